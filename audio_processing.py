@@ -0,0 +1,88 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+
+from config import Config
+from utils.audio import recognition_signature
+from utils.logger import setup_logger
+from utils.metrics import AUDIO_PROCESSING_BYTES, AUDIO_PROCESSING_LATENCY
+from utils.tracing import tracer
+
+logger = setup_logger(__name__)
+
+class AudioProcessor:
+    """Обработка аудио в пуле процессов.
+    
+    Декодирование и пересэмплирование занимают процессор на сотни
+    миллисекунд, поэтому выполняются в отдельных процессах, а не в цикле
+    событий. Одновременно в пул отправляется не больше задач, чем в нем
+    процессов, остальные ждут своей очереди.
+    """
+    
+    # Пул процессов общий для всех экземпляров
+    pool: Optional[ProcessPoolExecutor] = None
+    semaphore: Optional[asyncio.Semaphore] = None
+    
+    def __init__(self):
+        self.config = Config()
+        
+        if AudioProcessor.semaphore is None:
+            AudioProcessor.semaphore = asyncio.Semaphore(self.config.AUDIO_WORKERS)
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Возвращает пул процессов, запуская его при первом обращении"""
+        if AudioProcessor.pool is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения бота
+            AudioProcessor.pool = ProcessPoolExecutor(
+                max_workers=self.config.AUDIO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Пул обработки аудио запущен: {self.config.AUDIO_WORKERS} процессов")
+        return AudioProcessor.pool
+    
+    async def run(self, task: str, func: Callable, *args) -> Any:
+        """Выполняет func(*args) в пуле процессов"""
+        async with self.semaphore:
+            pool = self._get_pool()
+            try:
+                with tracer.span(f"audio.{task}"), AUDIO_PROCESSING_LATENCY.time(task=task):
+                    return await asyncio.get_running_loop().run_in_executor(
+                        pool, functools.partial(func, *args)
+                    )
+            except BrokenProcessPool:
+                # Упавший процесс ломает весь пул, следующая задача запустит новый
+                logger.error(f"Пул обработки аудио сломан, перезапускаю: {task}")
+                if AudioProcessor.pool is pool:
+                    AudioProcessor.pool = None
+                    pool.shutdown(wait=False)
+                raise
+    
+    async def prepare_for_recognition(self, audio_data: bytes) -> Optional[Tuple[str, int]]:
+        """Сигнатура самого громкого фрагмента клипа для Shazam.
+        
+        Возвращает URI сигнатуры и длину фрагмента в миллисекундах
+        или None, если клип слишком короткий для распознавания.
+        """
+        prepared = await self.run(
+            "recognition",
+            recognition_signature,
+            audio_data,
+            self.config.RECOGNITION_CLIP_SECONDS
+        )
+        
+        AUDIO_PROCESSING_BYTES.inc(len(audio_data), task="recognition", stage="input")
+        if prepared is not None:
+            AUDIO_PROCESSING_BYTES.inc(len(prepared[0]), task="recognition", stage="output")
+        
+        return prepared
+    
+    @classmethod
+    async def shutdown(cls):
+        """Останавливает пул процессов"""
+        if cls.pool is not None:
+            pool, cls.pool = cls.pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+            logger.info("Пул обработки аудио остановлен")
@@ -0,0 +1,273 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import re
+import time
+import wave
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+from aiohttp import web
+from shazamio import Shazam
+
+# Размер блока, которым отдается аудио
+CHUNK_SIZE = 64 * 1024
+
+# Размер обложки, которую отдает сервер аудио
+COVER_SIZE = 40 * 1024
+
+# Частота голосовых клипов заглушки Telegram
+VOICE_SAMPLE_RATE = 8000
+
+class FakeVkAudio:
+    """Замена vk_api.audio.VkAudio с настраиваемой задержкой и размером выдачи"""
+    
+    def __init__(self, audio_base_url: str, latency: float = 0.2, results: int = 6):
+        self.audio_base_url = audio_base_url
+        self.latency = latency
+        self.results = results
+        self.user_id = 1
+        self.convert_m3u8_links = True
+        self.calls = 0
+    
+    def track(self, owner_id: int, audio_id: int) -> Dict:
+        return {
+            'owner_id': owner_id,
+            'id': audio_id,
+            'artist': f"Artist {owner_id}",
+            'title': f"Track {audio_id}",
+            'duration': 180,
+            'url': f"{self.audio_base_url}/audio/{owner_id}_{audio_id}.mp3",
+            # Обложка общая для всех треков исполнителя, как у альбома
+            'track_covers': [f"{self.audio_base_url}/cover/{owner_id}.jpg"],
+        }
+    
+    def search(self, query: str, count: int = 6, offset: int = 0) -> Iterator[Dict]:
+        # vk_api работает синхронно, поэтому и задержка блокирующая
+        self.calls += 1
+        time.sleep(self.latency)
+        owner_id = abs(hash(query)) % 100000 + 1
+        for audio_id in range(offset, offset + min(count, self.results)):
+            yield self.track(owner_id, audio_id + 1)
+    
+    def get_audio_by_id(self, owner_id: int, audio_id: int) -> Dict:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.track(owner_id, audio_id)
+
+class FakeVkSession:
+    """Замена vk_api.VkApi: отдает страницы аудиозаписей для сбора хэшей"""
+    
+    def __init__(self, latency: float = 0.05):
+        self.http = SimpleNamespace(get=self._get)
+        self.latency = latency
+    
+    def _get(self, url: str, **kwargs):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=url)
+
+class FakeAudioModule:
+    """Замена функций модуля vk_api.audio, которыми пользуется VKClient"""
+    
+    def __init__(self, vk_audio: FakeVkAudio, batch_latency: float = 0.2):
+        self.vk_audio = vk_audio
+        self.batch_latency = batch_latency
+    
+    @staticmethod
+    def scrap_ids_from_html(html: str, filter_root_el=None) -> List[tuple]:
+        match = re.search(r"audio(-?\d+)_(\d+)", html)
+        if not match:
+            return []
+        return [(match.group(1), match.group(2), "access", "hash")]
+    
+    def scrap_tracks(self, ids, user_id, http=None, convert_m3u8_links=True) -> Iterator[Dict]:
+        # VK отдает треки пачками по 10 за один запрос
+        for start in range(0, len(ids), 10):
+            time.sleep(self.batch_latency)
+            for owner_id, audio_id, *_ in ids[start:start + 10]:
+                yield self.vk_audio.track(int(owner_id), int(audio_id))
+
+class FakeShazam(Shazam):
+    """shazamio.Shazam, который вместо запроса к Shazam ждет latency секунд.
+    
+    Запрос собирается настоящим кодом клиента, подменен только HTTP вызов.
+    """
+    
+    def __init__(self, latency: float = 1.0):
+        super().__init__()
+        self.latency = latency
+    
+    async def request(self, method: str, url: str, *args, **kwargs) -> Dict:
+        await asyncio.sleep(self.latency)
+        return {
+            'matches': [{'id': '1'}],
+            'track': {'title': "Recognized", 'subtitle': "Artist"},
+        }
+
+class AudioServer:
+    """Локальный сервер, отдающий MP3 файлы с ограниченной скоростью"""
+    
+    def __init__(self, track_size: int = 5 * 1024 * 1024, bandwidth: Optional[int] = None):
+        self.track_size = track_size
+        self.bandwidth = bandwidth
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+        self._payload = os.urandom(CHUNK_SIZE)
+    
+    async def handle_audio(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        response.content_length = self.track_size
+        await response.prepare(request)
+        
+        sent = 0
+        while sent < self.track_size:
+            chunk = self._payload[:min(CHUNK_SIZE, self.track_size - sent)]
+            await response.write(chunk)
+            sent += len(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        
+        await response.write_eof()
+        return response
+    
+    async def handle_cover(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._payload[:COVER_SIZE], content_type="image/jpeg")
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/audio/{name}", self.handle_audio)
+        app.router.add_get("/cover/{name}", self.handle_cover)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+class TelegramStub:
+    """Заглушка Telegram Bot API с настраиваемой задержкой.
+    
+    Запоминает отправленные тексты, чтобы бенчмарк мог отличить
+    успешные ответы от сообщений об ошибках.
+    """
+    
+    def __init__(self, latency: float = 0.05, voice_seconds: float = 10):
+        self.latency = latency
+        self.voice_seconds = voice_seconds
+        self.url = ""
+        self.calls: Dict[str, int] = {}
+        self.texts: List[str] = []
+        # Последняя кнопка листания результатов поиска в каждом чате
+        self.search_pages: Dict[int, str] = {}
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+    
+    def _message(self, chat_id, **extra) -> Dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            **extra,
+        }
+    
+    def _audio(self, params: Dict) -> Dict:
+        file_id = params.get('audio')
+        if not isinstance(file_id, str) or file_id.startswith("attach://"):
+            file_id = f"file-{next(self._message_ids)}"
+        return {'file_id': file_id, 'file_unique_id': f"u{file_id}", 'duration': 180}
+    
+    async def _read_params(self, request: web.Request) -> Dict:
+        params = {}
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                data = await part.read()
+                if part.filename:
+                    self.uploaded_bytes += len(data)
+                    params[part.name] = f"attach://{part.name}"
+                else:
+                    params[part.name] = data.decode("utf-8")
+        else:
+            params = dict(await request.post())
+        return params
+    
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self._read_params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+        
+        chat_id = params.get('chat_id', 0)
+        self._remember_search_page(chat_id, params.get('reply_markup'))
+        if method in ("sendMessage", "editMessageText"):
+            self.texts.append(params.get('text', ""))
+            result = self._message(chat_id, text=params.get('text', ""))
+        elif method == "sendAudio":
+            result = self._message(chat_id, audio=self._audio(params))
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get('media', "[]"))
+            result = [
+                self._message(chat_id, audio=self._audio({'audio': item.get('media')}))
+                for item in media
+            ]
+        elif method == "getFile":
+            file_id = params.get('file_id')
+            result = {
+                'file_id': file_id,
+                'file_unique_id': f"u{file_id}",
+                'file_path': f"voice/{file_id}.ogg",
+            }
+        else:
+            # deleteMessage, answerCallbackQuery, setMyCommands и прочие
+            result = True
+        
+        return web.json_response({'ok': True, 'result': result})
+    
+    def _remember_search_page(self, chat_id, reply_markup: Optional[str]):
+        if not reply_markup:
+            return
+        for row in json.loads(reply_markup).get('inline_keyboard', []):
+            for button in row:
+                if button.get('callback_data', "").startswith("search_page:"):
+                    self.search_pages[int(chat_id)] = button['callback_data']
+    
+    async def handle_file(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self._voice())
+    
+    def _voice(self) -> bytes:
+        """Случайный WAV клип: разные загрузки различаются по хэшу"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as clip:
+            clip.setnchannels(1)
+            clip.setsampwidth(2)
+            clip.setframerate(VOICE_SAMPLE_RATE)
+            clip.writeframes(os.urandom(int(VOICE_SAMPLE_RATE * self.voice_seconds) * 2))
+        return buffer.getvalue()
+    
+    @property
+    def errors(self) -> int:
+        """Количество сообщений об ошибках, отправленных пользователям"""
+        return sum(1 for text in self.texts if text.startswith(("❌", "⏳", "😔", "⚠️")))
+    
+    async def start(self):
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,319 @@
+"""Нагрузочный генератор: поток синтетических обновлений в диспетчер.
+
+Обновления приходят с заданной частотой (пуассоновский поток) от многих
+пользователей и смешивают текстовый поиск, нажатия кнопок, callback
+запросы download: и search_page: и голосовые сообщения. Частота растет
+ступенями, пока бот не перестает успевать. Для каждой ступени
+измеряются задержка обработки от прихода обновления, задержка цикла
+событий и стоимость операций хранилища FSM.
+
+Запуск:
+    python -m benchmarks.replay --rates 10 25 50 100 --step-duration 20 --users 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.run import (
+    RESULTS_DIR, ROOT, BenchmarkEnvironment, _prepare_environment, git_revision, max_rss, summarize
+)
+
+# Доли типов обновлений в потоке
+DEFAULT_MIX = {
+    'search': 0.4,
+    'button': 0.1,
+    'download': 0.3,
+    'search_page': 0.1,
+    'voice': 0.1,
+}
+
+# Операции хранилища FSM, время которых измеряется
+FSM_OPERATIONS = (
+    "get_state", "get_data", "set_state", "set_data", "update_data", "reset_state", "finish", "flush"
+)
+
+# Как часто проверяется задержка цикла событий (сек)
+LOOP_LAG_INTERVAL = 0.05
+
+class LoopLagMonitor:
+    """Измеряет, насколько позже запланированного просыпается цикл событий"""
+    
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+    
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    def collect(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+class FSMProfiler:
+    """Подменяет методы хранилища FSM обертками, которые считают их время"""
+    
+    def __init__(self, storage):
+        self.timings: Dict[str, List[float]] = {}
+        for name in FSM_OPERATIONS:
+            method = getattr(storage, name, None)
+            if method is not None:
+                setattr(storage, name, self._wrap(name, method))
+    
+    def _wrap(self, name: str, method):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.timings.setdefault(name, []).append(time.perf_counter() - started)
+        return wrapper
+    
+    def collect(self) -> Dict[str, Dict]:
+        timings, self.timings = self.timings, {}
+        return {
+            name: {'calls': len(values), 'total_ms': round(sum(values) * 1000, 2), **summarize(values)}
+            for name, values in sorted(timings.items())
+        }
+
+class ReplayGenerator:
+    """Создает обновления по заданной смеси и отправляет их в диспетчер"""
+    
+    def __init__(self, env: BenchmarkEnvironment, args: argparse.Namespace):
+        self.env = env
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.kinds = list(DEFAULT_MIX)
+        self.weights = [DEFAULT_MIX[kind] for kind in self.kinds]
+        self.semaphore = asyncio.Semaphore(args.max_concurrency)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.latencies: List[float] = []
+        self.by_kind: Dict[str, List[float]] = {}
+        self.failures = 0
+        self.closing = False
+        self._tasks = set()
+    
+    def _user_id(self) -> int:
+        # Часть пользователей активнее остальных
+        return 1000 + int(self.random.paretovariate(1.2)) % self.args.users
+    
+    def _query(self) -> str:
+        return f"replay query {int(self.random.paretovariate(1.0)) % self.args.queries}"
+    
+    def _track_id(self) -> str:
+        index = int(self.random.paretovariate(1.0)) % self.args.tracks + 1
+        return f"{index}_{index}"
+    
+    def make_update(self, kind: str, user_id: int) -> Dict:
+        env = self.env
+        if kind == "search":
+            return env.text_update(self._query(), user_id)
+        if kind == "button":
+            return env.text_update("🔍 Поиск музыки", user_id)
+        if kind == "download":
+            return env.callback_update(f"download:{self._track_id()}", user_id)
+        if kind == "search_page":
+            # Листать можно только результаты, которые пользователь уже получил
+            data = env.telegram.search_pages.get(user_id)
+            if data is None:
+                return env.text_update(self._query(), user_id)
+            return env.callback_update(data, user_id)
+        # Популярные клипы пересылают многие пользователи
+        return env.voice_update(f"clip-{self._track_id()}", user_id)
+    
+    def submit(self, kind: str, user_id: Optional[int] = None):
+        """Обновление пришло: обработка начнется, как только освободится слот"""
+        user_id = user_id or self._user_id()
+        task = asyncio.ensure_future(self._handle(kind, user_id, time.perf_counter()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _handle(self, kind: str, user_id: int, arrived: float):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            # Как и webhook сервер, ограничиваем число одновременных обновлений
+            async with self.semaphore:
+                await self.env.process(self.make_update(kind, user_id))
+        except Exception as e:
+            self.failures += 1
+            print(f"[{kind}] ошибка обработки: {e}", file=sys.stderr)
+        finally:
+            self.in_flight -= 1
+            latency = time.perf_counter() - arrived
+            self.latencies.append(latency)
+            self.by_kind.setdefault(kind, []).append(latency)
+        
+        if kind == "button":
+            # После кнопки поиска пользователь вводит запрос в состоянии FSM
+            await asyncio.sleep(self.args.think_time)
+            if not self.closing:
+                self.submit("search", user_id)
+    
+    async def run_step(self, rate: float, duration: float) -> int:
+        """Подает обновления с частотой rate в течение duration секунд"""
+        submitted = 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        next_arrival = loop.time()
+        while True:
+            next_arrival += self.random.expovariate(rate)
+            if next_arrival >= deadline:
+                break
+            await asyncio.sleep(max(0.0, next_arrival - loop.time()))
+            self.submit(self.random.choices(self.kinds, self.weights)[0])
+            submitted += 1
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        return submitted
+    
+    async def drain(self, timeout: float):
+        """Дожидается обработки уже пришедших обновлений"""
+        self.closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._tasks and loop.time() < deadline:
+            await asyncio.wait(set(self._tasks), timeout=deadline - loop.time())
+    
+    def collect(self) -> Dict:
+        latencies, self.latencies = self.latencies, []
+        by_kind, self.by_kind = self.by_kind, {}
+        failures, self.failures = self.failures, 0
+        peak, self.peak_in_flight = self.peak_in_flight, self.in_flight
+        return {
+            'completed': len(latencies),
+            'failures': failures,
+            'peak_in_flight': peak,
+            'backlog': self.in_flight,
+            'latency_ms': summarize(latencies),
+            'latency_by_kind_ms': {kind: summarize(values) for kind, values in sorted(by_kind.items())},
+        }
+
+def is_saturated(step: Dict, args: argparse.Namespace) -> bool:
+    """Ступень считается насыщенной, если бот не успевает за потоком"""
+    return (
+        step['achieved_rate'] < step['offered_rate'] * 0.9
+        or step['latency_ms']['p95'] > args.slo_p95
+        or step['backlog'] > args.max_concurrency
+    )
+
+async def replay(args: argparse.Namespace) -> Dict:
+    env = BenchmarkEnvironment(args)
+    await env.start()
+    profiler = FSMProfiler(env.dp.storage)
+    monitor = LoopLagMonitor()
+    generator = ReplayGenerator(env, args)
+    monitor.start()
+    
+    steps = []
+    saturation_rate = None
+    try:
+        for rate in args.rates:
+            errors_before = env.telegram.errors
+            started = time.perf_counter()
+            submitted = await generator.run_step(rate, args.step_duration)
+            elapsed = time.perf_counter() - started
+            
+            step = {'offered_rate': rate, 'submitted': submitted, **generator.collect()}
+            step['achieved_rate'] = round(step['completed'] / elapsed, 2)
+            step['errors'] = step['failures'] + env.telegram.errors - errors_before
+            step['loop_lag_ms'] = summarize(monitor.collect())
+            step['fsm'] = profiler.collect()
+            step['max_rss_bytes'] = max_rss()
+            step['saturated'] = is_saturated(step, args)
+            steps.append(step)
+            
+            print(
+                f"{rate:>7.1f} upd/s: обработано {step['achieved_rate']:.1f}/s, "
+                f"p95 {step['latency_ms']['p95']} мс, p99 {step['latency_ms']['p99']} мс, "
+                f"лаг цикла p99 {step['loop_lag_ms']['p99']} мс, очередь {step['backlog']}"
+                + (" — насыщение" if step['saturated'] else "")
+            )
+            
+            if step['saturated']:
+                saturation_rate = rate
+                if not args.keep_going:
+                    break
+        
+        await generator.drain(args.step_duration)
+    finally:
+        await monitor.stop()
+        await env.stop()
+    
+    return {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'settings': {key: value for key, value in vars(args).items() if key != "output"},
+        'mix': DEFAULT_MIX,
+        'saturation_rate': saturation_rate,
+        'steps': steps,
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обновлений через диспетчер")
+    parser.add_argument("--rates", nargs="+", type=float, default=[5, 10, 25, 50, 100], help="ступени частоты, обновлений/сек")
+    parser.add_argument("--step-duration", type=float, default=20, help="длительность ступени, сек")
+    parser.add_argument("--users", type=int, default=1000, help="число пользователей")
+    parser.add_argument("--queries", type=int, default=500, help="число различных запросов")
+    parser.add_argument("--tracks", type=int, default=2000, help="число различных треков")
+    parser.add_argument("--think-time", type=float, default=2.0, help="пауза между кнопкой и запросом, сек")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="по умолчанию WEBHOOK_MAX_CONCURRENCY")
+    parser.add_argument("--slo-p95", type=float, default=5000, help="допустимая p95 задержка, мс")
+    parser.add_argument("--keep-going", action="store_true", help="не останавливаться после насыщения")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--vk-latency", type=float, default=0.2, help="задержка VK, сек")
+    parser.add_argument("--shazam-latency", type=float, default=1.0, help="задержка Shazam, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка Telegram, сек")
+    parser.add_argument("--track-size", type=int, default=5 * 1024 * 1024, help="размер трека, байт")
+    parser.add_argument("--bandwidth", type=int, default=0, help="скорость отдачи аудио, байт/сек (0 - без ограничения)")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию benchmarks/results/replay-<время>.json)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    output = Path(args.output).resolve() if args.output else (
+        RESULTS_DIR / f"replay-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    
+    with tempfile.TemporaryDirectory(prefix="bot-replay-") as workdir:
+        _prepare_environment(workdir)
+        sys.path.insert(0, str(ROOT))
+        
+        os.chdir(workdir)
+        if args.max_concurrency is None:
+            from config import Config
+            args.max_concurrency = Config().WEBHOOK_MAX_CONCURRENCY
+        
+        report = asyncio.run(replay(args))
+        os.chdir(ROOT)
+    
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Насыщение: {report['saturation_rate'] or 'не достигнуто'}")
+    print(f"Результаты сохранены в {output}")
+
+if __name__ == "__main__":
+    main()
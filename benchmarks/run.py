@@ -0,0 +1,342 @@
+"""Офлайн бенчмарк основных сценариев бота.
+
+Настоящие обработчики bot.py прогоняются через диспетчер aiogram, а VK,
+Shazam и Telegram заменены локальными заглушками с настраиваемой
+задержкой. Для каждого сценария считаются пропускная способность,
+перцентили задержки и пиковая память, результаты сохраняются в JSON.
+
+Запуск:
+    python -m benchmarks.run --flow search download --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+FLOWS = ("search", "download", "recognition", "album")
+
+# Лимиты частоты не должны влиять на измерения
+UNLIMITED = "1000000:1000000"
+
+def _prepare_environment(workdir: str):
+    """Переменные окружения для Config до импорта модулей бота"""
+    os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("VK_LOGIN", "benchmark")
+    os.environ.setdefault("VK_PASSWORD", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FILE", os.path.join(workdir, "logs", "bot.log"))
+    os.environ.setdefault("METRICS_PORT", "0")
+    for key in (
+        "SEARCH_RATE_LIMIT", "DOWNLOAD_RATE_LIMIT", "RECOGNITION_RATE_LIMIT",
+        "VK_RATE_LIMIT", "SHAZAM_RATE_LIMIT",
+        "TELEGRAM_RATE_LIMIT", "TELEGRAM_CHAT_RATE_LIMIT", "TELEGRAM_GROUP_RATE_LIMIT",
+    ):
+        os.environ.setdefault(key, UNLIMITED)
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Сводка задержек в миллисекундах"""
+    if not latencies:
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99': round(percentile(latencies, 0.99) * 1000, 2),
+        'max': round(max(latencies) * 1000, 2),
+    }
+
+def max_rss() -> int:
+    """Пиковый RSS процесса в байтах"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS в байтах
+    return usage if sys.platform == "darwin" else usage * 1024
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except Exception:
+        return None
+
+class BenchmarkEnvironment:
+    """Бот с настоящими обработчиками и заглушками внешних сервисов"""
+    
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.dp = None
+        self.telegram = None
+        self.audio_server = None
+        self._update_ids = itertools.count(1)
+        self._user_ids = itertools.count(1000)
+        self._albums = []
+    
+    async def start(self):
+        import aiohttp
+        from aiogram import Bot, Dispatcher, types
+        from aiogram.bot.api import TelegramAPIServer
+        
+        import bot as bot_module
+        import vk_client as vk_module
+        from benchmarks.fakes import (
+            AudioServer, FakeAudioModule, FakeShazam, FakeVkAudio, FakeVkSession, TelegramStub
+        )
+        from config import Config
+        from database import Database
+        from shazam_client import ShazamClient
+        from utils.storage import SQLiteStorage
+        from utils.outbound import ScheduledBot
+        
+        self.telegram = TelegramStub(latency=self.args.telegram_latency)
+        await self.telegram.start()
+        self.audio_server = AudioServer(
+            track_size=self.args.track_size,
+            bandwidth=self.args.bandwidth or None
+        )
+        await self.audio_server.start()
+        
+        config = Config()
+        bot = ScheduledBot(
+            token=config.BOT_TOKEN,
+            parse_mode=types.ParseMode.HTML,
+            server=TelegramAPIServer.from_base(self.telegram.url)
+        )
+        Bot.set_current(bot)
+        
+        db = Database()
+        await db.init_db()
+        storage = SQLiteStorage(
+            db=db,
+            ttl=config.FSM_TTL,
+            cache_ttl=config.FSM_CACHE_TTL,
+            flush_interval=config.FSM_FLUSH_INTERVAL
+        )
+        self.dp = Dispatcher(bot, storage=storage)
+        Dispatcher.set_current(self.dp)
+        bot_module.register_handlers(self.dp)
+        
+        # VK клиент без авторизации: vk_api заменен заглушками
+        fake_audio = FakeVkAudio(
+            self.audio_server.url,
+            latency=self.args.vk_latency,
+            results=config.SEARCH_BATCH_SIZE
+        )
+        vk_module.audio = FakeAudioModule(fake_audio, batch_latency=self.args.vk_latency)
+        vk = vk_module.VKClient()
+        vk.session = FakeVkSession(latency=self.args.vk_latency / 4)
+        vk.vk_audio = fake_audio
+        vk._http_session = aiohttp.ClientSession()
+        
+        shazam = ShazamClient()
+        shazam.shazam = FakeShazam(latency=self.args.shazam_latency)
+        
+        bot_module.vk_client = vk
+        bot_module.shazam_client = shazam
+        bot_module.db = db
+        self.bot_module = bot_module
+    
+    async def stop(self):
+        if self.dp:
+            await self.bot_module.on_shutdown(self.dp)
+            session = await self.dp.bot.get_session()
+            await session.close()
+        if self.audio_server:
+            await self.audio_server.stop()
+        if self.telegram:
+            await self.telegram.stop()
+    
+    def _user(self, user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': "Benchmark"}
+    
+    def _message(self, user_id: int, **content) -> Dict:
+        return {
+            'message_id': next(self._update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            **content,
+        }
+    
+    def text_update(self, text: str, user_id: Optional[int] = None) -> Dict:
+        user_id = user_id or next(self._user_ids)
+        return {'update_id': next(self._update_ids), 'message': self._message(user_id, text=text)}
+    
+    def voice_update(self, clip: str, user_id: Optional[int] = None) -> Dict:
+        user_id = user_id or next(self._user_ids)
+        voice = {'file_id': clip, 'file_unique_id': f"u{clip}", 'duration': 5}
+        return {'update_id': next(self._update_ids), 'message': self._message(user_id, voice=voice)}
+    
+    def callback_update(self, data: str, user_id: Optional[int] = None) -> Dict:
+        user_id = user_id or next(self._user_ids)
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': self._message(user_id, text="Выберите трек для скачивания:"),
+            },
+        }
+    
+    async def process(self, update: Dict):
+        """Прогоняет одно обновление через диспетчер"""
+        from aiogram import types
+        await self.dp.process_updates([types.Update(**update)])
+    
+    async def prepare(self, flow: str, requests: int):
+        """Готовит данные сценария до замера"""
+        if flow != "album":
+            return
+        
+        # Альбомы создаются в базе, а воспроизводятся кнопкой, как у пользователя
+        db = self.bot_module.db
+        self._albums = []
+        for album_index in range(requests):
+            user_id = next(self._user_ids)
+            album_id = await db.create_album(user_id, f"benchmark {album_index}")
+            for i in range(self.args.album_size):
+                track_id = f"{album_index + 1}_{i + 1}"
+                await db.save_track({'id': track_id, 'title': "Benchmark", 'artist': "Benchmark"})
+                await db.add_track_to_album(album_id, track_id)
+            self._albums.append((user_id, album_id))
+    
+    def make_job(self, flow: str, index: int):
+        """Корутина одного запроса сценария"""
+        if flow == "search":
+            return self.process(self.text_update(f"benchmark query {index}"))
+        if flow == "download":
+            return self.process(self.callback_update(f"download:{index + 1}_{index + 1}"))
+        if flow == "recognition":
+            # Каждый клип новый, чтобы измерять распознавание, а не кэш
+            return self.process(self.voice_update(f"voice-{index}"))
+        if flow == "album":
+            user_id, album_id = self._albums[index]
+            return self.process(self.callback_update(f"play_album:{album_id}", user_id))
+        raise ValueError(f"Неизвестный сценарий: {flow}")
+
+async def run_flow(env: BenchmarkEnvironment, flow: str, requests: int, concurrency: int) -> Dict:
+    """Выполняет requests запросов сценария не более concurrency одновременно"""
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    errors_before = env.telegram.errors
+    await env.prepare(flow, requests)
+    
+    async def one(index: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await env.make_job(flow, index)
+            except Exception as e:
+                failures += 1
+                print(f"[{flow}] ошибка запроса {index}: {e}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+    
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    
+    result = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': failures + env.telegram.errors - errors_before,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': summarize(latencies),
+        'max_rss_bytes': max_rss(),
+    }
+    if tracemalloc.is_tracing():
+        result['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    return result
+
+async def run(args: argparse.Namespace) -> Dict:
+    env = BenchmarkEnvironment(args)
+    await env.start()
+    try:
+        results = {}
+        for flow in args.flow:
+            requests = args.albums if flow == "album" else args.requests
+            results[flow] = await run_flow(env, flow, requests, args.concurrency)
+            print(f"{flow}: {json.dumps(results[flow], ensure_ascii=False)}")
+        telegram_calls = dict(env.telegram.calls)
+    finally:
+        await env.stop()
+    
+    return {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'settings': {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "flow")
+        },
+        'flows': results,
+        'telegram_calls': telegram_calls,
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк бота")
+    parser.add_argument("--flow", nargs="+", choices=FLOWS, default=list(FLOWS))
+    parser.add_argument("--requests", type=int, default=100, help="запросов на сценарий")
+    parser.add_argument("--albums", type=int, default=5, help="альбомов в сценарии album")
+    parser.add_argument("--album-size", type=int, default=25, help="треков в альбоме")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--vk-latency", type=float, default=0.2, help="задержка VK, сек")
+    parser.add_argument("--shazam-latency", type=float, default=1.0, help="задержка Shazam, сек")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка Telegram, сек")
+    parser.add_argument("--track-size", type=int, default=5 * 1024 * 1024, help="размер трека, байт")
+    parser.add_argument("--bandwidth", type=int, default=0, help="скорость отдачи аудио, байт/сек (0 - без ограничения)")
+    parser.add_argument("--trace-memory", action="store_true", help="считать пик памяти через tracemalloc (замедляет)")
+    parser.add_argument("--output", help="файл для результатов (по умолчанию benchmarks/results/<время>.json)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    output = Path(args.output).resolve() if args.output else (
+        RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    
+    # База данных, логи и кэши бота живут во временной директории
+    with tempfile.TemporaryDirectory(prefix="bot-benchmark-") as workdir:
+        _prepare_environment(workdir)
+        sys.path.insert(0, str(ROOT))
+        os.chdir(workdir)
+        
+        if args.trace_memory:
+            tracemalloc.start()
+        report = asyncio.run(run(args))
+        os.chdir(ROOT)
+    
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты сохранены в {output}")
+
+if __name__ == "__main__":
+    main()
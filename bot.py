@@ -1,445 +1,847 @@
-#!/usr/bin/env python
-import asyncio
-import logging
-import os
-import sys
-from pathlib import Path
-
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.utils import executor
-from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.dispatcher.filters import Command, Text
-
-from config import Config
-from vk_client import VKClient
-from shazam_client import ShazamClient
-from utils.logger import setup_logger
-
-# Настройка логирования
-logger = setup_logger(__name__)
-
-# Состояния бота
-class BotStates(StatesGroup):
-    waiting_for_search = State()
-    waiting_for_album_name = State()
-
-# Глобальные переменные
-vk_client = None
-shazam_client = None
-
-async def cmd_start(message: types.Message):
-    """Обработчик команды /start"""
-    user_name = message.from_user.first_name
-    
-    welcome_text = f"""
-🎵 <b>Добро пожаловать, {user_name}!</b>
-
-Я помогу вам найти и скачать музыку из ВКонтакте.
-
-<b>Что я умею:</b>
-🔍 Искать музыку по названию
-🎤 Распознавать музыку из голосовых сообщений
-⬇️ Скачивать музыку в высоком качестве
-
-<b>Как пользоваться:</b>
-• Отправьте название песни или исполнителя
-• Запишите голосовое сообщение с музыкой
-• Используйте команды из меню
-
-Начните с поиска музыки! 🎶
-    """
-    
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(
-        types.KeyboardButton("🔍 Поиск музыки"),
-        types.KeyboardButton("❓ Помощь")
-    )
-    
-    await message.answer(welcome_text, reply_markup=keyboard)
-    logger.info(f"Пользователь {message.from_user.id} запустил бота")
-
-async def cmd_help(message: types.Message):
-    """Обработчик команды /help"""
-    help_text = """
-<b>📖 Справка по командам:</b>
-
-/start - Запустить бота
-/search - Поиск музыки
-/help - Показать эту справку
-
-<b>🎵 Поиск музыки:</b>
-• Просто отправьте название песни
-• Используйте формат "Исполнитель - Название"
-• Отправьте голосовое сообщение для распознавания
-
-<b>🔧 Дополнительно:</b>
-• Бот поддерживает высокое качество аудио
-• Автоматическое распознавание через Shazam
-• Быстрая загрузка и отправка файлов
-
-Если возникли проблемы, попробуйте команду /start
-    """
-    
-    await message.answer(help_text)
-
-async def cmd_search(message: types.Message):
-    """Обработчик команды /search"""
-    await message.answer(
-        "🔍 <b>Поиск музыки</b>\n\n"
-        "Отправьте название песни или исполнителя:",
-        reply_markup=types.ReplyKeyboardMarkup(
-            keyboard=[[types.KeyboardButton("❌ Отмена")]],
-            resize_keyboard=True
-        )
-    )
-    await BotStates.waiting_for_search.set()
-
-async def process_search_query(message: types.Message, state: FSMContext):
-    """Обработка поискового запроса"""
-    if message.text == "❌ Отмена":
-        await state.finish()
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(
-            types.KeyboardButton("🔍 Поиск музыки"),
-            types.KeyboardButton("❓ Помощь")
-        )
-        await message.answer("Поиск отменен", reply_markup=keyboard)
-        return
-    
-    query = message.text.strip()
-    if not query:
-        await message.answer("Пожалуйста, введите корректный запрос")
-        return
-    
-    await handle_search(message, query)
-    await state.finish()
-
-async def handle_search(message: types.Message, query: str):
-    """Обработка поиска музыки"""
-    # Показываем индикатор загрузки
-    search_msg = await message.answer("🔍 Ищу музыку...")
-    
-    try:
-        global vk_client
-        if not vk_client:
-            await search_msg.edit_text("❌ VK клиент не инициализирован")
-            return
-            
-        results = await vk_client.search_audio(query, page=0)
-        
-        if not results:
-            await search_msg.edit_text(
-                "😔 Ничего не найдено.\n"
-                "Попробуйте изменить запрос или проверить правописание."
-            )
-            return
-        
-        # Создаем клавиатуру с результатами
-        keyboard = types.InlineKeyboardMarkup(row_width=1)
-        
-        for i, track in enumerate(results[:6]):  # Показываем первые 6 результатов
-            track_text = f"🎵 {track['artist']} - {track['title']}"
-            if len(track_text) > 60:
-                track_text = track_text[:57] + "..."
-            
-            keyboard.add(
-                types.InlineKeyboardButton(
-                    track_text,
-                    callback_data=f"download:{track['id']}"
-                )
-            )
-        
-        await search_msg.edit_text(
-            f"🎵 <b>Результаты поиска:</b> {query}\n"
-            f"Найдено: {len(results)} треков"
-        )
-        
-        await message.answer(
-            "Выберите трек для скачивания:",
-            reply_markup=keyboard
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка поиска: {e}")
-        await search_msg.edit_text(
-            "❌ Произошла ошибка при поиске.\n"
-            "Попробуйте позже."
-        )
-
-async def handle_text_search(message: types.Message):
-    """Обработка текстового поиска без команды"""
-    # Проверяем, что это не команда и не кнопка
-    if message.text.startswith('/') or message.text in ["🔍 Поиск музыки", "❓ Помощь", "❌ Отмена"]:
-        return
-    
-    query = message.text.strip()
-    await handle_search(message, query)
-
-async def handle_voice_message(message: types.Message):
-    """Обработка голосовых сообщений для распознавания музыки"""
-    processing_msg = await message.answer("🎤 Распознаю музыку...")
-    
-    try:
-        # Скачиваем голосовое сообщение
-        file_info = await message.bot.get_file(message.voice.file_id)
-        file_data = await message.bot.download_file(file_info.file_path)
-        
-        # Распознаем через Shazam
-        await processing_msg.edit_text("🔍 Анализирую аудио...")
-        
-        global shazam_client
-        if not shazam_client:
-            await processing_msg.edit_text("❌ Shazam клиент не инициализирован")
-            return
-            
-        recognition_result = await shazam_client.recognize(file_data.read())
-        
-        if not recognition_result or not recognition_result.get('matches'):
-            await processing_msg.edit_text(
-                "😔 Не удалось распознать музыку.\n"
-                "Попробуйте записать более четкое голосовое сообщение."
-            )
-            return
-        
-        # Получаем информацию о треке
-        track_info = recognition_result.get('track', {})
-        title = track_info.get('title', '')
-        artist = track_info.get('subtitle', '')
-        
-        if not title or not artist:
-            await processing_msg.edit_text(
-                "😔 Не удалось получить информацию о треке."
-            )
-            return
-        
-        # Формируем поисковый запрос
-        query = f"{artist} - {title}"
-        
-        await processing_msg.edit_text(
-            f"✅ Распознано: <b>{query}</b>\n"
-            "🔍 Ищу в ВКонтакте..."
-        )
-        
-        # Ищем в VK
-        global vk_client
-        results = await vk_client.search_audio(query, page=0)
-        
-        if not results:
-            await processing_msg.edit_text(
-                f"✅ Распознано: <b>{query}</b>\n"
-                "😔 К сожалению, не найдено в ВКонтакте."
-            )
-            return
-        
-        # Показываем результаты
-        keyboard = types.InlineKeyboardMarkup(row_width=1)
-        
-        for track in results[:3]:  # Показываем первые 3 результата
-            track_text = f"🎵 {track['artist']} - {track['title']}"
-            if len(track_text) > 60:
-                track_text = track_text[:57] + "..."
-            
-            keyboard.add(
-                types.InlineKeyboardButton(
-                    track_text,
-                    callback_data=f"download:{track['id']}"
-                )
-            )
-        
-        await processing_msg.edit_text(
-            f"✅ Распознано: <b>{query}</b>\n"
-            f"🎵 Найдено: {len(results)} треков"
-        )
-        
-        await message.answer(
-            "Выберите нужный трек:",
-            reply_markup=keyboard
-        )
-        
-        logger.info(f"Пользователь {message.from_user.id} распознал: {query}")
-        
-    except Exception as e:
-        logger.error(f"Ошибка распознавания: {e}")
-        await processing_msg.edit_text(
-            "❌ Произошла ошибка при распознавании.\n"
-            "Попробуйте позже."
-        )
-
-async def handle_download_track(callback_query: types.CallbackQuery):
-    """Обработка скачивания трека"""
-    await callback_query.answer()
-    
-    # Извлекаем ID трека из callback_data
-    track_id = callback_query.data.split(':')[1]
-    
-    # Показываем индикатор загрузки
-    loading_msg = await callback_query.message.answer("⬇️ Скачиваю трек...")
-    
-    try:
-        global vk_client
-        track_info = await vk_client.get_track_by_id(track_id)
-        
-        if not track_info:
-            await loading_msg.edit_text("❌ Трек не найден")
-            return
-        
-        # Скачиваем аудио
-        await loading_msg.edit_text("📥 Загружаю аудио файл...")
-        audio_data = await vk_client.download_audio(track_info['url'])
-        
-        # Скачиваем обложку (если есть)
-        thumb_data = None
-        if track_info.get('thumb_url'):
-            try:
-                thumb_data = await vk_client.download_cover(track_info['thumb_url'])
-            except:
-                pass
-        
-        # Отправляем аудио
-        await loading_msg.edit_text("📤 Отправляю...")
-        
-        await callback_query.message.answer_audio(
-            audio_data,
-            duration=track_info.get('duration', 0),
-            performer=track_info['artist'],
-            title=track_info['title'],
-            thumb=thumb_data.getvalue() if thumb_data else None
-        )
-        
-        await loading_msg.delete()
-        
-        logger.info(f"Пользователь {callback_query.from_user.id} скачал трек {track_id}")
-        
-    except Exception as e:
-        logger.error(f"Ошибка скачивания трека: {e}")
-        await loading_msg.edit_text(
-            "❌ Произошла ошибка при скачивании.\n"
-            "Попробуйте позже."
-        )
-
-async def handle_button_press(message: types.Message):
-    """Обработка нажатий кнопок"""
-    if message.text == "🔍 Поиск музыки":
-        await cmd_search(message)
-    elif message.text == "❓ Помощь":
-        await cmd_help(message)
-
-async def set_bot_commands(bot: Bot):
-    """Устанавливает меню команд бота"""
-    commands = [
-        types.BotCommand(command="start", description="🎵 Запустить бота"),
-        types.BotCommand(command="search", description="🔍 Поиск музыки"),
-        types.BotCommand(command="help", description="❓ Помощь"),
-    ]
-    
-    await bot.set_my_commands(commands)
-    logger.info("Команды бота установлены")
-
-async def on_startup(dp: Dispatcher):
-    """Выполняется при запуске бота"""
-    logger.info("Бот запускается...")
-    
-    # Устанавливаем команды
-    await set_bot_commands(dp.bot)
-    
-    # Инициализируем VK клиент
-    global vk_client, shazam_client
-    try:
-        vk_client = VKClient()
-        await vk_client.init()
-        logger.info("VK клиент инициализирован")
-    except Exception as e:
-        logger.error(f"Ошибка инициализации VK клиента: {e}")
-    
-    # Инициализируем Shazam клиент
-    try:
-        shazam_client = ShazamClient()
-        logger.info("Shazam клиент инициализирован")
-    except Exception as e:
-        logger.error(f"Ошибка инициализации Shazam клиента: {e}")
-    
-    logger.info("Бот успешно запущен!")
-
-async def on_shutdown(dp: Dispatcher):
-    """Выполняется при остановке бота"""
-    logger.info("Бот останавливается...")
-    
-    # Закрываем соединения
-    global vk_client
-    if vk_client:
-        await vk_client.close()
-    
-    await dp.storage.close()
-    await dp.storage.wait_closed()
-    
-    logger.info("Бот остановлен")
-
-def register_handlers(dp: Dispatcher):
-    """Регистрирует все обработчики"""
-    # Команды
-    dp.register_message_handler(cmd_start, Command("start"))
-    dp.register_message_handler(cmd_help, Command("help"))
-    dp.register_message_handler(cmd_search, Command("search"))
-    
-    # Состояния
-    dp.register_message_handler(
-        process_search_query, 
-        state=BotStates.waiting_for_search
-    )
-    
-    # Callback запросы
-    dp.register_callback_query_handler(
-        handle_download_track,
-        Text(startswith="download:")
-    )
-    
-    # Голосовые сообщения
-    dp.register_message_handler(
-        handle_voice_message,
-        content_types=types.ContentType.VOICE
-    )
-    
-    # Кнопки
-    dp.register_message_handler(
-        handle_button_press,
-        Text(equals=["🔍 Поиск музыки", "❓ Помощь"])
-    )
-    
-    # Текстовые сообщения (поиск)
-    dp.register_message_handler(
-        handle_text_search,
-        content_types=types.ContentType.TEXT
-    )
-
-def main():
-    """Главная функция запуска бота"""
-    try:
-        # Загружаем конфигурацию
-        config = Config()
-        logger.info("Конфигурация загружена")
-        
-        # Создаем бота и диспетчер
-        bot = Bot(token=config.BOT_TOKEN, parse_mode=types.ParseMode.HTML)
-        storage = MemoryStorage()
-        dp = Dispatcher(bot, storage=storage)
-        
-        # Регистрируем обработчики
-        register_handlers(dp)
-        logger.info("Обработчики зарегистрированы")
-        
-        # Запускаем бота
-        executor.start_polling(
-            dp,
-            skip_updates=True,
-            on_startup=on_startup,
-            on_shutdown=on_shutdown
-        )
-        
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
-        sys.exit(1)
-
-if __name__ == '__main__':
-    main()
+#!/usr/bin/env python
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.utils import executor
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.dispatcher.filters import Command, Text
+from aiogram.utils.exceptions import BadRequest
+
+from config import Config
+from database import Database
+from downloader import download_coordinator
+from vk_client import VKClient, DownloadTooLargeError
+from shazam_client import ShazamClient
+from audio_processing import AudioProcessor
+from webhook import WebhookServer
+from workers import Supervisor
+from utils.logger import setup_logger, configure_logging
+from utils.circuit_breaker import ServiceUnavailableError
+from utils.keyboards import (
+    get_main_keyboard,
+    get_track_actions_keyboard,
+    get_albums_keyboard,
+    get_albums_selection_keyboard,
+    get_album_keyboard,
+    get_search_results_keyboard,
+)
+from utils.metrics import MetricsMiddleware, MetricsServer
+from utils.outbound import ScheduledBot, progress_update
+from utils.tracing import TracingMiddleware, tracer
+from utils.storage import SQLiteStorage
+from utils.throttling import (
+    ThrottlingMiddleware,
+    rate_limit,
+    ACTION_SEARCH,
+    ACTION_DOWNLOAD,
+    ACTION_RECOGNITION,
+)
+
+# Настройка логирования
+logger = setup_logger(__name__)
+
+# Состояния бота
+class BotStates(StatesGroup):
+    waiting_for_search = State()
+    waiting_for_album_name = State()
+
+# Глобальные переменные
+vk_client = None
+shazam_client = None
+db = None
+metrics_server = None
+
+async def cmd_start(message: types.Message):
+    """Обработчик команды /start"""
+    user_name = message.from_user.first_name
+    
+    welcome_text = f"""
+🎵 <b>Добро пожаловать, {user_name}!</b>
+
+Я помогу вам найти и скачать музыку из ВКонтакте.
+
+<b>Что я умею:</b>
+🔍 Искать музыку по названию
+🎤 Распознавать музыку из голосовых сообщений
+📁 Создавать альбомы для сохранения треков
+⬇️ Скачивать музыку в высоком качестве
+
+<b>Как пользоваться:</b>
+• Отправьте название песни или исполнителя
+• Запишите голосовое сообщение с музыкой
+• Используйте команды из меню
+
+Начните с поиска музыки! 🎶
+    """
+    
+    await message.answer(welcome_text, reply_markup=get_main_keyboard())
+    logger.info(f"Пользователь {message.from_user.id} запустил бота", extra={'sampled': True})
+
+async def cmd_help(message: types.Message):
+    """Обработчик команды /help"""
+    help_text = """
+<b>📖 Справка по командам:</b>
+
+/start - Запустить бота
+/search - Поиск музыки
+/albums - Управление альбомами
+/help - Показать эту справку
+
+<b>🎵 Поиск музыки:</b>
+• Просто отправьте название песни
+• Используйте формат "Исполнитель - Название"
+• Отправьте голосовое сообщение для распознавания
+
+<b>📁 Альбомы:</b>
+• Создавайте альбомы для организации музыки
+• Добавляйте треки в альбомы одним нажатием
+• Слушайте целые альбомы
+
+<b>🔧 Дополнительно:</b>
+• Бот поддерживает высокое качество аудио
+• Автоматическое распознавание через Shazam
+• Быстрая загрузка и отправка файлов
+
+Если возникли проблемы, попробуйте команду /start
+    """
+    
+    await message.answer(help_text)
+
+async def cmd_search(message: types.Message):
+    """Обработчик команды /search"""
+    await message.answer(
+        "🔍 <b>Поиск музыки</b>\n\n"
+        "Отправьте название песни или исполнителя:",
+        reply_markup=types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton("❌ Отмена")]],
+            resize_keyboard=True
+        )
+    )
+    await BotStates.waiting_for_search.set()
+
+@rate_limit(ACTION_SEARCH)
+async def process_search_query(message: types.Message, state: FSMContext):
+    """Обработка поискового запроса"""
+    if message.text == "❌ Отмена":
+        await state.finish()
+        await message.answer("Поиск отменен", reply_markup=get_main_keyboard())
+        return
+    
+    query = message.text.strip()
+    if not query:
+        await message.answer("Пожалуйста, введите корректный запрос")
+        return
+    
+    await handle_search(message, query)
+    await state.finish()
+
+async def handle_search(message: types.Message, query: str):
+    """Обработка поиска музыки"""
+    # Показываем индикатор загрузки
+    search_msg = await message.answer("🔍 Ищу музыку...")
+    
+    try:
+        global vk_client
+        if not vk_client:
+            await search_msg.edit_text("❌ VK клиент не инициализирован")
+            return
+            
+        # Результаты сохраняются в сессию, страницы листаются без запросов к VK
+        session = await vk_client.create_search_session(query)
+        
+        if not session:
+            await search_msg.edit_text(
+                "😔 Ничего не найдено.\n"
+                "Попробуйте изменить запрос или проверить правописание."
+            )
+            return
+        
+        # Создаем клавиатуру с первой страницей результатов
+        results = session['results']
+        keyboard = get_search_results_keyboard(
+            results, session['id'], 0, vk_client.config.RESULTS_PER_PAGE
+        )
+        
+        await search_msg.edit_text(
+            f"🎵 <b>Результаты поиска:</b> {query}\n"
+            f"Найдено: {len(results)} треков"
+        )
+        
+        await message.answer(
+            "Выберите трек для скачивания:",
+            reply_markup=keyboard
+        )
+        
+    except ServiceUnavailableError as e:
+        logger.warning(f"Сервис недоступен: {e}")
+        await search_msg.edit_text(
+            "⏳ Поиск временно недоступен: ВКонтакте не отвечает.\n"
+            "Попробуйте через пару минут."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка поиска: {e}")
+        await search_msg.edit_text(
+            "❌ Произошла ошибка при поиске.\n"
+            "Попробуйте позже."
+        )
+
+@rate_limit(ACTION_SEARCH)
+async def handle_text_search(message: types.Message):
+    """Обработка текстового поиска без команды"""
+    # Проверяем, что это не команда и не кнопка
+    if message.text.startswith('/') or message.text in ["🔍 Поиск музыки", "📁 Мои альбомы", "❓ Помощь", "❌ Отмена"]:
+        return
+    
+    query = message.text.strip()
+    await handle_search(message, query)
+
+@rate_limit(ACTION_RECOGNITION)
+async def handle_voice_message(message: types.Message):
+    """Обработка голосовых сообщений для распознавания музыки"""
+    processing_msg = await message.answer("🎤 Распознаю музыку...")
+    
+    try:
+        voice = message.voice or message.audio
+        
+        async def download() -> bytes:
+            # Скачиваем голосовое сообщение, если его нет в кэше распознавания
+            file_info = await message.bot.get_file(voice.file_id)
+            file_data = await message.bot.download_file(file_info.file_path)
+            with progress_update():
+                await processing_msg.edit_text("🔍 Анализирую аудио...")
+            return file_data.read()
+        
+        global shazam_client
+        if not shazam_client:
+            await processing_msg.edit_text("❌ Shazam клиент не инициализирован")
+            return
+        
+        # Распознаем через Shazam; повторные клипы берутся из кэша
+        recognition_result = await shazam_client.recognize_file(voice.file_unique_id, download)
+        
+        if not recognition_result or not recognition_result.get('matches'):
+            await processing_msg.edit_text(
+                "😔 Не удалось распознать музыку.\n"
+                "Попробуйте записать более четкое голосовое сообщение."
+            )
+            return
+        
+        # Получаем информацию о треке
+        track_info = recognition_result.get('track', {})
+        title = track_info.get('title', '')
+        artist = track_info.get('subtitle', '')
+        
+        if not title or not artist:
+            await processing_msg.edit_text(
+                "😔 Не удалось получить информацию о треке."
+            )
+            return
+        
+        # Формируем поисковый запрос
+        query = f"{artist} - {title}"
+        
+        await processing_msg.edit_text(
+            f"✅ Распознано: <b>{query}</b>\n"
+            "🔍 Ищу в ВКонтакте..."
+        )
+        
+        # Ищем в VK
+        global vk_client
+        results = await vk_client.search_audio(query, page=0)
+        
+        if not results:
+            await processing_msg.edit_text(
+                f"✅ Распознано: <b>{query}</b>\n"
+                "😔 К сожалению, не найдено в ВКонтакте."
+            )
+            return
+        
+        # Показываем результаты
+        keyboard = types.InlineKeyboardMarkup(row_width=1)
+        
+        for track in results[:3]:  # Показываем первые 3 результата
+            track_text = f"🎵 {track['artist']} - {track['title']}"
+            if len(track_text) > 60:
+                track_text = track_text[:57] + "..."
+            
+            keyboard.add(
+                types.InlineKeyboardButton(
+                    track_text,
+                    callback_data=f"download:{track['id']}"
+                )
+            )
+        
+        await processing_msg.edit_text(
+            f"✅ Распознано: <b>{query}</b>\n"
+            f"🎵 Найдено: {len(results)} треков"
+        )
+        
+        await message.answer(
+            "Выберите нужный трек:",
+            reply_markup=keyboard
+        )
+        
+        logger.info(f"Пользователь {message.from_user.id} распознал: {query}", extra={'sampled': True})
+        
+    except ServiceUnavailableError as e:
+        logger.warning(f"Сервис недоступен: {e}")
+        await processing_msg.edit_text(
+            "⏳ Сервис временно перегружен.\n"
+            "Попробуйте через пару минут."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка распознавания: {e}")
+        await processing_msg.edit_text(
+            "❌ Произошла ошибка при распознавании.\n"
+            "Попробуйте позже."
+        )
+
+@rate_limit(ACTION_SEARCH)
+async def handle_search_pagination(callback_query: types.CallbackQuery):
+    """Обработка пагинации результатов поиска"""
+    # Парсим данные: search_page:session_id:page
+    try:
+        _, session_id, page = callback_query.data.split(':')
+        page = int(page)
+    except ValueError:
+        await callback_query.answer("Результаты устарели, повторите поиск", show_alert=True)
+        return
+    
+    global vk_client
+    
+    try:
+        session = await vk_client.get_search_session(session_id)
+        
+        if not session:
+            await callback_query.answer("Результаты устарели, повторите поиск", show_alert=True)
+            return
+        
+        results = session['results']
+        per_page = vk_client.config.RESULTS_PER_PAGE
+        if page < 0 or page * per_page >= len(results):
+            await callback_query.answer("Больше результатов нет", show_alert=True)
+            return
+        
+        await callback_query.answer()
+        
+        await callback_query.message.edit_reply_markup(
+            get_search_results_keyboard(results, session_id, page, per_page)
+        )
+        
+    except Exception as e:
+        logger.error(f"Ошибка пагинации: {e}")
+        await callback_query.answer("Произошла ошибка", show_alert=True)
+
+@rate_limit(ACTION_DOWNLOAD)
+async def handle_download_track(callback_query: types.CallbackQuery):
+    """Обработка скачивания трека"""
+    await callback_query.answer()
+    
+    # Извлекаем ID трека из callback_data
+    track_id = callback_query.data.split(':')[1]
+    
+    global vk_client, db
+    
+    # Если трек уже отправлялся, переотправляем его по file_id
+    if db:
+        file_id = await db.get_cached_file_id(track_id)
+        if file_id:
+            try:
+                await callback_query.message.answer_audio(
+                    file_id,
+                    reply_markup=get_track_actions_keyboard(track_id)
+                )
+                logger.info(f"Пользователь {callback_query.from_user.id} получил трек {track_id} из кэша", extra={'sampled': True})
+                return
+            except BadRequest as e:
+                logger.warning(f"Устаревший file_id для трека {track_id}: {e}")
+                await db.delete_file_id(track_id)
+    
+    # Показываем индикатор загрузки
+    loading_msg = await callback_query.message.answer("⬇️ Скачиваю трек...")
+    
+    try:
+        # Одновременные запросы одного трека используют одну загрузку
+        track_info = await download_coordinator.send_track(
+            callback_query.message,
+            track_id,
+            vk_client,
+            db,
+            loading_msg,
+            reply_markup=get_track_actions_keyboard(track_id)
+        )
+        
+        if not track_info:
+            await loading_msg.edit_text("❌ Трек не найден")
+            return
+        
+        await loading_msg.delete()
+        
+        # Трек нужен в базе для альбомов и истории скачиваний
+        if db:
+            await db.save_downloaded_track(callback_query.from_user.id, track_id, track_info)
+        
+        logger.info(f"Пользователь {callback_query.from_user.id} скачал трек {track_id}", extra={'sampled': True})
+        
+    except DownloadTooLargeError as e:
+        logger.warning(f"Трек {track_id} слишком большой: {e}")
+        await loading_msg.edit_text(
+            "❌ Трек слишком большой для отправки в Telegram."
+        )
+    except ServiceUnavailableError as e:
+        logger.warning(f"Сервис недоступен: {e}")
+        await loading_msg.edit_text(
+            "⏳ ВКонтакте временно не отвечает.\n"
+            "Попробуйте скачать трек через пару минут."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка скачивания трека: {e}")
+        await loading_msg.edit_text(
+            "❌ Произошла ошибка при скачивании.\n"
+            "Попробуйте позже."
+        )
+
+async def cmd_albums(message: types.Message):
+    """Обработчик команды /albums"""
+    global db
+    
+    albums = await db.get_user_albums(message.from_user.id) if db else []
+    
+    if not albums:
+        albums_text = (
+            "📁 <b>У вас пока нет альбомов</b>\n\n"
+            "Создайте первый альбом, чтобы сохранять любимую музыку!"
+        )
+    else:
+        albums_text = "📁 <b>Ваши альбомы:</b>\n\n"
+        for album in albums:
+            albums_text += f"• {album['name']} ({album['track_count']} треков)\n"
+    
+    await message.answer(
+        albums_text,
+        reply_markup=get_albums_keyboard(albums, can_create=True)
+    )
+
+async def handle_create_album(callback_query: types.CallbackQuery, state: FSMContext):
+    """Начало создания альбома"""
+    await callback_query.answer()
+    
+    await callback_query.message.answer(
+        "📝 <b>Создание нового альбома</b>\n\n"
+        "Введите название альбома:",
+        reply_markup=types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton("❌ Отмена")]],
+            resize_keyboard=True
+        )
+    )
+    await state.set_state(BotStates.waiting_for_album_name)
+
+async def process_album_name(message: types.Message, state: FSMContext):
+    """Завершение создания альбома"""
+    if message.text == "❌ Отмена":
+        await state.finish()
+        await message.answer("Создание альбома отменено", reply_markup=get_main_keyboard())
+        return
+    
+    album_name = message.text.strip()
+    if not album_name:
+        await message.answer("Пожалуйста, введите корректное название")
+        return
+    
+    if len(album_name) > 50:
+        await message.answer("Название слишком длинное (максимум 50 символов)")
+        return
+    
+    global db
+    
+    try:
+        # Проверяем, нет ли уже такого альбома
+        existing = await db.get_album_by_name(message.from_user.id, album_name)
+        if existing:
+            await message.answer(
+                f"❌ Альбом с названием '{album_name}' уже существует.\n"
+                "Выберите другое название."
+            )
+            return
+        
+        await db.create_album(message.from_user.id, album_name)
+        
+        await message.answer(
+            f"✅ Альбом '<b>{album_name}</b>' успешно создан!",
+            reply_markup=get_main_keyboard()
+        )
+        await state.finish()
+        
+        logger.info(f"Пользователь {message.from_user.id} создал альбом '{album_name}'")
+        
+    except Exception as e:
+        logger.error(f"Ошибка создания альбома: {e}")
+        await message.answer(
+            "❌ Произошла ошибка при создании альбома.\n"
+            "Попробуйте позже.",
+            reply_markup=get_main_keyboard()
+        )
+        await state.finish()
+
+async def handle_add_to_album(callback_query: types.CallbackQuery):
+    """Обработка добавления трека в альбом"""
+    await callback_query.answer()
+    
+    track_id = callback_query.data.split(':')[1]
+    
+    global db
+    
+    albums = await db.get_user_albums(callback_query.from_user.id) if db else []
+    
+    if not albums:
+        await callback_query.message.answer(
+            "📁 У вас нет альбомов.\n"
+            "Создайте альбом командой /albums"
+        )
+        return
+    
+    await callback_query.message.answer(
+        "📁 Выберите альбом для добавления трека:",
+        reply_markup=get_albums_selection_keyboard(albums, track_id)
+    )
+
+async def handle_album_selection(callback_query: types.CallbackQuery):
+    """Обработка выбора альбома для добавления трека"""
+    await callback_query.answer()
+    
+    # Парсим данные: album_add:album_id:track_id
+    _, album_id, track_id = callback_query.data.split(':')
+    album_id = int(album_id)
+    
+    global db
+    
+    try:
+        album = await db.get_album_by_id(album_id)
+        if not album or album['user_id'] != callback_query.from_user.id:
+            await callback_query.message.edit_text("❌ Альбом не найден")
+            return
+        
+        # Проверяем, нет ли уже этого трека в альбоме
+        if await db.track_exists_in_album(album_id, track_id):
+            await callback_query.message.edit_text(
+                "ℹ️ Этот трек уже есть в выбранном альбоме"
+            )
+            return
+        
+        await db.add_track_to_album(album_id, track_id)
+        
+        await callback_query.message.edit_text(
+            f"✅ Трек добавлен в альбом '<b>{album['name']}</b>'"
+        )
+        
+        logger.info(f"Трек {track_id} добавлен в альбом {album_id}")
+        
+    except Exception as e:
+        logger.error(f"Ошибка добавления в альбом: {e}")
+        await callback_query.message.edit_text(
+            "❌ Произошла ошибка при добавлении в альбом"
+        )
+
+async def handle_album_view(callback_query: types.CallbackQuery):
+    """Обработка открытия альбома"""
+    await callback_query.answer()
+    
+    album_id = int(callback_query.data.split(':')[1])
+    
+    global db
+    
+    album = await db.get_album_by_id(album_id) if db else None
+    
+    if not album or album['user_id'] != callback_query.from_user.id:
+        await callback_query.message.answer("❌ Альбом не найден")
+        return
+    
+    track_count = await db.get_album_track_count(album_id)
+    
+    await callback_query.message.answer(
+        f"📁 <b>{album['name']}</b>\n"
+        f"Треков: {track_count}",
+        reply_markup=get_album_keyboard(album_id)
+    )
+
+@rate_limit(ACTION_DOWNLOAD)
+async def handle_play_album(callback_query: types.CallbackQuery):
+    """Обработка воспроизведения альбома"""
+    await callback_query.answer()
+    
+    album_id = int(callback_query.data.split(':')[1])
+    
+    global vk_client, db
+    
+    album = await db.get_album_by_id(album_id) if db else None
+    
+    if not album or album['user_id'] != callback_query.from_user.id:
+        await callback_query.message.answer("❌ Альбом не найден")
+        return
+    
+    # Все треки альбома и их file_id одним запросом
+    tracks = await db.get_album_tracks(album_id)
+    
+    if not tracks:
+        await callback_query.message.answer("📁 В альбоме пока нет треков")
+        return
+    
+    loading_msg = await callback_query.message.answer(
+        f"▶️ Загружаю альбом '<b>{album['name']}</b>' ({len(tracks)} треков)..."
+    )
+    
+    try:
+        sent = await download_coordinator.send_album(
+            callback_query.message,
+            tracks,
+            vk_client,
+            db
+        )
+        
+        if sent < len(tracks):
+            await loading_msg.edit_text(
+                f"⚠️ Отправлено {sent} из {len(tracks)} треков альбома"
+            )
+        else:
+            await loading_msg.delete()
+        
+        logger.info(f"Пользователь {callback_query.from_user.id} воспроизвел альбом {album_id}")
+        
+    except ServiceUnavailableError as e:
+        logger.warning(f"Сервис недоступен: {e}")
+        await loading_msg.edit_text(
+            "⏳ ВКонтакте временно не отвечает.\n"
+            "Попробуйте включить альбом через пару минут."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка воспроизведения альбома: {e}")
+        await loading_msg.edit_text(
+            "❌ Произошла ошибка при загрузке альбома.\n"
+            "Попробуйте позже."
+        )
+
+async def handle_button_press(message: types.Message):
+    """Обработка нажатий кнопок"""
+    if message.text == "🔍 Поиск музыки":
+        await cmd_search(message)
+    elif message.text == "📁 Мои альбомы":
+        await cmd_albums(message)
+    elif message.text == "❓ Помощь":
+        await cmd_help(message)
+
+async def set_bot_commands(bot: Bot):
+    """Устанавливает меню команд бота"""
+    commands = [
+        types.BotCommand(command="start", description="🎵 Запустить бота"),
+        types.BotCommand(command="search", description="🔍 Поиск музыки"),
+        types.BotCommand(command="albums", description="📁 Мои альбомы"),
+        types.BotCommand(command="help", description="❓ Помощь"),
+    ]
+    
+    await bot.set_my_commands(commands)
+    logger.info("Команды бота установлены")
+
+async def on_startup(dp: Dispatcher):
+    """Выполняется при запуске бота"""
+    logger.info("Бот запускается...")
+    
+    # Устанавливаем команды
+    await set_bot_commands(dp.bot)
+    
+    await init_services()
+    
+    logger.info("Бот успешно запущен!")
+
+async def init_services(vk_credentials=None):
+    """Запускает метрики, базу данных и клиенты сервисов.
+    
+    Рабочие процессы вызывают ее напрямую: команды бота ставит супервизор,
+    он же входит в VK и передает vk_credentials.
+    """
+    global vk_client, shazam_client, db, metrics_server
+    config = Config()
+    
+    # Запускаем сервер метрик
+    if config.METRICS_PORT:
+        try:
+            metrics_server = MetricsServer(config.METRICS_HOST, config.METRICS_PORT)
+            await metrics_server.start()
+        except Exception as e:
+            metrics_server = None
+            logger.error(f"Ошибка запуска сервера метрик: {e}")
+    
+    # Включаем трассировку, если задан файл или коллектор
+    try:
+        tracer.configure(config)
+    except Exception as e:
+        logger.error(f"Ошибка настройки трассировки: {e}")
+    
+    # Инициализируем базу данных
+    try:
+        db = Database()
+        await db.init_db()
+    except Exception as e:
+        db = None
+        logger.error(f"Ошибка инициализации базы данных: {e}")
+    
+    # Инициализируем VK клиент
+    try:
+        vk_client = VKClient()
+        await vk_client.init(vk_credentials)
+        logger.info("VK клиент инициализирован")
+    except Exception as e:
+        logger.error(f"Ошибка инициализации VK клиента: {e}")
+    
+    # Инициализируем Shazam клиент
+    try:
+        shazam_client = ShazamClient()
+        logger.info("Shazam клиент инициализирован")
+    except Exception as e:
+        logger.error(f"Ошибка инициализации Shazam клиента: {e}")
+
+async def on_shutdown(dp: Dispatcher):
+    """Выполняется при остановке бота"""
+    logger.info("Бот останавливается...")
+    
+    # Закрываем соединения
+    global vk_client, db, metrics_server
+    if vk_client:
+        await vk_client.close()
+    
+    # Хранилище FSM закрываем до базы данных, чтобы сбросить последние изменения
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    
+    if db:
+        await db.close()
+    
+    if metrics_server:
+        await metrics_server.stop()
+    
+    await AudioProcessor.shutdown()
+    tracer.shutdown()
+    
+    logger.info("Бот остановлен")
+
+def register_handlers(dp: Dispatcher):
+    """Регистрирует все обработчики"""
+    # Корневой span на каждое обновление
+    dp.middleware.setup(TracingMiddleware())
+    
+    # Ограничение частоты запросов к VK и Shazam
+    dp.middleware.setup(ThrottlingMiddleware.from_config(Config()))
+    # Время работы обработчиков без учета ожидания в ограничителе
+    dp.middleware.setup(MetricsMiddleware())
+    
+    # Команды
+    dp.register_message_handler(cmd_start, Command("start"))
+    dp.register_message_handler(cmd_help, Command("help"))
+    dp.register_message_handler(cmd_search, Command("search"))
+    dp.register_message_handler(cmd_albums, Command("albums"))
+    
+    # Состояния
+    dp.register_message_handler(
+        process_search_query, 
+        state=BotStates.waiting_for_search
+    )
+    dp.register_message_handler(
+        process_album_name,
+        state=BotStates.waiting_for_album_name
+    )
+    
+    # Callback запросы
+    dp.register_callback_query_handler(
+        handle_download_track,
+        Text(startswith="download:")
+    )
+    dp.register_callback_query_handler(
+        handle_search_pagination,
+        Text(startswith="search_page:")
+    )
+    dp.register_callback_query_handler(
+        handle_create_album,
+        Text(equals="create_album")
+    )
+    dp.register_callback_query_handler(
+        handle_add_to_album,
+        Text(startswith="add_album:")
+    )
+    dp.register_callback_query_handler(
+        handle_album_selection,
+        Text(startswith="album_add:")
+    )
+    dp.register_callback_query_handler(
+        handle_album_view,
+        Text(startswith="album:")
+    )
+    dp.register_callback_query_handler(
+        handle_play_album,
+        Text(startswith="play_album:")
+    )
+    
+    # Голосовые сообщения и аудиофайлы
+    dp.register_message_handler(
+        handle_voice_message,
+        content_types=[types.ContentType.VOICE, types.ContentType.AUDIO]
+    )
+    
+    # Кнопки
+    dp.register_message_handler(
+        handle_button_press,
+        Text(equals=["🔍 Поиск музыки", "📁 Мои альбомы", "❓ Помощь"])
+    )
+    
+    # Текстовые сообщения (поиск)
+    dp.register_message_handler(
+        handle_text_search,
+        content_types=types.ContentType.TEXT
+    )
+
+def main():
+    """Главная функция запуска бота"""
+    try:
+        # Загружаем конфигурацию
+        config = Config()
+        configure_logging(config)
+        logger.info("Конфигурация загружена")
+        
+        # Несколько процессов: этот процесс только принимает и раздает обновления
+        if config.WORKERS > 1:
+            Supervisor(config, set_commands=set_bot_commands).run()
+            return
+        
+        # Создаем бота и диспетчер
+        bot = ScheduledBot(token=config.BOT_TOKEN, parse_mode=types.ParseMode.HTML)
+        storage = SQLiteStorage(
+            ttl=config.FSM_TTL,
+            cache_ttl=config.FSM_CACHE_TTL,
+            flush_interval=config.FSM_FLUSH_INTERVAL
+        )
+        dp = Dispatcher(bot, storage=storage)
+        
+        # Регистрируем обработчики
+        register_handlers(dp)
+        logger.info("Обработчики зарегистрированы")
+        
+        # Запускаем бота: webhook в продакшене, polling для локальной разработки
+        if config.WEBHOOK_URL:
+            WebhookServer(dp, config, on_startup, on_shutdown).run()
+        else:
+            executor.start_polling(
+                dp,
+                skip_updates=True,
+                on_startup=on_startup,
+                on_shutdown=on_shutdown
+            )
+        
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,217 @@
-import os
-from dataclasses import dataclass
-from typing import Optional
-
-@dataclass
-class Config:
-    """Конфигурация бота"""
-    
-    # Telegram Bot
-    BOT_TOKEN: str
-    
-    # VK
-    VK_LOGIN: str
-    VK_PASSWORD: str
-    
-    # Logging
-    LOG_LEVEL: str = "INFO"
-    
-    # Bot settings
-    RESULTS_PER_PAGE: int = 6
-    MAX_DOWNLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB
-    
-    def __init__(self):
-        self.BOT_TOKEN = self._get_env("BOT_TOKEN")
-        self.VK_LOGIN = self._get_env("VK_LOGIN")
-        self.VK_PASSWORD = self._get_env("VK_PASSWORD")
-        self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-        self.RESULTS_PER_PAGE = int(os.getenv("RESULTS_PER_PAGE", "6"))
-        self.MAX_DOWNLOAD_SIZE = int(os.getenv("MAX_DOWNLOAD_SIZE", str(50 * 1024 * 1024)))
-    
-    def _get_env(self, key: str) -> str:
-        """Получает переменную окружения или вызывает ошибку"""
-        value = os.getenv(key)
-        if not value:
-            raise ValueError(f"Переменная окружения {key} не установлена")
-        return value
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+@dataclass
+class Config:
+    """Конфигурация бота"""
+    
+    # Telegram Bot
+    BOT_TOKEN: str
+    
+    # VK
+    VK_LOGIN: str
+    VK_PASSWORD: str
+    
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"  # text или json
+    LOG_FILE: str = "logs/bot.log"
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024  # 10MB
+    LOG_BACKUP_COUNT: int = 5
+    LOG_SAMPLE_RATE: float = 1.0  # доля частых сообщений об успехе
+    
+    # Bot settings
+    RESULTS_PER_PAGE: int = 6
+    MAX_DOWNLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB
+    DOWNLOAD_SPOOL_SIZE: int = 5 * 1024 * 1024  # 5MB, дальше файл пишется на диск
+    
+    # Transcoding (треки больше MAX_DOWNLOAD_SIZE перекодируются через ffmpeg)
+    TRANSCODE_ENABLED: bool = True
+    MAX_SOURCE_SIZE: int = 200 * 1024 * 1024  # 200MB, предел скачивания из VK
+    TRANSCODE_MAX_BITRATE: int = 192  # кбит/с
+    TRANSCODE_TIMEOUT: int = 600  # секунд
+    TRANSCODE_WORKERS: int = 2  # одновременных процессов ffmpeg
+    TRANSCODE_CACHE_DIR: str = "cache/transcoded"
+    TRANSCODE_CACHE_SIZE: int = 2 * 1024 * 1024 * 1024  # 2GB
+    
+    # Cover cache (миниатюры обложек для отправки аудио)
+    THUMBNAIL_SIZE: int = 320  # пикселей, предел Telegram для миниатюр
+    COVER_CACHE_DIR: str = "cache/covers"
+    COVER_CACHE_SIZE: int = 200 * 1024 * 1024  # 200MB
+    COVER_MEMORY_SIZE: int = 200  # миниатюр в памяти
+    
+    # Download pipeline (таймауты этапов скачивания трека)
+    TRACK_INFO_TIMEOUT: float = 30.0  # секунд
+    AUDIO_DOWNLOAD_TIMEOUT: float = 900.0  # секунд, вместе с перекодированием
+    COVER_TIMEOUT: float = 5.0  # секунд, дальше трек уходит без обложки
+    UPLOAD_TIMEOUT: float = 300.0  # секунд
+    STATUS_EDIT_TIMEOUT: float = 5.0  # секунд
+    
+    # Webhook (если WEBHOOK_URL не задан, бот работает через polling)
+    WEBHOOK_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""
+    WEBAPP_HOST: str = "0.0.0.0"
+    WEBAPP_PORT: int = 8080
+    WEBHOOK_MAX_CONCURRENCY: int = 40
+    
+    # Worker processes
+    WORKERS: int = 1
+    WORKER_QUEUE_SIZE: int = 1000
+    WORKER_CONCURRENCY: int = 50
+    
+    # Metrics
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100  # 0 - отключить
+    
+    # Tracing
+    TRACE_FILE: str = ""  # файл для трасс в формате OTLP/JSON
+    TRACE_ENDPOINT: str = ""  # OTLP/HTTP коллектор, например http://localhost:4318/v1/traces
+    TRACE_SAMPLE_RATE: float = 0.01
+    TRACE_SLOW_THRESHOLD: float = 5.0  # секунд, такие трассы сохраняются всегда
+    
+    # FSM storage
+    FSM_TTL: int = 24 * 60 * 60  # секунд
+    FSM_CACHE_TTL: float = 5.0  # секунд
+    FSM_FLUSH_INTERVAL: float = 0.5  # секунд
+    
+    # VK executor
+    VK_WORKERS: int = 4
+    VK_QUEUE_SIZE: int = 100
+    VK_CALL_TIMEOUT: int = 20  # секунд
+    
+    # Search cache
+    SEARCH_CACHE_TTL: int = 600  # секунд
+    SEARCH_CACHE_SIZE: int = 1000  # записей в памяти
+    SEARCH_CACHE_MAX_ROWS: int = 50000  # записей в базе данных
+    SEARCH_CACHE_STALE_TTL: int = 24 * 60 * 60  # секунд, отдаются при недоступности VK
+    SEARCH_BATCH_SIZE: int = 60  # результатов за один запрос к VK
+    SEARCH_SESSION_TTL: int = 60 * 60  # секунд, сколько можно листать результаты
+    SEARCH_SESSION_SIZE: int = 1000  # сессий в памяти
+    
+    # Audio processing
+    AUDIO_WORKERS: int = 2  # процессов для декодирования аудио
+    RECOGNITION_CLIP_SECONDS: float = 12.0  # длина фрагмента для Shazam
+    
+    # Recognition cache
+    RECOGNITION_CACHE_TTL: int = 30 * 24 * 60 * 60  # секунд
+    RECOGNITION_NEGATIVE_TTL: int = 60 * 60  # секунд, для нераспознанных клипов
+    RECOGNITION_CACHE_SIZE: int = 1000  # записей в памяти
+    
+    # Circuit breaker
+    CIRCUIT_WINDOW: int = 20  # последних вызовов
+    CIRCUIT_FAILURE_RATE: float = 0.5
+    CIRCUIT_BASE_BACKOFF: float = 5.0  # секунд
+    CIRCUIT_MAX_BACKOFF: float = 300.0  # секунд
+    VK_SLOW_CALL: float = 10.0  # секунд
+    SHAZAM_SLOW_CALL: float = 20.0  # секунд
+    
+    # Rate limits: (запросов в секунду, размер пачки)
+    SEARCH_RATE_LIMIT: Tuple[float, float] = (20 / 60, 5)
+    DOWNLOAD_RATE_LIMIT: Tuple[float, float] = (30 / 60, 10)
+    RECOGNITION_RATE_LIMIT: Tuple[float, float] = (6 / 60, 2)
+    VK_RATE_LIMIT: Tuple[float, float] = (600 / 60, 30)
+    SHAZAM_RATE_LIMIT: Tuple[float, float] = (60 / 60, 5)
+    RATE_LIMIT_MAX_DELAY: float = 3.0  # секунд
+    
+    # Telegram flood limits: (запросов в секунду, размер пачки)
+    TELEGRAM_RATE_LIMIT: Tuple[float, float] = (1800 / 60, 30)
+    TELEGRAM_CHAT_RATE_LIMIT: Tuple[float, float] = (60 / 60, 5)
+    TELEGRAM_GROUP_RATE_LIMIT: Tuple[float, float] = (20 / 60, 3)
+    TELEGRAM_MAX_RETRIES: int = 3
+    
+    def __init__(self):
+        self.BOT_TOKEN = self._get_env("BOT_TOKEN")
+        self.VK_LOGIN = self._get_env("VK_LOGIN")
+        self.VK_PASSWORD = self._get_env("VK_PASSWORD")
+        self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+        self.LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+        self.LOG_FILE = os.getenv("LOG_FILE", "logs/bot.log")
+        self.LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+        self.LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+        self.LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+        self.RESULTS_PER_PAGE = int(os.getenv("RESULTS_PER_PAGE", "6"))
+        self.MAX_DOWNLOAD_SIZE = int(os.getenv("MAX_DOWNLOAD_SIZE", str(50 * 1024 * 1024)))
+        self.DOWNLOAD_SPOOL_SIZE = int(os.getenv("DOWNLOAD_SPOOL_SIZE", str(5 * 1024 * 1024)))
+        self.TRANSCODE_ENABLED = os.getenv("TRANSCODE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.MAX_SOURCE_SIZE = int(os.getenv("MAX_SOURCE_SIZE", str(200 * 1024 * 1024)))
+        self.TRANSCODE_MAX_BITRATE = int(os.getenv("TRANSCODE_MAX_BITRATE", "192"))
+        self.TRANSCODE_TIMEOUT = int(os.getenv("TRANSCODE_TIMEOUT", "600"))
+        self.TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+        self.TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", "cache/transcoded")
+        self.TRANSCODE_CACHE_SIZE = int(os.getenv("TRANSCODE_CACHE_SIZE", str(2 * 1024 * 1024 * 1024)))
+        self.THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+        self.COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "cache/covers")
+        self.COVER_CACHE_SIZE = int(os.getenv("COVER_CACHE_SIZE", str(200 * 1024 * 1024)))
+        self.COVER_MEMORY_SIZE = int(os.getenv("COVER_MEMORY_SIZE", "200"))
+        self.TRACK_INFO_TIMEOUT = float(os.getenv("TRACK_INFO_TIMEOUT", "30"))
+        self.AUDIO_DOWNLOAD_TIMEOUT = float(os.getenv("AUDIO_DOWNLOAD_TIMEOUT", "900"))
+        self.COVER_TIMEOUT = float(os.getenv("COVER_TIMEOUT", "5"))
+        self.UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "300"))
+        self.STATUS_EDIT_TIMEOUT = float(os.getenv("STATUS_EDIT_TIMEOUT", "5"))
+        self.WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+        self.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+        self.WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+        self.WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+        self.WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+        self.WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "40"))
+        self.WORKERS = int(os.getenv("WORKERS", "1"))
+        self.WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+        self.WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "50"))
+        self.METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+        self.METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+        self.TRACE_FILE = os.getenv("TRACE_FILE", "")
+        self.TRACE_ENDPOINT = os.getenv("TRACE_ENDPOINT", "")
+        self.TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+        self.TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "5"))
+        self.FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 60 * 60)))
+        self.FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))
+        self.FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+        self.VK_WORKERS = int(os.getenv("VK_WORKERS", "4"))
+        self.VK_QUEUE_SIZE = int(os.getenv("VK_QUEUE_SIZE", "100"))
+        self.VK_CALL_TIMEOUT = int(os.getenv("VK_CALL_TIMEOUT", "20"))
+        self.SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+        self.SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+        self.SEARCH_CACHE_MAX_ROWS = int(os.getenv("SEARCH_CACHE_MAX_ROWS", "50000"))
+        self.SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", str(24 * 60 * 60)))
+        self.SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", "60"))
+        self.SEARCH_SESSION_TTL = int(os.getenv("SEARCH_SESSION_TTL", str(60 * 60)))
+        self.SEARCH_SESSION_SIZE = int(os.getenv("SEARCH_SESSION_SIZE", "1000"))
+        self.AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "2"))
+        self.RECOGNITION_CLIP_SECONDS = float(os.getenv("RECOGNITION_CLIP_SECONDS", "12"))
+        self.RECOGNITION_CACHE_TTL = int(os.getenv("RECOGNITION_CACHE_TTL", str(30 * 24 * 60 * 60)))
+        self.RECOGNITION_NEGATIVE_TTL = int(os.getenv("RECOGNITION_NEGATIVE_TTL", "3600"))
+        self.RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", "1000"))
+        self.CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+        self.CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+        self.CIRCUIT_BASE_BACKOFF = float(os.getenv("CIRCUIT_BASE_BACKOFF", "5"))
+        self.CIRCUIT_MAX_BACKOFF = float(os.getenv("CIRCUIT_MAX_BACKOFF", "300"))
+        self.VK_SLOW_CALL = float(os.getenv("VK_SLOW_CALL", "10"))
+        self.SHAZAM_SLOW_CALL = float(os.getenv("SHAZAM_SLOW_CALL", "20"))
+        self.SEARCH_RATE_LIMIT = self._get_rate_limit("SEARCH_RATE_LIMIT", "20:5")
+        self.DOWNLOAD_RATE_LIMIT = self._get_rate_limit("DOWNLOAD_RATE_LIMIT", "30:10")
+        self.RECOGNITION_RATE_LIMIT = self._get_rate_limit("RECOGNITION_RATE_LIMIT", "6:2")
+        self.VK_RATE_LIMIT = self._get_rate_limit("VK_RATE_LIMIT", "600:30")
+        self.SHAZAM_RATE_LIMIT = self._get_rate_limit("SHAZAM_RATE_LIMIT", "60:5")
+        self.RATE_LIMIT_MAX_DELAY = float(os.getenv("RATE_LIMIT_MAX_DELAY", "3"))
+        self.TELEGRAM_RATE_LIMIT = self._get_rate_limit("TELEGRAM_RATE_LIMIT", "1800:30")
+        self.TELEGRAM_CHAT_RATE_LIMIT = self._get_rate_limit("TELEGRAM_CHAT_RATE_LIMIT", "60:5")
+        self.TELEGRAM_GROUP_RATE_LIMIT = self._get_rate_limit("TELEGRAM_GROUP_RATE_LIMIT", "20:3")
+        self.TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+    
+    def _get_env(self, key: str) -> str:
+        """Получает переменную окружения или вызывает ошибку"""
+        value = os.getenv(key)
+        if not value:
+            raise ValueError(f"Переменная окружения {key} не установлена")
+        return value
+    
+    def _get_rate_limit(self, key: str, default: str) -> Tuple[float, float]:
+        """Читает лимит в формате "запросов_в_минуту:размер_пачки" """
+        value = os.getenv(key, default)
+        try:
+            per_minute, burst = value.split(":")
+            return float(per_minute) / 60, float(burst)
+        except ValueError:
+            raise ValueError(f"Некорректный лимит {key}={value}, ожидается формат 20:5")
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+from vk_client import VKClient
+from utils.cache import LRUCache, SingleFlight
+from utils.logger import setup_logger
+from utils.metrics import CACHE_REQUESTS
+from utils.tracing import tracer
+
+logger = setup_logger(__name__)
+
+# Сколько миниатюр готовится одновременно
+THUMBNAIL_CONCURRENCY = 4
+
+# Таймаут ffmpeg на одну миниатюру (сек)
+THUMBNAIL_TIMEOUT = 10
+
+# Как часто проверять размер кэша на диске (число новых миниатюр)
+EVICT_EVERY = 50
+
+# Сколько миниатюра живет в памяти (сек)
+MEMORY_TTL = 24 * 60 * 60
+
+# Сколько ссылок хранит индекс на диске и сколько живет неиспользуемая ссылка (сек)
+INDEX_MAX_ENTRIES = 20000
+INDEX_MAX_AGE = 30 * 24 * 60 * 60
+
+class CoverCache:
+    """Кэш миниатюр обложек для отправки аудио в Telegram.
+    
+    Обложка скачивается и уменьшается до JPEG THUMBNAIL_SIZE пикселей один
+    раз. Миниатюры хранятся на диске под хэшем содержимого, поэтому одна
+    обложка альбома, доступная по разным ссылкам, хранится в одном файле.
+    Ссылка связывается с хэшем через небольшой индекс. Самые частые
+    миниатюры дополнительно держатся в памяти, а диск ограничен общим
+    размером и вытесняет давно не использованные файлы.
+    """
+    
+    def __init__(self):
+        self.config = Config()
+        self.cache_dir = Path(self.config.COVER_CACHE_DIR)
+        self.thumbs_dir = self.cache_dir / "thumbs"
+        self.index_dir = self.cache_dir / "index"
+        self._memory = LRUCache(self.config.COVER_MEMORY_SIZE, MEMORY_TTL)
+        self._flight = SingleFlight()
+        self._semaphore = asyncio.Semaphore(THUMBNAIL_CONCURRENCY)
+        self._writes = 0
+    
+    @staticmethod
+    def _url_key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+    
+    async def get_thumbnail(self, url: str, vk_client: VKClient) -> Optional[io.BytesIO]:
+        """Миниатюра обложки или None, если обложку получить не удалось"""
+        key = self._url_key(url)
+        
+        thumbnail = self._memory.get(key)
+        if thumbnail is not None:
+            CACHE_REQUESTS.inc(cache="cover", result="memory")
+        else:
+            # Одну обложку одновременно готовит только один запрос
+            thumbnail, _ = await self._flight.run(key, lambda: self._load(key, url, vk_client))
+        
+        # Пустая миниатюра - запомненная неудача, чтобы не скачивать ее снова
+        return io.BytesIO(thumbnail) if thumbnail else None
+    
+    async def _load(self, key: str, url: str, vk_client: VKClient) -> bytes:
+        """Читает миниатюру с диска или скачивает и уменьшает обложку"""
+        loop = asyncio.get_running_loop()
+        
+        thumbnail = await loop.run_in_executor(None, self._read_disk, key)
+        if thumbnail is not None:
+            CACHE_REQUESTS.inc(cache="cover", result="disk")
+            self._memory.set(key, thumbnail)
+            return thumbnail
+        
+        CACHE_REQUESTS.inc(cache="cover", result="miss")
+        cover = await vk_client.download_cover(url)
+        if cover is None:
+            return b""
+        
+        cover_data = cover.getvalue()
+        content_hash = hashlib.sha256(cover_data).hexdigest()
+        thumbnail = await loop.run_in_executor(None, self._read_thumb, content_hash)
+        if thumbnail is None:
+            thumbnail = await self._resize(cover_data)
+            if thumbnail is None:
+                self._memory.set(key, b"")
+                return b""
+        
+        self._memory.set(key, thumbnail)
+        await loop.run_in_executor(None, self._write_disk, key, content_hash, thumbnail)
+        return thumbnail
+    
+    async def _resize(self, cover_data: bytes) -> Optional[bytes]:
+        """Уменьшает обложку до JPEG миниатюры через ffmpeg"""
+        size = self.config.THUMBNAIL_SIZE
+        async with self._semaphore:
+            with tracer.span("cover.resize"):
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        "ffmpeg", "-v", "error",
+                        "-i", "pipe:0",
+                        "-vf", f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease",
+                        "-frames:v", "1", "-q:v", "4",
+                        "-f", "mjpeg", "pipe:1",
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE
+                    )
+                    try:
+                        thumbnail, stderr = await asyncio.wait_for(
+                            process.communicate(cover_data),
+                            THUMBNAIL_TIMEOUT
+                        )
+                    except asyncio.TimeoutError:
+                        process.kill()
+                        await process.wait()
+                        raise Exception("таймаут ffmpeg")
+                    
+                    if process.returncode != 0 or not thumbnail:
+                        raise Exception(stderr.decode("utf-8", "replace").strip())
+                    return thumbnail
+                
+                except Exception as e:
+                    logger.error(f"Ошибка подготовки миниатюры обложки: {e}")
+                    return None
+    
+    def _thumb_path(self, content_hash: str) -> Path:
+        return self.thumbs_dir / f"{content_hash}.jpg"
+    
+    def _read_thumb(self, content_hash: str) -> Optional[bytes]:
+        path = self._thumb_path(content_hash)
+        try:
+            thumbnail = path.read_bytes()
+        except OSError:
+            return None
+        # Время изменения служит временем последнего использования для вытеснения
+        os.utime(path)
+        return thumbnail
+    
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        index_path = self.index_dir / key
+        try:
+            content_hash = index_path.read_text().strip()
+        except OSError:
+            return None
+        
+        thumbnail = self._read_thumb(content_hash)
+        if thumbnail is not None:
+            os.utime(index_path)
+        return thumbnail
+    
+    def _write_disk(self, key: str, content_hash: str, thumbnail: bytes):
+        """Сохраняет миниатюру и ссылку на нее, файлы появляются атомарно"""
+        try:
+            self.thumbs_dir.mkdir(parents=True, exist_ok=True)
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            
+            path = self._thumb_path(content_hash)
+            if not path.exists():
+                temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                temp_path.write_bytes(thumbnail)
+                os.replace(temp_path, path)
+            
+            index_path = self.index_dir / key
+            temp_index = index_path.with_suffix(f".{os.getpid()}.tmp")
+            temp_index.write_text(content_hash)
+            os.replace(temp_index, index_path)
+            
+            # Первая запись после запуска убирает то, что накопилось до него
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 1:
+                self._evict()
+        except OSError as e:
+            logger.error(f"Ошибка сохранения миниатюры обложки: {e}")
+    
+    def _evict(self):
+        """Ограничивает размер кэша на диске.
+        
+        Давно не использованные миниатюры удаляются, пока кэш больше лимита.
+        Из индекса удаляются ссылки сверх INDEX_MAX_ENTRIES и не использованные
+        дольше INDEX_MAX_AGE. Записи индекса, указывающие на удаленные файлы,
+        при чтении считаются промахом и перезаписываются.
+        """
+        files = [
+            (entry.stat().st_mtime, entry.stat().st_size, entry)
+            for entry in self.thumbs_dir.glob("*.jpg")
+        ]
+        total = sum(size for _, size, _ in files)
+        for _, size, entry in sorted(files):
+            if total <= self.config.COVER_CACHE_SIZE:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+        
+        entries = sorted(
+            ((entry.stat().st_mtime, entry) for entry in self.index_dir.iterdir()),
+            reverse=True
+        )
+        expired = time.time() - INDEX_MAX_AGE
+        for index, (mtime, entry) in enumerate(entries):
+            if index >= INDEX_MAX_ENTRIES or mtime < expired:
+                entry.unlink(missing_ok=True)
@@ -1,235 +1,755 @@
-import aiosqlite
-import asyncio
-from typing import List, Dict, Optional
-from pathlib import Path
-
-from utils.logger import setup_logger
-
-logger = setup_logger(__name__)
-
-class Database:
-    """Класс для работы с базой данных"""
-    
-    def __init__(self, db_path: str = "bot.db"):
-        self.db_path = db_path
-    
-    async def init_db(self):
-        """Инициализация базы данных"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                # Таблица пользователей
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY,
-                        telegram_id INTEGER UNIQUE NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Таблица альбомов
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS albums (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        name TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (telegram_id),
-                        UNIQUE(user_id, name)
-                    )
-                """)
-                
-                # Таблица треков
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS tracks (
-                        id TEXT PRIMARY KEY,
-                        title TEXT NOT NULL,
-                        artist TEXT NOT NULL,
-                        duration INTEGER,
-                        url TEXT,
-                        thumb_url TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Таблица связи альбомов и треков
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS album_tracks (
-                        album_id INTEGER NOT NULL,
-                        track_id TEXT NOT NULL,
-                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        PRIMARY KEY (album_id, track_id),
-                        FOREIGN KEY (album_id) REFERENCES albums (id) ON DELETE CASCADE,
-                        FOREIGN KEY (track_id) REFERENCES tracks (id) ON DELETE CASCADE
-                    )
-                """)
-                
-                # Таблица скачанных треков
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS downloaded_tracks (
-                        user_id INTEGER NOT NULL,
-                        track_id TEXT NOT NULL,
-                        downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        PRIMARY KEY (user_id, track_id),
-                        FOREIGN KEY (user_id) REFERENCES users (telegram_id),
-                        FOREIGN KEY (track_id) REFERENCES tracks (id)
-                    )
-                """)
-                
-                await db.commit()
-                logger.info("База данных инициализирована")
-                
-        except Exception as e:
-            logger.error(f"Ошибка инициализации БД: {e}")
-            raise
-    
-    async def create_user(self, telegram_id: int, username: str = None, first_name: str = None):
-        """Создание пользователя"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    "INSERT OR IGNORE INTO users (telegram_id, username, first_name) VALUES (?, ?, ?)",
-                    (telegram_id, username, first_name)
-                )
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Ошибка создания пользователя: {e}")
-    
-    async def create_album(self, user_id: int, name: str) -> int:
-        """Создание альбома"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
-                    "INSERT INTO albums (user_id, name) VALUES (?, ?)",
-                    (user_id, name)
-                )
-                album_id = cursor.lastrowid
-                await db.commit()
-                return album_id
-        except Exception as e:
-            logger.error(f"Ошибка создания альбома: {e}")
-            raise
-    
-    async def get_user_albums(self, user_id: int) -> List[Dict]:
-        """Получение альбомов пользователя"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(
-                    "SELECT * FROM albums WHERE user_id = ? ORDER BY created_at DESC",
-                    (user_id,)
-                )
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
-        except Exception as e:
-            logger.error(f"Ошибка получения альбомов: {e}")
-            return []
-    
-    async def get_album_by_name(self, user_id: int, name: str) -> Optional[Dict]:
-        """Получение альбома по названию"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(
-                    "SELECT * FROM albums WHERE user_id = ? AND name = ?",
-                    (user_id, name)
-                )
-                row = await cursor.fetchone()
-                return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка получения альбома: {e}")
-            return None
-    
-    async def get_album_by_id(self, album_id: int) -> Optional[Dict]:
-        """Получение альбома по ID"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                cursor = await db.execute(
-                    "SELECT * FROM albums WHERE id = ?",
-                    (album_id,)
-                )
-                row = await cursor.fetchone()
-                return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка получения альбома: {e}")
-            return None
-    
-    async def save_track(self, track_info: Dict):
-        """Сохранение информации о треке"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    """INSERT OR REPLACE INTO tracks 
-                       (id, title, artist, duration, url, thumb_url) 
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    (
-                        track_info['id'],
-                        track_info['title'],
-                        track_info['artist'],
-                        track_info.get('duration', 0),
-                        track_info.get('url'),
-                        track_info.get('thumb_url')
-                    )
-                )
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Ошибка сохранения трека: {e}")
-    
-    async def add_track_to_album(self, album_id: int, track_id: str):
-        """Добавление трека в альбом"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    "INSERT OR IGNORE INTO album_tracks (album_id, track_id) VALUES (?, ?)",
-                    (album_id, track_id)
-                )
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Ошибка добавления трека в альбом: {e}")
-            raise
-    
-    async def track_exists_in_album(self, album_id: int, track_id: str) -> bool:
-        """Проверка существования трека в альбоме"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
-                    "SELECT 1 FROM album_tracks WHERE album_id = ? AND track_id = ?",
-                    (album_id, track_id)
-                )
-                row = await cursor.fetchone()
-                return row is not None
-        except Exception as e:
-            logger.error(f"Ошибка проверки трека в альбоме: {e}")
-            return False
-    
-    async def get_album_track_count(self, album_id: int) -> int:
-        """Получение количества треков в альбоме"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(
-                    "SELECT COUNT(*) FROM album_tracks WHERE album_id = ?",
-                    (album_id,)
-                )
-                row = await cursor.fetchone()
-                return row[0] if row else 0
-        except Exception as e:
-            logger.error(f"Ошибка подсчета треков: {e}")
-            return 0
-    
-    async def save_downloaded_track(self, user_id: int, track_id: str, track_info: Dict):
-        """Сохранение информации о скачанном треке"""
-        try:
-            # Сначала сохраняем трек
-            await self.save_track(track_info)
-            
-            # Затем отмечаем как скачанный
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(
-                    "INSERT OR REPLACE INTO downloaded_tracks (user_id, track_id) VALUES (?, ?)",
-                    (user_id, track_id)
-                )
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Ошибка сохранения скачанного трека: {e}")
+import aiosqlite
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+
+from utils.logger import setup_logger
+from utils.metrics import CACHE_REQUESTS
+from utils.tracing import traced
+
+logger = setup_logger(__name__)
+
+# Размер кэша подготовленных выражений sqlite3
+STATEMENT_CACHE_SIZE = 256
+
+# Миграции схемы: версия и выражения, которые к ней приводят.
+# Текущая версия хранится в PRAGMA user_version.
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_albums_user_created ON albums (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_album_tracks_album_added ON album_tracks (album_id, added_at)",
+        "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_track ON downloaded_tracks (track_id, downloaded_at)",
+        "CREATE INDEX IF NOT EXISTS idx_search_cache_cached_at ON search_cache (cached_at)",
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)",
+    ]),
+    (3, [
+        "CREATE INDEX IF NOT EXISTS idx_recognition_cache_cached_at ON recognition_cache (cached_at)",
+    ]),
+    (4, [
+        "CREATE INDEX IF NOT EXISTS idx_search_sessions_created ON search_sessions (created_at)",
+    ]),
+    # page в кэше поиска теперь номер пачки SEARCH_BATCH_SIZE, а не страницы из 6 треков
+    (5, [
+        "DELETE FROM search_cache",
+    ]),
+]
+
+# Частые запросы и индексы, которые они должны использовать
+QUERY_PLAN_CHECKS = [
+    (
+        "SELECT * FROM albums WHERE user_id = ? ORDER BY created_at DESC",
+        (0,),
+        "idx_albums_user_created"
+    ),
+    (
+        "SELECT track_id FROM album_tracks WHERE album_id = ? ORDER BY added_at",
+        (0,),
+        "idx_album_tracks_album_added"
+    ),
+    (
+        "SELECT user_id FROM downloaded_tracks WHERE track_id = ? ORDER BY downloaded_at DESC",
+        ("",),
+        "idx_downloaded_tracks_track"
+    ),
+    (
+        "DELETE FROM search_cache WHERE cached_at < ?",
+        (0,),
+        "idx_search_cache_cached_at"
+    ),
+    (
+        "DELETE FROM fsm_storage WHERE updated_at < ?",
+        (0,),
+        "idx_fsm_storage_updated"
+    ),
+    (
+        "DELETE FROM recognition_cache WHERE cached_at < ? OR (NOT matched AND cached_at < ?)",
+        (0, 0),
+        "idx_recognition_cache_cached_at"
+    ),
+    (
+        "DELETE FROM search_sessions WHERE created_at < ?",
+        (0,),
+        "idx_search_sessions_created"
+    ),
+]
+
+class QueryPlanError(Exception):
+    """Частый запрос не использует свой индекс"""
+
+# Общие соединения, по одному на файл базы данных
+_connections: Dict[str, aiosqlite.Connection] = {}
+_connections_lock = asyncio.Lock()
+
+# Записи в одну базу идут по очереди, чтобы откат не задел чужую транзакцию
+_write_locks: Dict[str, asyncio.Lock] = {}
+
+class Database:
+    """Класс для работы с базой данных"""
+    
+    def __init__(self, db_path: str = "bot.db"):
+        self.db_path = db_path
+    
+    async def _get_connection(self) -> aiosqlite.Connection:
+        """Возвращает общее долгоживущее соединение с базой данных"""
+        db = _connections.get(self.db_path)
+        if db is not None:
+            return db
+        
+        async with _connections_lock:
+            db = _connections.get(self.db_path)
+            if db is None:
+                db = await aiosqlite.connect(
+                    self.db_path,
+                    cached_statements=STATEMENT_CACHE_SIZE
+                )
+                db.row_factory = aiosqlite.Row
+                
+                # WAL позволяет читать параллельно с записью
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute("PRAGMA synchronous=NORMAL")
+                
+                _connections[self.db_path] = db
+                logger.info(f"Открыто соединение с базой данных {self.db_path}")
+        
+        return db
+    
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Транзакция записи на общем соединении.
+        
+        Фиксируется при выходе из блока. При ошибке изменения откатываются,
+        иначе незавершенная транзакция попала бы в commit следующей записи.
+        """
+        db = await self._get_connection()
+        lock = _write_locks.setdefault(self.db_path, asyncio.Lock())
+        async with lock:
+            try:
+                yield db
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+    
+    async def close(self):
+        """Закрытие общего соединения с базой данных"""
+        db = _connections.pop(self.db_path, None)
+        if db is not None:
+            await db.close()
+            logger.info(f"Соединение с базой данных {self.db_path} закрыто")
+    
+    async def init_db(self):
+        """Инициализация базы данных"""
+        try:
+            db = await self._get_connection()
+            
+            # Таблица пользователей
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY,
+                    telegram_id INTEGER UNIQUE NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Таблица альбомов
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS albums (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+                    UNIQUE(user_id, name)
+                )
+            """)
+            
+            # Таблица треков
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    duration INTEGER,
+                    url TEXT,
+                    thumb_url TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Таблица связи альбомов и треков
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS album_tracks (
+                    album_id INTEGER NOT NULL,
+                    track_id TEXT NOT NULL,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (album_id, track_id),
+                    FOREIGN KEY (album_id) REFERENCES albums (id) ON DELETE CASCADE,
+                    FOREIGN KEY (track_id) REFERENCES tracks (id) ON DELETE CASCADE
+                )
+            """)
+            
+            # Таблица скачанных треков
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS downloaded_tracks (
+                    user_id INTEGER NOT NULL,
+                    track_id TEXT NOT NULL,
+                    downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, track_id),
+                    FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+                    FOREIGN KEY (track_id) REFERENCES tracks (id)
+                )
+            """)
+            
+            # Кэш file_id, выданных Telegram после первой отправки трека
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS telegram_files (
+                    track_id TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Кэш результатов поиска VK
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    query TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    results TEXT NOT NULL,
+                    cached_at REAL NOT NULL,
+                    PRIMARY KEY (query, page)
+                )
+            """)
+            
+            # Кэш распознавания Shazam по file_unique_id и хэшу содержимого
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_cache (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    matched INTEGER NOT NULL,
+                    cached_at REAL NOT NULL
+                )
+            """)
+            
+            # Сессии поиска: результаты, которые листаются кнопками
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS search_sessions (
+                    id TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    results TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            
+            # Состояния FSM пользователей
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    chat TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (chat, user)
+                )
+            """)
+            
+            await db.commit()
+            
+            await self._migrate(db)
+            await self._check_query_plans(db)
+            
+            logger.info("База данных инициализирована")
+        
+        except Exception as e:
+            logger.error(f"Ошибка инициализации БД: {e}")
+            raise
+    
+    async def _migrate(self, db: aiosqlite.Connection):
+        """Применение недостающих миграций схемы"""
+        cursor = await db.execute("PRAGMA user_version")
+        row = await cursor.fetchone()
+        current_version = row[0]
+        
+        for version, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            
+            for statement in statements:
+                await db.execute(statement)
+            # PRAGMA не поддерживает параметры, версия - число из MIGRATIONS
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.commit()
+            
+            logger.info(f"Схема базы данных обновлена до версии {version}")
+    
+    async def _check_query_plans(self, db: aiosqlite.Connection):
+        """Проверка, что частые запросы используют свои индексы.
+        
+        Запрос без индекса на больших таблицах сканирует их целиком,
+        поэтому такая регрессия останавливает запуск, а не пишется в лог.
+        """
+        failures = []
+        for query, params, index_name in QUERY_PLAN_CHECKS:
+            cursor = await db.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = " ".join(row['detail'] for row in await cursor.fetchall())
+            if index_name not in plan:
+                failures.append(f"{query} не использует {index_name}: {plan}")
+        
+        if failures:
+            raise QueryPlanError("; ".join(failures))
+    
+    @traced("db.create_user")
+    async def create_user(self, telegram_id: int, username: str = None, first_name: str = None):
+        """Создание пользователя"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "INSERT OR IGNORE INTO users (telegram_id, username, first_name) VALUES (?, ?, ?)",
+                    (telegram_id, username, first_name)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка создания пользователя: {e}")
+    
+    @traced("db.create_album")
+    async def create_album(self, user_id: int, name: str) -> int:
+        """Создание альбома"""
+        try:
+            async with self._transaction() as db:
+                cursor = await db.execute(
+                    "INSERT INTO albums (user_id, name) VALUES (?, ?)",
+                    (user_id, name)
+                )
+                album_id = cursor.lastrowid
+            return album_id
+        except Exception as e:
+            logger.error(f"Ошибка создания альбома: {e}")
+            raise
+    
+    @traced("db.get_user_albums")
+    async def get_user_albums(self, user_id: int) -> List[Dict]:
+        """Получение альбомов пользователя с количеством треков"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                """SELECT a.*, (
+                       SELECT COUNT(*) FROM album_tracks AS at WHERE at.album_id = a.id
+                   ) AS track_count
+                   FROM albums AS a
+                   WHERE a.user_id = ?
+                   ORDER BY a.created_at DESC""",
+                (user_id,)
+            )
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка получения альбомов: {e}")
+            return []
+    
+    @traced("db.get_album_by_name")
+    async def get_album_by_name(self, user_id: int, name: str) -> Optional[Dict]:
+        """Получение альбома по названию"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT * FROM albums WHERE user_id = ? AND name = ?",
+                (user_id, name)
+            )
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения альбома: {e}")
+            return None
+    
+    @traced("db.get_album_by_id")
+    async def get_album_by_id(self, album_id: int) -> Optional[Dict]:
+        """Получение альбома по ID"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT * FROM albums WHERE id = ?",
+                (album_id,)
+            )
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения альбома: {e}")
+            return None
+    
+    @traced("db.save_track")
+    async def save_track(self, track_info: Dict):
+        """Сохранение информации о треке"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    """INSERT OR REPLACE INTO tracks 
+                       (id, title, artist, duration, url, thumb_url) 
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (
+                        track_info['id'],
+                        track_info['title'],
+                        track_info['artist'],
+                        track_info.get('duration', 0),
+                        track_info.get('url'),
+                        track_info.get('thumb_url')
+                    )
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения трека: {e}")
+    
+    @traced("db.add_track_to_album")
+    async def add_track_to_album(self, album_id: int, track_id: str):
+        """Добавление трека в альбом"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "INSERT OR IGNORE INTO album_tracks (album_id, track_id) VALUES (?, ?)",
+                    (album_id, track_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка добавления трека в альбом: {e}")
+            raise
+    
+    @traced("db.track_exists_in_album")
+    async def track_exists_in_album(self, album_id: int, track_id: str) -> bool:
+        """Проверка существования трека в альбоме"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT 1 FROM album_tracks WHERE album_id = ? AND track_id = ?",
+                (album_id, track_id)
+            )
+            row = await cursor.fetchone()
+            return row is not None
+        except Exception as e:
+            logger.error(f"Ошибка проверки трека в альбоме: {e}")
+            return False
+    
+    @traced("db.get_album_track_count")
+    async def get_album_track_count(self, album_id: int) -> int:
+        """Получение количества треков в альбоме"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM album_tracks WHERE album_id = ?",
+                (album_id,)
+            )
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Ошибка подсчета треков: {e}")
+            return 0
+    
+    @traced("db.get_album_tracks")
+    async def get_album_tracks(self, album_id: int) -> List[Dict]:
+        """Получение треков альбома вместе с сохраненными file_id"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                """SELECT at.track_id AS id, t.title, t.artist, t.duration, f.file_id
+                   FROM album_tracks AS at
+                   LEFT JOIN tracks AS t ON t.id = at.track_id
+                   LEFT JOIN telegram_files AS f ON f.track_id = at.track_id
+                   WHERE at.album_id = ?
+                   ORDER BY at.added_at""",
+                (album_id,)
+            )
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка получения треков альбома: {e}")
+            return []
+    
+    @traced("db.save_downloaded_track")
+    async def save_downloaded_track(self, user_id: int, track_id: str, track_info: Dict):
+        """Сохранение информации о скачанном треке"""
+        try:
+            async with self._transaction() as db:
+                
+                # Трек и отметку о скачивании записываем одной транзакцией
+                await db.execute(
+                    """INSERT OR REPLACE INTO tracks 
+                       (id, title, artist, duration, url, thumb_url) 
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (
+                        track_info['id'],
+                        track_info['title'],
+                        track_info['artist'],
+                        track_info.get('duration', 0),
+                        track_info.get('url'),
+                        track_info.get('thumb_url')
+                    )
+                )
+                await db.execute(
+                    "INSERT OR REPLACE INTO downloaded_tracks (user_id, track_id) VALUES (?, ?)",
+                    (user_id, track_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения скачанного трека: {e}")
+    
+    @traced("db.mark_track_downloaded")
+    async def mark_track_downloaded(self, user_id: int, track_id: str):
+        """Отметка трека как скачанного пользователем"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "INSERT OR REPLACE INTO downloaded_tracks (user_id, track_id) VALUES (?, ?)",
+                    (user_id, track_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка отметки скачанного трека: {e}")
+    
+    @traced("db.get_cached_file_id")
+    async def get_cached_file_id(self, track_id: str) -> Optional[str]:
+        """Получение сохраненного Telegram file_id трека"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT file_id FROM telegram_files WHERE track_id = ?",
+                (track_id,)
+            )
+            row = await cursor.fetchone()
+            CACHE_REQUESTS.inc(cache="file_id", result="hit" if row else "miss")
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения file_id: {e}")
+            return None
+    
+    @traced("db.save_file_id")
+    async def save_file_id(self, track_id: str, file_id: str, file_unique_id: str = None):
+        """Сохранение Telegram file_id трека"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    """INSERT OR REPLACE INTO telegram_files 
+                       (track_id, file_id, file_unique_id) 
+                       VALUES (?, ?, ?)""",
+                    (track_id, file_id, file_unique_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения file_id: {e}")
+    
+    @traced("db.delete_file_id")
+    async def delete_file_id(self, track_id: str):
+        """Удаление устаревшего Telegram file_id трека"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "DELETE FROM telegram_files WHERE track_id = ?",
+                    (track_id,)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка удаления file_id: {e}")
+    
+    @traced("db.get_search_results")
+    async def get_search_results(self, query: str, page: int, max_age: float) -> Optional[List[Dict]]:
+        """Получение закэшированных результатов поиска, если они не устарели"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT results FROM search_cache WHERE query = ? AND page = ? AND cached_at >= ?",
+                (query, page, time.time() - max_age)
+            )
+            row = await cursor.fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения кэша поиска: {e}")
+            return None
+    
+    @traced("db.save_search_results")
+    async def save_search_results(self, query: str, page: int, results: List[Dict]):
+        """Сохранение результатов поиска в кэш"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    """INSERT OR REPLACE INTO search_cache 
+                       (query, page, results, cached_at) 
+                       VALUES (?, ?, ?, ?)""",
+                    (query, page, json.dumps(results, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша поиска: {e}")
+    
+    async def prune_search_cache(self, max_age: float, max_rows: int):
+        """Удаление устаревших и самых старых записей кэша поиска"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "DELETE FROM search_cache WHERE cached_at < ?",
+                    (time.time() - max_age,)
+                )
+                await db.execute(
+                    """DELETE FROM search_cache WHERE rowid IN (
+                           SELECT rowid FROM search_cache 
+                           ORDER BY cached_at DESC LIMIT -1 OFFSET ?
+                       )""",
+                    (max_rows,)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша поиска: {e}")
+    
+    @traced("db.get_search_session")
+    async def get_search_session(self, session_id: str, max_age: float) -> Optional[Dict]:
+        """Получение сессии поиска, если она не устарела"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                "SELECT query, results FROM search_sessions WHERE id = ? AND created_at >= ?",
+                (session_id, time.time() - max_age)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            return {'query': row['query'], 'results': json.loads(row['results'])}
+        except Exception as e:
+            logger.error(f"Ошибка получения сессии поиска: {e}")
+            return None
+    
+    @traced("db.save_search_session")
+    async def save_search_session(self, session_id: str, query: str, results: List[Dict]):
+        """Сохранение сессии поиска"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    """INSERT OR REPLACE INTO search_sessions 
+                       (id, query, results, created_at) 
+                       VALUES (?, ?, ?, ?)""",
+                    (session_id, query, json.dumps(results, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сессии поиска: {e}")
+    
+    async def prune_search_sessions(self, max_age: float):
+        """Удаление устаревших сессий поиска"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "DELETE FROM search_sessions WHERE created_at < ?",
+                    (time.time() - max_age,)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка очистки сессий поиска: {e}")
+    
+    @traced("db.get_recognition")
+    async def get_recognition(self, key: str, max_age: float, negative_max_age: float) -> Optional[Dict]:
+        """Получение закэшированного результата распознавания, если он не устарел"""
+        try:
+            db = await self._get_connection()
+            now = time.time()
+            cursor = await db.execute(
+                """SELECT result FROM recognition_cache 
+                   WHERE key = ? AND cached_at >= CASE WHEN matched THEN ? ELSE ? END""",
+                (key, now - max_age, now - negative_max_age)
+            )
+            row = await cursor.fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка получения кэша распознавания: {e}")
+            return None
+    
+    @traced("db.save_recognition")
+    async def save_recognition(self, keys: List[str], result: Dict, matched: bool):
+        """Сохранение результата распознавания под несколькими ключами"""
+        try:
+            async with self._transaction() as db:
+                payload = json.dumps(result, ensure_ascii=False)
+                now = time.time()
+                await db.executemany(
+                    """INSERT OR REPLACE INTO recognition_cache 
+                       (key, result, matched, cached_at) 
+                       VALUES (?, ?, ?, ?)""",
+                    [(key, payload, int(matched), now) for key in keys]
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения кэша распознавания: {e}")
+    
+    async def prune_recognition_cache(self, max_age: float, negative_max_age: float):
+        """Удаление устаревших результатов распознавания"""
+        try:
+            async with self._transaction() as db:
+                now = time.time()
+                await db.execute(
+                    "DELETE FROM recognition_cache WHERE cached_at < ? OR (NOT matched AND cached_at < ?)",
+                    (now - max_age, now - negative_max_age)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша распознавания: {e}")
+    
+    @traced("db.get_fsm_record")
+    async def get_fsm_record(self, chat: str, user: str, max_age: float) -> Optional[Dict]:
+        """Получение состояния FSM пользователя, если оно не устарело"""
+        try:
+            db = await self._get_connection()
+            cursor = await db.execute(
+                """SELECT state, data, bucket FROM fsm_storage 
+                   WHERE chat = ? AND user = ? AND updated_at >= ?""",
+                (chat, user, time.time() - max_age)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            return {
+                'state': row['state'],
+                'data': json.loads(row['data']),
+                'bucket': json.loads(row['bucket'])
+            }
+        except Exception as e:
+            logger.error(f"Ошибка получения состояния FSM: {e}")
+            return None
+    
+    @traced("db.save_fsm_records")
+    async def save_fsm_records(self, records: List[Tuple[str, str, Dict]]):
+        """Сохранение пачки состояний FSM одной транзакцией.
+        
+        Пустые состояния удаляются из таблицы.
+        """
+        now = time.time()
+        to_save = []
+        to_delete = []
+        for chat, user, record in records:
+            if record['state'] is None and not record['data'] and not record['bucket']:
+                to_delete.append((chat, user))
+            else:
+                to_save.append((
+                    chat,
+                    user,
+                    record['state'],
+                    json.dumps(record['data'], ensure_ascii=False),
+                    json.dumps(record['bucket'], ensure_ascii=False),
+                    now
+                ))
+        
+        try:
+            async with self._transaction() as db:
+                if to_save:
+                    await db.executemany(
+                        """INSERT OR REPLACE INTO fsm_storage 
+                           (chat, user, state, data, bucket, updated_at) 
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        to_save
+                    )
+                if to_delete:
+                    await db.executemany(
+                        "DELETE FROM fsm_storage WHERE chat = ? AND user = ?",
+                        to_delete
+                    )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояний FSM: {e}")
+            raise
+    
+    async def delete_expired_fsm_records(self, max_age: float):
+        """Удаление устаревших состояний FSM"""
+        try:
+            async with self._transaction() as db:
+                await db.execute(
+                    "DELETE FROM fsm_storage WHERE updated_at < ?",
+                    (time.time() - max_age,)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка очистки состояний FSM: {e}")
@@ -0,0 +1,446 @@
+import asyncio
+from typing import Any, Awaitable, BinaryIO, Dict, List, Optional, Set, Tuple
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest
+
+from config import Config
+from cover_cache import CoverCache
+from database import Database
+from transcoder import Transcoder
+from vk_client import VKClient
+from utils.cache import SingleFlight
+from utils.circuit_breaker import ServiceUnavailableError
+from utils.logger import setup_logger
+from utils.metrics import (
+    DOWNLOAD_STAGE_LATENCY, DOWNLOAD_STAGE_TIMEOUTS, DOWNLOADS_IN_FLIGHT, TELEGRAM_UPLOAD_LATENCY
+)
+from utils.outbound import progress_update
+from utils.tracing import traced, tracer
+
+logger = setup_logger(__name__)
+
+# Максимум файлов в одной медиагруппе Telegram
+MEDIA_GROUP_SIZE = 10
+
+# Сколько треков альбома скачивается одновременно
+ALBUM_DOWNLOAD_CONCURRENCY = 3
+
+class StatusUpdater:
+    """Обновляет сообщение о статусе, не задерживая скачивание.
+    
+    Правки отправляются в фоне как обновления статуса: планировщик
+    исходящих запросов держит их в порядке отправки и пропускает те,
+    что успела сменить более новая правка. Ошибки и таймауты правок
+    только логируются: статус не стоит того, чтобы из-за него не дошел трек.
+    """
+    
+    def __init__(self, message: types.Message, timeout: float):
+        self.message = message
+        self.timeout = timeout
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def update(self, text: str):
+        """Ставит правку в очередь и сразу возвращает управление"""
+        task = asyncio.create_task(self._edit(text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _edit(self, text: str):
+        try:
+            with progress_update():
+                await asyncio.wait_for(self.message.edit_text(text), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Статус не обновился за {self.timeout} сек, пропускаю: {text}")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус: {e}")
+
+class DownloadCoordinator:
+    """Объединяет одновременные скачивания одного трека в одну загрузку"""
+    
+    def __init__(self):
+        self._flight = SingleFlight()
+        self._transcoder: Optional[Transcoder] = None
+        self._cover_cache: Optional[CoverCache] = None
+        self._config: Optional[Config] = None
+        DOWNLOADS_IN_FLIGHT.set_function(lambda: self.in_flight)
+    
+    @property
+    def config(self) -> Config:
+        """Конфигурация загружается при первом скачивании, а не при импорте модуля"""
+        if self._config is None:
+            self._config = Config()
+        return self._config
+    
+    @property
+    def transcoder(self) -> Transcoder:
+        """Перекодировщик создается при первом скачивании, когда конфигурация уже загружена"""
+        if self._transcoder is None:
+            self._transcoder = Transcoder()
+        return self._transcoder
+    
+    @property
+    def cover_cache(self) -> CoverCache:
+        """Кэш обложек создается при первом скачивании, как и перекодировщик"""
+        if self._cover_cache is None:
+            self._cover_cache = CoverCache()
+        return self._cover_cache
+    
+    async def _download(self, track_info: Dict, vk_client: VKClient) -> BinaryIO:
+        """Скачивает трек и при необходимости перекодирует его под лимит Telegram"""
+        audio_data = self.transcoder.open_cached(track_info['id'])
+        if audio_data is not None:
+            return audio_data
+        
+        audio_data = await vk_client.download_audio(
+            track_info['url'],
+            max_size=self.transcoder.max_source_size
+        )
+        return await self.transcoder.fit(
+            track_info['id'],
+            audio_data,
+            track_info.get('duration', 0)
+        )
+    
+    @property
+    def in_flight(self) -> int:
+        """Количество треков, которые скачиваются прямо сейчас"""
+        return len(self._flight)
+    
+    async def send_track(
+        self,
+        message: types.Message,
+        track_id: str,
+        vk_client: VKClient,
+        db: Optional[Database],
+        status_msg: types.Message,
+        reply_markup: Optional[types.InlineKeyboardMarkup] = None
+    ) -> Optional[Dict]:
+        """Отправляет трек в чат сообщения.
+        
+        Первый запрос скачивает трек из VK и загружает его в Telegram,
+        одновременные запросы того же трека ждут его и переотправляют
+        полученный file_id. Возвращает информацию о треке или None,
+        если трек не найден.
+        """
+        result, leader = await self._flight.run(
+            track_id,
+            lambda: self._download_and_upload(
+                message, track_id, vk_client, db, status_msg, reply_markup
+            )
+        )
+        
+        if result is None:
+            return None
+        
+        file_id, track_info = result
+        if not leader:
+            await message.answer_audio(file_id, reply_markup=reply_markup)
+            logger.info(f"Трек {track_id} отправлен по file_id из общей загрузки", extra={'sampled': True})
+        
+        return track_info
+    
+    async def _stage(self, stage: str, awaitable: Awaitable[Any], timeout: float) -> Any:
+        """Выполняет этап скачивания со своим таймаутом"""
+        with tracer.span(f"download.{stage}"), DOWNLOAD_STAGE_LATENCY.time(stage=stage):
+            try:
+                return await asyncio.wait_for(awaitable, timeout)
+            except asyncio.TimeoutError:
+                DOWNLOAD_STAGE_TIMEOUTS.inc(stage=stage)
+                raise
+    
+    async def _fetch_thumb(self, track_info: Dict, vk_client: VKClient) -> Optional[types.InputFile]:
+        """Миниатюра обложки или None: без обложки трек все равно отправляется"""
+        if not track_info.get('thumb_url'):
+            return None
+        
+        try:
+            # shield: по таймауту обложка дозагружается в кэш для следующих запросов
+            thumb_data = await self._stage(
+                "cover",
+                asyncio.shield(self.cover_cache.get_thumbnail(track_info['thumb_url'], vk_client)),
+                self.config.COVER_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Обложка трека {track_info['id']} не успела загрузиться, отправляю без нее")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка получения обложки: {e}")
+            return None
+        
+        if thumb_data is None:
+            return None
+        return types.InputFile(thumb_data, filename="cover.jpg")
+    
+    @traced("download.track")
+    async def _download_and_upload(
+        self,
+        message: types.Message,
+        track_id: str,
+        vk_client: VKClient,
+        db: Optional[Database],
+        status_msg: types.Message,
+        reply_markup: Optional[types.InlineKeyboardMarkup]
+    ) -> Optional[Tuple[str, Dict]]:
+        """Скачивает трек из VK и загружает его в Telegram.
+        
+        Независимые этапы идут одновременно: статус обновляется в фоне,
+        обложка скачивается параллельно с аудио. Без обложки трек
+        отправляется, без аудио или информации о треке - нет.
+        """
+        status = StatusUpdater(status_msg, self.config.STATUS_EDIT_TIMEOUT)
+        thumb_task: Optional[asyncio.Task] = None
+        try:
+            status.update("📥 Загружаю аудио файл...")
+            
+            try:
+                track_info = await self._stage(
+                    "track_info",
+                    vk_client.get_track_by_id(track_id),
+                    self.config.TRACK_INFO_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise ServiceUnavailableError("VK не вернул информацию о треке вовремя")
+            if not track_info:
+                return None
+            
+            thumb_task = asyncio.create_task(self._fetch_thumb(track_info, vk_client))
+            
+            try:
+                audio_data = await self._stage(
+                    "audio",
+                    self._download(track_info, vk_client),
+                    self.config.AUDIO_DOWNLOAD_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise ServiceUnavailableError("VK не отдал аудио вовремя")
+            
+            try:
+                status.update("📤 Отправляю...")
+                thumb = await thumb_task
+                
+                audio_file = types.InputFile(
+                    audio_data,
+                    filename=f"{track_info['artist']} - {track_info['title']}.mp3"
+                )
+                
+                with TELEGRAM_UPLOAD_LATENCY.time(kind="audio"):
+                    sent_msg = await self._stage(
+                        "upload",
+                        message.answer_audio(
+                            audio_file,
+                            duration=track_info.get('duration', 0),
+                            performer=track_info['artist'],
+                            title=track_info['title'],
+                            thumb=thumb,
+                            reply_markup=reply_markup
+                        ),
+                        self.config.UPLOAD_TIMEOUT
+                    )
+            finally:
+                # Временный файл больше не нужен
+                audio_data.close()
+        finally:
+            if thumb_task is not None and not thumb_task.done():
+                thumb_task.cancel()
+        
+        # Запоминаем file_id для повторных запросов
+        file_id = sent_msg.audio.file_id
+        if db:
+            await db.save_file_id(track_id, file_id, sent_msg.audio.file_unique_id)
+        
+        return file_id, track_info
+    
+    @traced("download.album")
+    async def send_album(
+        self,
+        message: types.Message,
+        tracks: List[Dict],
+        vk_client: VKClient,
+        db: Database
+    ) -> int:
+        """Отправляет треки альбома медиагруппами по 10.
+        
+        Треки с сохраненным file_id переотправляются без VK, для остальных
+        метаданные запрашиваются пакетно, а аудио скачивается параллельно
+        с ограничением. Возвращает количество отправленных треков.
+        """
+        missing_ids = [track['id'] for track in tracks if not track.get('file_id')]
+        try:
+            resolved = await vk_client.get_tracks_by_ids(missing_ids)
+        except ServiceUnavailableError as e:
+            # Без VK отправляем хотя бы треки с сохраненным file_id
+            if len(missing_ids) == len(tracks):
+                raise
+            logger.warning(f"VK недоступен, отправляю только сохраненные треки: {e}")
+            resolved = {}
+        
+        semaphore = asyncio.Semaphore(ALBUM_DOWNLOAD_CONCURRENCY)
+        batches = [
+            tracks[i:i + MEDIA_GROUP_SIZE]
+            for i in range(0, len(tracks), MEDIA_GROUP_SIZE)
+        ]
+        
+        sent = 0
+        pending = asyncio.ensure_future(
+            self._prepare_batch(batches[0], resolved, vk_client, semaphore)
+        )
+        try:
+            for index in range(len(batches)):
+                prepared = await pending
+                
+                # Пока отправляется текущая пачка, скачиваем следующую
+                if index + 1 < len(batches):
+                    pending = asyncio.ensure_future(
+                        self._prepare_batch(batches[index + 1], resolved, vk_client, semaphore)
+                    )
+                
+                if not prepared:
+                    continue
+                
+                try:
+                    try:
+                        sent += await self._send_batch(message, prepared, db)
+                    except BadRequest as e:
+                        # Пачку целиком отклонил устаревший file_id: скачиваем такие треки заново
+                        if all(audio_data is not None for _, _, audio_data in prepared):
+                            raise
+                        logger.warning(f"Устаревший file_id в пачке альбома: {e}")
+                        prepared = await self._replace_file_ids(prepared, vk_client, db, semaphore)
+                        if prepared:
+                            sent += await self._send_batch(message, prepared, db)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки части альбома: {e}")
+                finally:
+                    for _, _, audio_data in prepared:
+                        if audio_data is not None:
+                            audio_data.close()
+        finally:
+            if not pending.done():
+                pending.cancel()
+        
+        return sent
+    
+    async def _prepare_batch(
+        self,
+        batch: List[Dict],
+        resolved: Dict[str, Dict],
+        vk_client: VKClient,
+        semaphore: asyncio.Semaphore
+    ) -> List[Tuple]:
+        """Готовит пачку треков к отправке: file_id или скачанный файл"""
+        results = await asyncio.gather(
+            *(self._prepare_track(track, resolved, vk_client, semaphore) for track in batch),
+            return_exceptions=True
+        )
+        
+        prepared = []
+        for track, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось скачать трек {track['id']}: {result}")
+            elif result is not None:
+                prepared.append(result)
+        return prepared
+    
+    async def _prepare_track(
+        self,
+        track: Dict,
+        resolved: Dict[str, Dict],
+        vk_client: VKClient,
+        semaphore: asyncio.Semaphore
+    ) -> Optional[Tuple]:
+        """Возвращает информацию о треке, медиа для отправки и временный файл"""
+        if track.get('file_id'):
+            return track, track['file_id'], None
+        
+        track_info = resolved.get(track['id'])
+        if not track_info:
+            logger.warning(f"Трек {track['id']} не найден в VK")
+            return None
+        
+        async with semaphore:
+            audio_data = await self._download(track_info, vk_client)
+        
+        audio_file = types.InputFile(
+            audio_data,
+            filename=f"{track_info['artist']} - {track_info['title']}.mp3"
+        )
+        return track_info, audio_file, audio_data
+    
+    async def _replace_file_ids(
+        self,
+        prepared: List[Tuple],
+        vk_client: VKClient,
+        db: Database,
+        semaphore: asyncio.Semaphore
+    ) -> List[Tuple]:
+        """Удаляет file_id пачки и скачивает эти треки заново.
+        
+        Telegram не сообщает, какой file_id в медиагруппе устарел, поэтому
+        заменяются все. Порядок треков сохраняется, треки, которые не удалось
+        скачать, выпадают из пачки.
+        """
+        cached = [track for track, _, audio_data in prepared if audio_data is None]
+        for track in cached:
+            await db.delete_file_id(track['id'])
+        
+        resolved = await vk_client.get_tracks_by_ids([track['id'] for track in cached])
+        downloaded = await self._prepare_batch(
+            [{'id': track['id']} for track in cached],
+            resolved,
+            vk_client,
+            semaphore
+        )
+        replacements = {item[0]['id']: item for item in downloaded}
+        
+        result = []
+        for track, media, audio_data in prepared:
+            if audio_data is None:
+                if track['id'] in replacements:
+                    result.append(replacements[track['id']])
+            else:
+                # Файл уже читался при первой попытке
+                audio_data.seek(0)
+                result.append((track, media, audio_data))
+        return result
+    
+    async def _send_batch(self, message: types.Message, prepared: List[Tuple], db: Database) -> int:
+        """Отправляет пачку треков и сохраняет новые file_id"""
+        if len(prepared) == 1:
+            # Медиагруппа должна содержать минимум два файла
+            track_info, media, _ = prepared[0]
+            with TELEGRAM_UPLOAD_LATENCY.time(kind="audio"):
+                sent_msgs = [
+                    await message.answer_audio(
+                        media,
+                        duration=track_info.get('duration'),
+                        performer=track_info.get('artist'),
+                        title=track_info.get('title')
+                    )
+                ]
+        else:
+            media_group = types.MediaGroup()
+            for track_info, media, _ in prepared:
+                media_group.attach_audio(
+                    media,
+                    duration=track_info.get('duration'),
+                    performer=track_info.get('artist'),
+                    title=track_info.get('title')
+                )
+            with TELEGRAM_UPLOAD_LATENCY.time(kind="media_group"):
+                sent_msgs = await message.answer_media_group(media_group)
+        
+        # Запоминаем file_id загруженных треков
+        for (track_info, _, audio_data), sent_msg in zip(prepared, sent_msgs):
+            if audio_data is not None and sent_msg.audio:
+                await db.save_track(track_info)
+                await db.save_file_id(
+                    track_info['id'],
+                    sent_msg.audio.file_id,
+                    sent_msg.audio.file_unique_id
+                )
+        
+        return len(sent_msgs)
+
+# Общий координатор скачиваний
+download_coordinator = DownloadCoordinator()
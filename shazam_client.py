@@ -1,29 +1,109 @@
-import asyncio
-import io
-from shazamio import Shazam
-from typing import Dict, Optional
-
-from utils.logger import setup_logger
-
-logger = setup_logger(__name__)
-
-class ShazamClient:
-    """Клиент для распознавания музыки через Shazam"""
-    
-    def __init__(self):
-        self.shazam = Shazam()
-    
-    async def recognize(self, audio_data: bytes) -> Optional[Dict]:
-        """Распознавание музыки из аудио данных"""
-        try:
-            # Создаем BytesIO объект из данных
-            audio_buffer = io.BytesIO(audio_data)
-            
-            # Распознаем через Shazam
-            result = await self.shazam.recognize_song(audio_buffer)
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Ошибка распознавания Shazam: {e}")
-            return None
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from shazamio import Shazam
+from shazamio.misc import Request, ShazamUrl
+from typing import Awaitable, Callable, Dict, Optional
+
+from audio_processing import AudioProcessor
+from config import Config
+from utils.cache import RecognitionCache
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.logger import setup_logger
+from utils.metrics import SHAZAM_LATENCY
+from utils.tracing import tracer
+
+logger = setup_logger(__name__)
+
+class ShazamClient:
+    """Клиент для распознавания музыки через Shazam"""
+    
+    # Автомат отключения при сбоях Shazam
+    breaker: Optional[CircuitBreaker] = None
+    
+    # Кэш результатов распознавания общий для всех экземпляров клиента
+    cache: Optional[RecognitionCache] = None
+    
+    def __init__(self):
+        self.shazam = Shazam()
+        self.processor = AudioProcessor()
+        config = Config()
+        
+        if ShazamClient.cache is None:
+            ShazamClient.cache = RecognitionCache(
+                ttl=config.RECOGNITION_CACHE_TTL,
+                negative_ttl=config.RECOGNITION_NEGATIVE_TTL,
+                max_size=config.RECOGNITION_CACHE_SIZE
+            )
+        
+        if ShazamClient.breaker is None:
+            ShazamClient.breaker = CircuitBreaker(
+                "shazam",
+                window=config.CIRCUIT_WINDOW,
+                failure_rate=config.CIRCUIT_FAILURE_RATE,
+                slow_call=config.SHAZAM_SLOW_CALL,
+                base_backoff=config.CIRCUIT_BASE_BACKOFF,
+                max_backoff=config.CIRCUIT_MAX_BACKOFF
+            )
+    
+    async def recognize(self, audio_data: bytes) -> Optional[Dict]:
+        """Распознавание музыки из аудио данных.
+        
+        Пока Shazam недоступен, сразу вызывает CircuitOpenError.
+        """
+        try:
+            # Декодирование и сигнатура строятся в пуле процессов, а не в цикле событий.
+            # Клип, который не удалось разобрать, - ошибка пользователя, а не сбой Shazam,
+            # поэтому подготовка идет вне автомата отключения
+            try:
+                prepared = await self.processor.prepare_for_recognition(audio_data)
+            except BrokenProcessPool:
+                # Сбой пула, а не клипа: такой результат не должен попасть в кэш
+                raise
+            except Exception as e:
+                logger.warning(f"Не удалось подготовить клип: {e}")
+                return {'matches': []}
+            
+            if prepared is None:
+                # Клип слишком короткий для распознавания
+                return {'matches': []}
+            
+            uri, samplems = prepared
+            
+            # Распознаем через Shazam
+            async def recognize_song():
+                with tracer.span("shazam.recognize"), SHAZAM_LATENCY.time():
+                    return await self._send_signature(uri, samplems)
+            
+            result = await self.breaker.call(recognize_song)
+            
+            return result
+        
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка распознавания Shazam: {e}")
+            return None
+    
+    async def _send_signature(self, uri: str, samplems: int) -> Dict:
+        """Запрос распознавания по готовой сигнатуре, как его отправляет shazamio"""
+        data = self.shazam.data_search(Request.TIME_ZONE, uri, samplems, int(time.time() * 1000))
+        url = ShazamUrl.SEARCH_FROM_FILE.format(
+            language=self.shazam.language,
+            endpoint_country=self.shazam.endpoint_country,
+            uuid_1=str(uuid.uuid4()).upper(),
+            uuid_2=str(uuid.uuid4()).upper()
+        )
+        return await self.shazam.request("POST", url, headers=self.shazam.headers(), json=data)
+    
+    async def recognize_file(
+        self,
+        file_unique_id: str,
+        download: Callable[[], Awaitable[bytes]]
+    ) -> Optional[Dict]:
+        """Распознавание файла Telegram с использованием кэша.
+        
+        download вызывается, только если клипа с таким file_unique_id
+        еще нет в кэше. Результат урезан до трека и первого совпадения.
+        """
+        return await self.cache.get_or_recognize(file_unique_id, download, self.recognize)
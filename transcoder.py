@@ -0,0 +1,199 @@
+import asyncio
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from config import Config
+from vk_client import DownloadTooLargeError
+from utils.logger import setup_logger
+from utils.metrics import AUDIO_PROCESSING_BYTES, AUDIO_PROCESSING_LATENCY, CACHE_REQUESTS
+from utils.tracing import tracer
+
+logger = setup_logger(__name__)
+
+# Битрейты, которые поддерживает MP3 (кбит/с)
+MP3_BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+# Запас на заголовки и погрешность битрейта
+SIZE_MARGIN = 0.95
+
+class Transcoder:
+    """Перекодирует треки больше лимита Telegram, чтобы их можно было отправить.
+    
+    Битрейт подбирается по длительности трека. Перекодирование идет в
+    отдельном процессе ffmpeg, исходный и готовый файлы лежат на диске.
+    Одновременно работает не больше TRANSCODE_WORKERS процессов, отдельно
+    от пула распознавания, чтобы длинные треки не задерживали Shazam.
+    Результат кэшируется по ID трека, кэш ограничен общим размером и
+    вытесняет давно не использованные файлы.
+    """
+    
+    # Ограничение числа процессов ffmpeg общее для всех экземпляров
+    semaphore: Optional[asyncio.Semaphore] = None
+    
+    def __init__(self):
+        self.config = Config()
+        self.enabled = self.config.TRANSCODE_ENABLED
+        self.max_size = self.config.MAX_DOWNLOAD_SIZE
+        self.cache_dir = Path(self.config.TRANSCODE_CACHE_DIR)
+        
+        if Transcoder.semaphore is None:
+            Transcoder.semaphore = asyncio.Semaphore(self.config.TRANSCODE_WORKERS)
+    
+    @property
+    def max_source_size(self) -> int:
+        """Сколько можно скачать из VK: с перекодированием больше лимита Telegram"""
+        if self.enabled:
+            return max(self.config.MAX_SOURCE_SIZE, self.max_size)
+        return self.max_size
+    
+    def _cache_path(self, track_id: str) -> Path:
+        return self.cache_dir / f"{track_id}.mp3"
+    
+    def open_cached(self, track_id: str) -> Optional[BinaryIO]:
+        """Открывает уже перекодированный трек, если он есть в кэше"""
+        if not self.enabled:
+            return None
+        
+        path = self._cache_path(track_id)
+        try:
+            audio_file = open(path, "rb")
+        except OSError:
+            return None
+        
+        # Время изменения служит временем последнего использования для вытеснения
+        os.utime(path)
+        CACHE_REQUESTS.inc(cache="transcode", result="hit")
+        return audio_file
+    
+    def bitrate_for(self, duration: int) -> Optional[int]:
+        """Наибольший битрейт, при котором трек уложится в лимит"""
+        if not duration:
+            return None
+        
+        limit = min(
+            self.max_size * SIZE_MARGIN * 8 / duration / 1000,
+            self.config.TRANSCODE_MAX_BITRATE
+        )
+        suitable = [bitrate for bitrate in MP3_BITRATES if bitrate <= limit]
+        return suitable[-1] if suitable else None
+    
+    async def fit(self, track_id: str, audio_data: BinaryIO, duration: int) -> BinaryIO:
+        """Возвращает файл, который помещается в лимит Telegram.
+        
+        Файлы в пределах лимита возвращаются как есть, иначе перекодируются.
+        Исходный файл закрывается, если вместо него вернулся другой.
+        """
+        audio_data.seek(0, os.SEEK_END)
+        size = audio_data.tell()
+        audio_data.seek(0)
+        if size <= self.max_size:
+            return audio_data
+        
+        try:
+            bitrate = self.bitrate_for(duration) if self.enabled else None
+            if bitrate is None:
+                raise DownloadTooLargeError(
+                    f"Размер файла {size} больше {self.max_size}, перекодировать нельзя"
+                )
+            
+            CACHE_REQUESTS.inc(cache="transcode", result="miss")
+            path = await self._transcode(track_id, audio_data, bitrate)
+        finally:
+            audio_data.close()
+        
+        # Файл открываем до очистки кэша, чтобы его не вытеснили раньше отправки
+        transcoded = open(path, "rb")
+        await asyncio.get_running_loop().run_in_executor(None, self._evict)
+        
+        output_size = os.fstat(transcoded.fileno()).st_size
+        AUDIO_PROCESSING_BYTES.inc(size, task="transcode", stage="input")
+        AUDIO_PROCESSING_BYTES.inc(output_size, task="transcode", stage="output")
+        logger.info(f"Трек {track_id} перекодирован в {bitrate} кбит/с: {size} -> {output_size} байт")
+        return transcoded
+    
+    async def _transcode(self, track_id: str, audio_data: BinaryIO, bitrate: int) -> Path:
+        """Перекодирует трек в кэш и возвращает путь к готовому файлу"""
+        loop = asyncio.get_running_loop()
+        work_dir = self.cache_dir / "tmp"
+        work_dir.mkdir(parents=True, exist_ok=True)
+        
+        name = uuid.uuid4().hex
+        source = work_dir / f"{name}.src"
+        output = work_dir / f"{name}.mp3"
+        try:
+            # ffmpeg в другом процессе читает исходник с диска
+            await loop.run_in_executor(None, self._write_file, audio_data, source)
+            
+            async with self.semaphore:
+                with tracer.span("audio.transcode"), AUDIO_PROCESSING_LATENCY.time(task="transcode"):
+                    await self._run_ffmpeg(source, output, bitrate)
+            
+            if output.stat().st_size > self.max_size:
+                raise DownloadTooLargeError(
+                    f"После перекодирования файл {output.stat().st_size} больше {self.max_size}"
+                )
+            
+            # Готовый файл появляется в кэше атомарно
+            path = self._cache_path(track_id)
+            os.replace(output, path)
+        finally:
+            for leftover in (source, output):
+                leftover.unlink(missing_ok=True)
+        
+        return path
+    
+    async def _run_ffmpeg(self, source: Path, output: Path, bitrate: int):
+        """Перекодирует source в MP3 с постоянным битрейтом через ffmpeg.
+        
+        Процесс убивается по таймауту и при отмене задачи.
+        """
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-v", "error",
+            "-i", str(source),
+            "-vn", "-map_metadata", "0",
+            "-codec:a", "libmp3lame", "-b:a", f"{bitrate}k",
+            "-f", "mp3", str(output),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(
+                process.communicate(),
+                timeout=self.config.TRANSCODE_TIMEOUT
+            )
+        except BaseException as e:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Exception(f"ffmpeg не уложился в {self.config.TRANSCODE_TIMEOUT} сек") from e
+            raise
+        
+        if process.returncode != 0:
+            stderr = (stderr or b"").decode("utf-8", "replace").strip()
+            raise Exception(f"ffmpeg завершился с кодом {process.returncode}: {stderr}")
+    
+    @staticmethod
+    def _write_file(audio_data: BinaryIO, path: Path):
+        with open(path, "wb") as f:
+            shutil.copyfileobj(audio_data, f)
+    
+    def _evict(self):
+        """Удаляет давно не использованные файлы, пока кэш больше лимита"""
+        try:
+            files = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry)
+                for entry in self.cache_dir.glob("*.mp3")
+            ]
+            total = sum(size for _, size, _ in files)
+            for _, size, entry in sorted(files):
+                if total <= self.config.TRANSCODE_CACHE_SIZE:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+        except OSError as e:
+            logger.error(f"Ошибка очистки кэша перекодирования: {e}")
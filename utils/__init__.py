@@ -1 +1 @@
-# Утилиты для бота
+# Утилиты для бота
@@ -0,0 +1,66 @@
+import io
+from typing import Optional, Tuple
+
+from pydub import AudioSegment
+from shazamio.converter import Converter
+
+# Формат, из которого Shazam строит сигнатуру
+RECOGNITION_SAMPLE_RATE = 16000
+RECOGNITION_SAMPLE_WIDTH = 2
+
+# Шаг поиска самого громкого фрагмента (мс)
+ENERGY_STEP_MS = 500
+
+# Функции модуля выполняются в пуле процессов. При spawn дочерний процесс
+# заново импортирует главный модуль бота со всеми его зависимостями, но
+# состояние родителя (клиенты, соединения, настройки логов) в него не
+# попадает, поэтому все нужное функции получают через аргументы
+
+def recognition_signature(audio_data: bytes, clip_seconds: float) -> Optional[Tuple[str, int]]:
+    """Строит сигнатуру клипа для запроса к Shazam.
+    
+    Декодирует аудио, сводит его в моно, понижает частоту до 16 кГц,
+    вырезает самый громкий фрагмент длиной clip_seconds и строит по нему
+    сигнатуру так же, как shazamio. Возвращает URI сигнатуры и длину
+    фрагмента в миллисекундах или None, если клип слишком короткий.
+    """
+    audio = AudioSegment.from_file(io.BytesIO(audio_data))
+    audio = (
+        audio.set_channels(1)
+        .set_frame_rate(RECOGNITION_SAMPLE_RATE)
+        .set_sample_width(RECOGNITION_SAMPLE_WIDTH)
+    )
+    audio = loudest_window(audio, int(clip_seconds * 1000))
+    
+    generator = Converter.create_signature_generator(audio)
+    signature = generator.get_next_signature()
+    if len(generator.input_pending_processing) < 128:
+        return None
+    
+    while not signature:
+        signature = generator.get_next_signature()
+    
+    samplems = int(signature.number_samples / signature.sample_rate_hz * 1000)
+    return signature.encode_to_uri(), samplems
+
+def loudest_window(audio: AudioSegment, window_ms: int) -> AudioSegment:
+    """Фрагмент длиной window_ms с наибольшей суммарной громкостью"""
+    if len(audio) <= window_ms:
+        return audio
+    
+    energies = [
+        audio[start:start + ENERGY_STEP_MS].rms
+        for start in range(0, len(audio), ENERGY_STEP_MS)
+    ]
+    steps = max(1, window_ms // ENERGY_STEP_MS)
+    
+    # Скользящая сумма громкости по окну из steps шагов
+    current = sum(energies[:steps])
+    best, best_index = current, 0
+    for index in range(1, len(energies) - steps + 1):
+        current += energies[index + steps - 1] - energies[index - 1]
+        if current > best:
+            best, best_index = current, index
+    
+    start = best_index * ENERGY_STEP_MS
+    return audio[start:start + window_ms]
@@ -0,0 +1,415 @@
+import asyncio
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import Database
+from utils.logger import setup_logger
+from utils.metrics import CACHE_REQUESTS
+
+logger = setup_logger(__name__)
+
+class LRUCache:
+    """Кэш в памяти с вытеснением давно неиспользуемых записей и TTL"""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+    
+    def get(self, key) -> Optional[Any]:
+        """Получение значения, если оно есть и не устарело"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        """Сохранение значения с вытеснением самых старых записей"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+class _LeaderCancelled(Exception):
+    """Запрос, выполнявший общий вызов, отменен"""
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один"""
+    
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Future] = {}
+    
+    def __len__(self) -> int:
+        return len(self._inflight)
+    
+    async def run(self, key, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Выполняет func или ждет уже начатый вызов с тем же ключом.
+        
+        Возвращает результат и признак того, что вызов выполнил именно этот запрос.
+        """
+        future = self._inflight.get(key)
+        while future is not None:
+            try:
+                return await asyncio.shield(future), False
+            except _LeaderCancelled:
+                # Первый ожидающий выполнит вызов сам, остальные дождутся его
+                future = self._inflight.get(key)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+            return result, True
+        except asyncio.CancelledError:
+            # Отмена касается только этого запроса, ожидающие повторят вызов
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, помечаем его полученным
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+class SearchCache:
+    """Двухуровневый кэш результатов поиска: память и SQLite"""
+    
+    # Как часто (в записях) чистить кэш в базе данных
+    PRUNE_EVERY = 100
+    
+    def __init__(
+        self,
+        ttl: int,
+        max_size: int,
+        max_rows: int,
+        stale_ttl: int = 0,
+        db: Optional[Database] = None
+    ):
+        self.ttl = ttl
+        # Устаревшие записи хранятся дольше и отдаются, когда VK недоступен
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_rows = max_rows
+        self.db = db or Database()
+        self._memory = LRUCache(max_size, ttl)
+        self._flight = SingleFlight()
+        self._writes = 0
+        
+        # Счетчики для подбора TTL
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        
+        for result, attribute in (
+            ("memory", "memory_hits"),
+            ("db", "db_hits"),
+            ("coalesced", "coalesced"),
+            ("miss", "misses"),
+        ):
+            CACHE_REQUESTS.set_function(
+                lambda attribute=attribute: getattr(self, attribute),
+                cache="search",
+                result=result
+            )
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Приводит запрос к единому виду для ключа кэша"""
+        return " ".join(query.lower().split())
+    
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов кэша"""
+        return {
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'stale_hits': self.stale_hits,
+            'memory_size': len(self._memory)
+        }
+    
+    async def get_or_fetch(
+        self,
+        query: str,
+        page: int,
+        fetch: Callable[[], Awaitable[List[Dict]]]
+    ) -> List[Dict]:
+        """Возвращает результаты из кэша или выполняет один общий запрос к VK"""
+        key = (self.normalize_query(query), page)
+        
+        results = self._memory.get(key)
+        if results is not None:
+            self.memory_hits += 1
+            return results
+        
+        # Одинаковые одновременные запросы ждут один общий вызов
+        results, leader = await self._flight.run(key, lambda: self._load(key, fetch))
+        if not leader:
+            self.coalesced += 1
+        return results
+    
+    async def _load(self, key: Tuple[str, int], fetch: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        """Читает результаты из базы данных или запрашивает их у VK"""
+        query, page = key
+        
+        results = await self.db.get_search_results(query, page, self.ttl)
+        if results is not None:
+            self.db_hits += 1
+            self._memory.set(key, results)
+            return results
+        
+        self.misses += 1
+        results = await fetch()
+        
+        self._memory.set(key, results)
+        await self.db.save_search_results(query, page, results)
+        
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            await self.db.prune_search_cache(self.stale_ttl, self.max_rows)
+            logger.info(f"Статистика кэша поиска: {self.stats}")
+        
+        return results
+    
+    async def get_stale(self, query: str, page: int) -> Optional[List[Dict]]:
+        """Возвращает устаревшие результаты из базы данных, если они есть"""
+        results = await self.db.get_search_results(
+            self.normalize_query(query), page, self.stale_ttl
+        )
+        if results is not None:
+            self.stale_hits += 1
+        return results
+
+class SearchSessions:
+    """Сессии поиска: результаты одного запроса под коротким ID.
+    
+    Клавиатура с результатами хранит в callback_data только ID сессии
+    и номер страницы, поэтому длина и символы запроса не важны, а
+    листание страниц берет результаты из сессии без запроса к VK.
+    Сессии хранятся в памяти и в SQLite, чтобы пережить перезапуск.
+    """
+    
+    # Как часто (в записях) чистить сессии в базе данных
+    PRUNE_EVERY = 100
+    
+    # Длина ID сессии в байтах до кодирования (8 символов base64)
+    ID_BYTES = 6
+    
+    def __init__(self, ttl: int, max_size: int, db: Optional[Database] = None):
+        self.ttl = ttl
+        self.db = db or Database()
+        self._memory = LRUCache(max_size, ttl)
+        self._writes = 0
+    
+    async def create(self, query: str, results: List[Dict]) -> str:
+        """Сохраняет результаты поиска и возвращает ID сессии"""
+        session_id = secrets.token_urlsafe(self.ID_BYTES)
+        session = {'query': query, 'results': results}
+        
+        self._memory.set(session_id, session)
+        await self.db.save_search_session(session_id, query, results)
+        
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            await self.db.prune_search_sessions(self.ttl)
+        
+        return session_id
+    
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """Запрос и результаты сессии или None, если сессия устарела"""
+        session = self._memory.get(session_id)
+        if session is not None:
+            CACHE_REQUESTS.inc(cache="search_session", result="memory")
+            return session
+        
+        session = await self.db.get_search_session(session_id, self.ttl)
+        if session is None:
+            CACHE_REQUESTS.inc(cache="search_session", result="miss")
+            return None
+        
+        CACHE_REQUESTS.inc(cache="search_session", result="db")
+        self._memory.set(session_id, session)
+        return session
+
+class RecognitionCache:
+    """Кэш результатов распознавания Shazam: память и SQLite.
+    
+    Результат хранится под двумя ключами: file_unique_id файла в Telegram
+    и хэшем содержимого. Повторно пересланный клип находится без
+    скачивания, а заново загруженный - без обращения к Shazam.
+    Нераспознанные клипы тоже кэшируются, но на меньший срок.
+    """
+    
+    # Как часто (в записях) чистить кэш в базе данных
+    PRUNE_EVERY = 100
+    
+    def __init__(
+        self,
+        ttl: int,
+        negative_ttl: int,
+        max_size: int,
+        db: Optional[Database] = None
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.db = db or Database()
+        self._memory = LRUCache(max_size, ttl)
+        self._misses = LRUCache(max_size, negative_ttl)
+        self._flight = SingleFlight()
+        self._writes = 0
+        
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        
+        for result, attribute in (
+            ("memory", "memory_hits"),
+            ("db", "db_hits"),
+            ("content", "content_hits"),
+            ("coalesced", "coalesced"),
+            ("miss", "misses"),
+        ):
+            CACHE_REQUESTS.set_function(
+                lambda attribute=attribute: getattr(self, attribute),
+                cache="recognition",
+                result=result
+            )
+    
+    @staticmethod
+    def file_key(file_unique_id: str) -> str:
+        return f"file:{file_unique_id}"
+    
+    @staticmethod
+    def content_key(audio_data: bytes) -> str:
+        return f"sha256:{hashlib.sha256(audio_data).hexdigest()}"
+    
+    @staticmethod
+    def compact(result: Dict) -> Dict:
+        """Оставляет от ответа Shazam только то, что нужно обработчикам"""
+        track = result.get('track') or {}
+        return {
+            'matches': [{'id': match.get('id')} for match in result.get('matches', [])[:1]],
+            'track': {
+                'key': track.get('key'),
+                'title': track.get('title'),
+                'subtitle': track.get('subtitle'),
+            } if track else {},
+        }
+    
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов кэша"""
+        return {
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'content_hits': self.content_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'memory_size': len(self._memory) + len(self._misses)
+        }
+    
+    async def get_or_recognize(
+        self,
+        file_unique_id: str,
+        download: Callable[[], Awaitable[bytes]],
+        recognize: Callable[[bytes], Awaitable[Optional[Dict]]]
+    ) -> Optional[Dict]:
+        """Возвращает результат из кэша или скачивает и распознает клип.
+        
+        Одновременные запросы одного файла ждут одно общее распознавание.
+        Ошибки Shazam (recognize вернул None) не кэшируются.
+        """
+        file_key = self.file_key(file_unique_id)
+        
+        result = self._get_memory(file_key)
+        if result is not None:
+            self.memory_hits += 1
+            return result
+        
+        result, leader = await self._flight.run(
+            file_key,
+            lambda: self._load(file_key, download, recognize)
+        )
+        if not leader:
+            self.coalesced += 1
+        return result
+    
+    def _get_memory(self, key: str) -> Optional[Dict]:
+        result = self._memory.get(key)
+        if result is None:
+            result = self._misses.get(key)
+        return result
+    
+    async def _get(self, key: str) -> Optional[Dict]:
+        result = self._get_memory(key)
+        if result is None:
+            result = await self.db.get_recognition(key, self.ttl, self.negative_ttl)
+            if result is not None:
+                self._set_memory([key], result)
+        return result
+    
+    def _set_memory(self, keys: List[str], result: Dict):
+        memory = self._memory if result.get('matches') else self._misses
+        for key in keys:
+            memory.set(key, result)
+    
+    async def _load(
+        self,
+        file_key: str,
+        download: Callable[[], Awaitable[bytes]],
+        recognize: Callable[[bytes], Awaitable[Optional[Dict]]]
+    ) -> Optional[Dict]:
+        """Ищет результат в базе данных, затем по содержимому, затем в Shazam"""
+        result = await self._get(file_key)
+        if result is not None:
+            self.db_hits += 1
+            return result
+        
+        audio_data = await download()
+        content_key = self.content_key(audio_data)
+        
+        # Тот же клип, загруженный в Telegram заново
+        result = await self._get(content_key)
+        if result is not None:
+            self.content_hits += 1
+            await self._save([file_key], result)
+            return result
+        
+        self.misses += 1
+        result = await recognize(audio_data)
+        if result is None:
+            return None
+        
+        result = self.compact(result)
+        await self._save([file_key, content_key], result)
+        return result
+    
+    async def _save(self, keys: List[str], result: Dict):
+        self._set_memory(keys, result)
+        await self.db.save_recognition(keys, result, bool(result.get('matches')))
+        
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            await self.db.prune_recognition_cache(self.ttl, self.negative_ttl)
+            logger.info(f"Статистика кэша распознавания: {self.stats}")
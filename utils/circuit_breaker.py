@@ -0,0 +1,184 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from utils.logger import setup_logger
+from utils.metrics import CIRCUIT_STATE, CIRCUIT_REJECTED
+
+logger = setup_logger(__name__)
+
+# Состояния автомата
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class ServiceUnavailableError(Exception):
+    """Внешний сервис временно недоступен"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(ServiceUnavailableError):
+    """Вызов отклонен, потому что автомат разомкнут"""
+
+class CircuitBreaker:
+    """Автоматический выключатель для вызовов внешнего сервиса.
+    
+    Следит за долей ошибок и медленных вызовов среди последних window
+    вызовов. Если доля превышает порог, автомат размыкается и вызовы
+    сразу отклоняются. Пауза растет экспоненциально со случайным разбросом,
+    после нее пропускаются пробные вызовы: успех замыкает автомат,
+    ошибка снова размыкает его на более долгий срок.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call: float = 10.0,
+        base_backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        half_open_probes: int = 1,
+        ignore: Tuple[Type[BaseException], ...] = ()
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.half_open_probes = half_open_probes
+        self.ignore = ignore
+        
+        self.state = STATE_CLOSED
+        # Результаты последних вызовов: (ошибка, медленный)
+        self._calls: deque = deque(maxlen=window)
+        self._open_until = 0.0
+        self._trips = 0
+        self._probes = 0
+        
+        self.rejected = 0
+
+        CIRCUIT_STATE.set_function(
+            lambda: (STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN).index(self.state),
+            service=name
+        )
+        CIRCUIT_REJECTED.set_function(lambda: self.rejected, service=name)
+    
+    @property
+    def retry_after(self) -> float:
+        """Сколько секунд осталось до пробного вызова"""
+        return max(self._open_until - time.monotonic(), 0.0)
+    
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Состояние автомата для мониторинга"""
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return {
+            'state': self.state,
+            'calls': len(self._calls),
+            'failures': failures,
+            'slow': slow,
+            'trips': self._trips,
+            'rejected': self.rejected
+        }
+    
+    def _allow(self) -> bool:
+        """Проверяет, можно ли выполнить вызов сейчас.
+        
+        Возвращает True, если вызов пробный.
+        """
+        if self.state == STATE_OPEN:
+            if time.monotonic() < self._open_until:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f"Сервис {self.name} временно недоступен",
+                    retry_after=self.retry_after
+                )
+            self.state = STATE_HALF_OPEN
+            self._probes = 0
+            logger.info(f"Автомат {self.name}: пробный вызов")
+        
+        if self.state == STATE_HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f"Сервис {self.name} проверяется",
+                    retry_after=self.base_backoff
+                )
+            self._probes += 1
+            return True
+        
+        return False
+    
+    def _trip(self):
+        """Размыкает автомат с экспоненциальной паузой и разбросом"""
+        self._trips += 1
+        backoff = min(self.base_backoff * 2 ** (self._trips - 1), self.max_backoff)
+        # Разброс не дает всем процессам вернуться к сервису одновременно
+        backoff = backoff / 2 + random.uniform(0, backoff / 2)
+        
+        logger.warning(f"Автомат {self.name} разомкнут на {backoff:.1f} сек: {self.stats}")
+        self.state = STATE_OPEN
+        self._open_until = time.monotonic() + backoff
+        self._calls.clear()
+    
+    def _record(self, failed: bool, duration: float, probe: bool):
+        """Учитывает результат вызова"""
+        slow = duration >= self.slow_call
+        
+        if probe:
+            self._probes -= 1
+            if self.state != STATE_HALF_OPEN:
+                return
+            if failed or slow:
+                self._trip()
+            else:
+                self.state = STATE_CLOSED
+                self._trips = 0
+                self._calls.clear()
+                logger.info(f"Автомат {self.name} замкнут")
+            return
+        
+        # Вызовы, начатые до размыкания, на состояние уже не влияют
+        if self.state != STATE_CLOSED:
+            return
+        
+        self._calls.append((failed, slow))
+        if len(self._calls) < self.min_calls:
+            return
+        
+        failures = sum(1 for is_failed, _ in self._calls if is_failed)
+        slow_calls = sum(1 for _, is_slow in self._calls if is_slow)
+        if max(failures, slow_calls) >= self.failure_rate * len(self._calls):
+            self._trip()
+    
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет вызов через автомат"""
+        probe = self._allow()
+        
+        started = time.monotonic()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            # Отмена ничего не говорит о состоянии сервиса
+            if probe:
+                self._probes -= 1
+            raise
+        except self.ignore:
+            # Отказ до обращения к сервису - не успех и не сбой
+            if probe:
+                self._probes -= 1
+            raise
+        except Exception:
+            self._record(True, time.monotonic() - started, probe)
+            raise
+        
+        self._record(False, time.monotonic() - started, probe)
+        return result
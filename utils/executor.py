@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from utils.logger import setup_logger
+from utils.metrics import EXECUTOR_QUEUE_DEPTH, EXECUTOR_ACTIVE
+
+logger = setup_logger(__name__)
+
+# Приоритеты задач: чем меньше число, тем раньше выполняется задача
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Признак таймаута по умолчанию
+DEFAULT_TIMEOUT = object()
+
+class ExecutorBusyError(Exception):
+    """Очередь исполнителя переполнена"""
+
+class PriorityExecutor:
+    """Пул потоков с ограниченной очередью и приоритетами для блокирующих вызовов"""
+    
+    def __init__(self, name: str, workers: int, queue_size: int, default_timeout: Optional[float] = None):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.default_timeout = default_timeout
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._counter = itertools.count()
+        self.active = 0
+        
+        EXECUTOR_QUEUE_DEPTH.set_function(lambda: self.queue_depth, executor=name)
+        EXECUTOR_ACTIVE.set_function(lambda: self.active, executor=name)
+    
+    @property
+    def queue_depth(self) -> int:
+        """Количество задач, ожидающих выполнения"""
+        return self._queue.qsize() if self._queue else 0
+    
+    def _start(self):
+        """Запускает пул потоков и обработчики очереди в текущем цикле событий"""
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        self._queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.workers)
+        ]
+        logger.info(f"Исполнитель {self.name} запущен: {self.workers} потоков")
+    
+    async def run(
+        self,
+        func: Callable[[], Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Any = DEFAULT_TIMEOUT
+    ) -> Any:
+        """Выполняет блокирующую функцию в пуле и возвращает ее результат.
+        
+        Без явного timeout используется таймаут по умолчанию, None - без таймаута.
+        """
+        if self._queue is None:
+            self._start()
+        
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((priority, next(self._counter), func, future))
+        except asyncio.QueueFull:
+            raise ExecutorBusyError(
+                f"Очередь исполнителя {self.name} переполнена ({self.queue_size})"
+            )
+        
+        # Отмена по таймауту снимает задачу, если она еще не началась
+        return await asyncio.wait_for(future, timeout)
+    
+    async def _worker(self):
+        """Берет задачи из очереди по приоритету и выполняет их в пуле"""
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, func, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                
+                self.active += 1
+                try:
+                    result = await loop.run_in_executor(self._pool, func)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.active -= 1
+            finally:
+                self._queue.task_done()
+    
+    async def shutdown(self):
+        """Останавливает обработчики и пул потоков"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        logger.info(f"Исполнитель {self.name} остановлен")
@@ -1,39 +1,126 @@
-import logging
-import sys
-from pathlib import Path
-
-def setup_logger(name: str) -> logging.Logger:
-    """Настройка логгера"""
-    logger = logging.getLogger(name)
-    
-    if logger.handlers:
-        return logger
-    
-    logger.setLevel(logging.INFO)
-    
-    # Форматтер
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    # Консольный обработчик
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
-    # Файловый обработчик (только если директория существует)
-    try:
-        log_dir = Path("logs")
-        log_dir.mkdir(exist_ok=True)
-        
-        file_handler = logging.FileHandler(
-            log_dir / "bot.log",
-            encoding='utf-8'
-        )
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    except:
-        # Если не можем создать файл логов, продолжаем без него
-        pass
-    
-    return logger
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+
+# Фоновый поток, который пишет записи в консоль и файл
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только часть частых сообщений об успешных действиях.
+
+    Выборке подлежат записи уровня INFO и ниже, помеченные
+    extra={'sampled': True}. Предупреждения и ошибки пишутся всегда.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+def configure_logging(config: Optional[Config] = None):
+    """Настраивает логирование через очередь с одним фоновым писателем.
+
+    Обработчики событий только кладут запись в очередь, а вывод в консоль
+    и запись в файл с ротацией выполняются в отдельном потоке.
+    Без config настройки берутся из переменных окружения.
+    """
+    global _listener
+
+    def setting(name: str):
+        if config is not None:
+            return getattr(config, name)
+        return os.getenv(name, str(getattr(Config, name)))
+
+    if setting("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+
+    # Консольный обработчик
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    handlers = [console_handler]
+
+    # Файловый обработчик (только если директорию можно создать)
+    try:
+        log_file = Path(setting("LOG_FILE"))
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(setting("LOG_MAX_BYTES")),
+            backupCount=int(setting("LOG_BACKUP_COUNT")),
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    except OSError:
+        # Если не можем создать файл логов, продолжаем без него
+        pass
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(float(setting("LOG_SAMPLE_RATE"))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(str(setting("LOG_LEVEL")).upper())
+
+    # Старый писатель дописывает свою очередь и останавливается
+    shutdown_logging()
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+def shutdown_logging():
+    """Дописывает оставшиеся записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(shutdown_logging)
+
+def setup_logger(name: str) -> logging.Logger:
+    """Возвращает логгер модуля; записи уходят в общую очередь"""
+    if _listener is None:
+        configure_logging()
+
+    return logging.getLogger(name)
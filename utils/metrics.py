@@ -0,0 +1,303 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Границы корзин гистограмм по умолчанию (сек)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Границы для скорости скачивания (байт/сек)
+THROUGHPUT_BUCKETS = tuple(2 ** power * 1024 for power in range(4, 16))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Базовая метрика с набором меток"""
+    
+    type = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+    
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+    
+    def set_function(self, func: Callable[[], float], **labels):
+        """Значение будет вычисляться функцией при каждом чтении метрик"""
+        self._functions[self._key(labels)] = func
+    
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """Возвращает значения метрики: имя, метки, значения меток, значение"""
+        values = dict(self._values)
+        for key, func in self._functions.items():
+            try:
+                values[key] = func()
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+        
+        for key, value in sorted(values.items()):
+            yield self.name, self.label_names, key, value
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+    
+    type = "counter"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Текущее значение, которое может расти и уменьшаться"""
+    
+    type = "gauge"
+    
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+    
+    type = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики корзин, сумма, количество
+        self._histograms: Dict[Tuple[str, ...], List] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+        
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Измеряет длительность блока кода"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+    
+    def samples(self):
+        names = self.label_names + ("le",)
+        for key, (counts, total, count) in sorted(self._histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", names, key + (_format_value(bound),), cumulative
+            yield f"{self.name}_bucket", names, key + ("+Inf",), count
+            yield f"{self.name}_sum", self.label_names, key, total
+            yield f"{self.name}_count", self.label_names, key, count
+
+class Registry:
+    """Набор метрик процесса"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+    
+    def register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+    
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+    
+    def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, label_names, label_values, value in metric.samples():
+                lines.append(
+                    f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы обработчиков", ["handler"]
+)
+VK_REQUEST_LATENCY = REGISTRY.histogram(
+    "bot_vk_request_seconds", "Время запросов к VK", ["method"]
+)
+DOWNLOAD_THROUGHPUT = REGISTRY.histogram(
+    "bot_audio_download_bytes_per_second", "Скорость скачивания аудио", buckets=THROUGHPUT_BUCKETS
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "bot_audio_download_bytes_total", "Скачано байт аудио"
+)
+SHAZAM_LATENCY = REGISTRY.histogram(
+    "bot_shazam_recognition_seconds", "Время распознавания в Shazam"
+)
+AUDIO_PROCESSING_LATENCY = REGISTRY.histogram(
+    "bot_audio_processing_seconds", "Время обработки аудио в пуле процессов", ["task"]
+)
+AUDIO_PROCESSING_BYTES = REGISTRY.counter(
+    "bot_audio_processing_bytes_total", "Размер аудио до и после обработки", ["task", "stage"]
+)
+DOWNLOAD_STAGE_LATENCY = REGISTRY.histogram(
+    "bot_download_stage_seconds", "Время этапов скачивания трека", ["stage"]
+)
+DOWNLOAD_STAGE_TIMEOUTS = REGISTRY.counter(
+    "bot_download_stage_timeouts_total", "Этапы скачивания, не уложившиеся в таймаут", ["stage"]
+)
+TELEGRAM_OUTBOUND = REGISTRY.counter(
+    "bot_telegram_outbound_total", "Исходящие запросы к Telegram через планировщик", ["result"]
+)
+TELEGRAM_OUTBOUND_DELAY = REGISTRY.histogram(
+    "bot_telegram_outbound_delay_seconds", "Время ожидания запроса к Telegram в очереди"
+)
+TELEGRAM_OUTBOUND_QUEUED = REGISTRY.gauge(
+    "bot_telegram_outbound_queued", "Запросов к Telegram, ожидающих отправки"
+)
+TELEGRAM_UPLOAD_LATENCY = REGISTRY.histogram(
+    "bot_telegram_upload_seconds", "Время отправки аудио в Telegram", ["kind"]
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "bot_cache_requests_total", "Обращения к кэшам", ["cache", "result"]
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "bot_cache_hit_ratio", "Доля попаданий в кэш", ["cache"]
+)
+EXECUTOR_QUEUE_DEPTH = REGISTRY.gauge(
+    "bot_executor_queue_depth", "Задач в очереди исполнителя", ["executor"]
+)
+EXECUTOR_ACTIVE = REGISTRY.gauge(
+    "bot_executor_active", "Задач, выполняемых исполнителем", ["executor"]
+)
+DOWNLOADS_IN_FLIGHT = REGISTRY.gauge(
+    "bot_downloads_in_flight", "Треков, которые скачиваются прямо сейчас"
+)
+RATE_LIMIT_REQUESTS = REGISTRY.counter(
+    "bot_rate_limit_requests_total", "Решения ограничителя частоты", ["action", "result"]
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "bot_circuit_state", "Состояние автомата: 0 - замкнут, 1 - проверка, 2 - разомкнут", ["service"]
+)
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "bot_circuit_rejected_total", "Вызовы, отклоненные автоматом", ["service"]
+)
+
+def _cache_hit_ratio(cache: str) -> float:
+    """Доля попаданий среди всех обращений к кэшу"""
+    total = misses = 0
+    for _, _, (name, result), value in CACHE_REQUESTS.samples():
+        if name == cache:
+            total += value
+            if result == "miss":
+                misses += value
+    return (total - misses) / total if total else 0.0
+
+for _cache in ("search", "file_id", "recognition", "transcode", "cover", "search_session"):
+    CACHE_HIT_RATIO.set_function(lambda cache=_cache: _cache_hit_ratio(cache), cache=_cache)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Middleware, измеряющий время работы каждого обработчика"""
+    
+    def _start(self, data: dict):
+        handler = current_handler.get()
+        data['_metrics_handler'] = getattr(handler, "__name__", "unknown")
+        data['_metrics_started'] = time.monotonic()
+    
+    def _finish(self, data: dict):
+        started = data.pop('_metrics_started', None)
+        if started is not None:
+            HANDLER_LATENCY.observe(
+                time.monotonic() - started,
+                handler=data.pop('_metrics_handler')
+            )
+    
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._start(data)
+    
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        self._finish(data)
+    
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._start(data)
+    
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results: list, data: dict):
+        self._finish(data)
+
+class MetricsServer:
+    """HTTP сервер, отдающий метрики в формате Prometheus"""
+    
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+    
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain")
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
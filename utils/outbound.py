@@ -0,0 +1,255 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Union
+
+from aiogram import types
+from aiogram.utils.exceptions import RetryAfter
+
+from config import Config
+from utils.cache import LRUCache
+from utils.logger import setup_logger
+from utils.metrics import TELEGRAM_OUTBOUND, TELEGRAM_OUTBOUND_DELAY, TELEGRAM_OUTBOUND_QUEUED
+from utils.throttling import TokenBucket
+from utils.tracing import TracedBot
+
+logger = setup_logger(__name__)
+
+# Методы, которые правят или удаляют уже отправленное сообщение
+MESSAGE_UPDATE_METHODS = ("editMessageText", "editMessageReplyMarkup", "deleteMessage")
+
+# Запросы внутри progress_update() считаются правками статуса
+_progress = contextvars.ContextVar("outbound_progress", default=False)
+
+@contextmanager
+def progress_update():
+    """Помечает правки сообщения внутри блока как обновления статуса.
+    
+    Такие правки не повторяются после RetryAfter и выбрасываются,
+    если за ними в очереди уже стоит более новая правка того же сообщения.
+    """
+    token = _progress.set(True)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+class OutboundRequest:
+    """Запрос к Telegram в очереди чата"""
+    
+    def __init__(self, method: str, data: Dict, call: Callable[[], Awaitable[Any]], progress: bool):
+        self.method = method
+        self.data = data
+        self.call = call
+        self.progress = progress
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+        # Запрос выполняется в контексте отправителя, чтобы span и другие
+        # contextvars относились к его обновлению, а не к воркеру чата
+        self.context = contextvars.copy_context()
+    
+    def supersedes(self, other: "OutboundRequest") -> bool:
+        """Делает ли этот запрос ненужной правку статуса other"""
+        return (
+            other.progress
+            and self.method in MESSAGE_UPDATE_METHODS
+            and other.data.get('message_id') == self.data.get('message_id')
+        )
+    
+    def resolve(self, result: Any):
+        if not self.future.done():
+            self.future.set_result(result)
+    
+    def fail(self, error: Exception):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+class ChatQueue:
+    """Очередь исходящих запросов одного чата"""
+    
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.requests: Deque[OutboundRequest] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+class OutboundScheduler:
+    """Планировщик исходящих запросов к Telegram Bot API.
+    
+    Держит запросы в пределах общего лимита бота и лимитов чатов, чтобы
+    Telegram не отвечал 429. Запросы одного чата отправляются строго по
+    очереди. Ответ RetryAfter не доходит до обработчиков: запрос
+    повторяется после указанной паузы. Правки статуса, которые успела
+    сменить более новая правка того же сообщения, не отправляются.
+    """
+    
+    def __init__(
+        self,
+        rate_limit: Tuple[float, float],
+        chat_rate_limit: Tuple[float, float],
+        group_rate_limit: Tuple[float, float],
+        max_retries: int,
+        max_chats: int = 10000
+    ):
+        self.rate_limit = rate_limit
+        self.chat_rate_limit = chat_rate_limit
+        self.group_rate_limit = group_rate_limit
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(*rate_limit)
+        
+        # Корзины чатов живут, пока не наполнятся, как у ограничителя частоты
+        max_idle = max(capacity / rate for rate, capacity in (chat_rate_limit, group_rate_limit))
+        self._buckets = LRUCache(max_chats, max_idle)
+        self._chats: Dict[Union[int, str], ChatQueue] = {}
+        
+        TELEGRAM_OUTBOUND_QUEUED.set_function(lambda: self.queued)
+    
+    @classmethod
+    def from_config(cls, config: Config) -> "OutboundScheduler":
+        """Создает планировщик с лимитами из конфигурации"""
+        # Общий лимит бота делится между рабочими процессами, чаты закреплены за процессом
+        workers = max(config.WORKERS, 1)
+        rate, capacity = config.TELEGRAM_RATE_LIMIT
+        return cls(
+            rate_limit=(rate / workers, max(capacity / workers, 1)),
+            chat_rate_limit=config.TELEGRAM_CHAT_RATE_LIMIT,
+            group_rate_limit=config.TELEGRAM_GROUP_RATE_LIMIT,
+            max_retries=config.TELEGRAM_MAX_RETRIES
+        )
+    
+    @property
+    def queued(self) -> int:
+        """Запросов, ожидающих отправки"""
+        return sum(len(chat.requests) for chat in self._chats.values())
+    
+    @staticmethod
+    def is_group(chat_id: Union[int, str]) -> bool:
+        """Группы и каналы имеют отрицательный ID или @username"""
+        try:
+            return int(chat_id) < 0
+        except (TypeError, ValueError):
+            return True
+    
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            limit = self.group_rate_limit if self.is_group(chat_id) else self.chat_rate_limit
+            bucket = TokenBucket(*limit)
+        # Обновляем время жизни при каждом обращении
+        self._buckets.set(chat_id, bucket)
+        return bucket
+    
+    async def submit(self, method: str, data: Optional[Dict], call: Callable[[], Awaitable[Any]]) -> Any:
+        """Ставит запрос в очередь его чата и ждет ответа Telegram.
+        
+        call выполняет сам запрос и вызывается заново при каждом повторе.
+        Запросы без чата (ответы на callback, getFile) не ограничиваются.
+        """
+        chat_id = (data or {}).get('chat_id')
+        if chat_id is None:
+            return await call()
+        
+        request = OutboundRequest(method, data, call, _progress.get())
+        
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = ChatQueue(self._chat_bucket(chat_id))
+        
+        # Устаревшие правки статуса этого сообщения больше не нужны
+        for queued in [queued for queued in chat.requests if request.supersedes(queued)]:
+            chat.requests.remove(queued)
+            queued.resolve(True)
+            TELEGRAM_OUTBOUND.inc(result="superseded")
+        
+        chat.requests.append(request)
+        if chat.worker is None:
+            chat.worker = asyncio.create_task(self._run_chat(chat_id, chat))
+        
+        return await request.future
+    
+    async def _run_chat(self, chat_id: Union[int, str], chat: ChatQueue):
+        """Отправляет запросы чата по одному, пока очередь не опустеет"""
+        request = None
+        try:
+            while chat.requests:
+                request = chat.requests.popleft()
+                # Отправитель перестал ждать ответа, например по таймауту
+                if request.future.done():
+                    continue
+                await self._send(chat_id, chat, request)
+        finally:
+            del self._chats[chat_id]
+            # Запросы, оставшиеся после отмены, не должны ждать вечно
+            for pending in [request, *chat.requests]:
+                if pending is not None:
+                    pending.future.cancel()
+    
+    async def _wait_turn(self, chat: ChatQueue):
+        """Ждет токенов чата, затем общего лимита"""
+        delay = chat.bucket.reserve(float("inf"))
+        if delay:
+            await asyncio.sleep(delay)
+        
+        delay = self.bucket.reserve(float("inf"))
+        if delay:
+            await asyncio.sleep(delay)
+    
+    async def _send(self, chat_id: Union[int, str], chat: ChatQueue, request: OutboundRequest):
+        """Отправляет запрос, повторяя его после RetryAfter"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(chat)
+            if request.future.done():
+                return
+            TELEGRAM_OUTBOUND_DELAY.observe(time.monotonic() - request.queued_at)
+            
+            try:
+                result = await asyncio.create_task(request.call(), context=request.context)
+            except RetryAfter as e:
+                if request.progress:
+                    # Статус устарел, пока ждали бы паузу: просто пропускаем его
+                    TELEGRAM_OUTBOUND.inc(result="dropped")
+                    logger.warning(f"Telegram просит подождать {e.timeout} сек, правка статуса в чате {chat_id} пропущена")
+                    request.resolve(True)
+                    return
+                
+                if attempt == self.max_retries:
+                    TELEGRAM_OUTBOUND.inc(result="failed")
+                    request.fail(e)
+                    return
+                
+                TELEGRAM_OUTBOUND.inc(result="retried")
+                logger.warning(f"Telegram просит подождать {e.timeout} сек: {request.method} в чат {chat_id}")
+                # Пауза задерживает всю очередь чата, а не только этот запрос
+                await asyncio.sleep(e.timeout)
+            except Exception as e:
+                TELEGRAM_OUTBOUND.inc(result="failed")
+                request.fail(e)
+                return
+            else:
+                TELEGRAM_OUTBOUND.inc(result="sent")
+                request.resolve(result)
+                return
+
+class ScheduledBot(TracedBot):
+    """Бот, отправляющий запросы к Telegram через OutboundScheduler"""
+    
+    def __init__(self, *args, scheduler: Optional[OutboundScheduler] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or OutboundScheduler.from_config(Config())
+    
+    async def request(self, method, data=None, files=None, **kwargs):
+        attempts = 0
+        
+        async def call():
+            nonlocal attempts
+            attempts += 1
+            if attempts > 1:
+                # При повторе файлы отправляются заново с начала
+                for file in (files or {}).values():
+                    stream = file.file if isinstance(file, types.InputFile) else None
+                    if stream is not None and hasattr(stream, "seek"):
+                        stream.seek(0)
+            return await super(ScheduledBot, self).request(method, data, files, **kwargs)
+        
+        return await self.scheduler.submit(method, data, call)
@@ -0,0 +1,183 @@
+import asyncio
+import copy
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from database import Database
+from utils.cache import LRUCache
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite с кэшем в памяти и пакетной записью.
+    
+    Изменения сразу попадают в кэш, а в базу записываются пачками
+    раз в flush_interval секунд. Записи кэша живут cache_ttl секунд,
+    чтобы процессы на одном хосте видели изменения друг друга.
+    """
+    
+    # Как часто (в сбросах) удалять устаревшие состояния
+    CLEANUP_EVERY = 1000
+    
+    # Наибольшая пауза между повторами записи, пока база недоступна (сек)
+    RETRY_MAX_DELAY = 30
+    
+    def __init__(
+        self,
+        db: typing.Optional[Database] = None,
+        ttl: float = 24 * 60 * 60,
+        cache_ttl: float = 5,
+        cache_size: int = 10000,
+        flush_interval: float = 0.5
+    ):
+        self.db = db or Database()
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache = LRUCache(cache_size, cache_ttl)
+        self._pending: typing.Dict[typing.Tuple[str, str], typing.Dict] = {}
+        self._flush_task: typing.Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._flushes = 0
+    
+    def _resolve_address(self, chat, user) -> typing.Tuple[str, str]:
+        chat_id, user_id = map(str, self.check_address(chat=chat, user=user))
+        return chat_id, user_id
+    
+    async def _get_record(self, chat, user) -> typing.Dict:
+        """Возвращает запись пользователя из кэша или базы данных"""
+        key = self._resolve_address(chat, user)
+        
+        record = self._pending.get(key) or self._cache.get(key)
+        if record is None:
+            record = await self.db.get_fsm_record(*key, self.ttl)
+            if record is None:
+                record = {'state': None, 'data': {}, 'bucket': {}}
+            self._cache.set(key, record)
+        
+        return record
+    
+    def _put_record(self, chat, user, record: typing.Dict):
+        """Сохраняет запись в кэш и ставит ее в очередь на запись"""
+        key = self._resolve_address(chat, user)
+        self._cache.set(key, record)
+        self._pending[key] = record
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        """Сбрасывает накопленные изменения после небольшой паузы.
+        
+        Пока есть несохраненные изменения, сброс повторяется: они могли
+        прийти во время записи или остаться после ее ошибки.
+        """
+        delay = self.flush_interval
+        while True:
+            await asyncio.sleep(delay)
+            # Начатую запись не прерываем, даже если хранилище закрывается
+            saved = await asyncio.shield(self.flush())
+            if not self._pending:
+                return
+            # Пока база недоступна, повторяем все реже
+            delay = self.flush_interval if saved else min(delay * 2, self.RETRY_MAX_DELAY)
+    
+    async def flush(self) -> bool:
+        """Записывает накопленные изменения в базу данных.
+        
+        Если запись не удалась, изменения возвращаются в очередь.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            
+            pending, self._pending = self._pending, {}
+            try:
+                await self.db.save_fsm_records([
+                    (chat, user, record) for (chat, user), record in pending.items()
+                ])
+            except Exception as e:
+                # Изменения, пришедшие во время записи, новее неудавшихся
+                self._pending = {**pending, **self._pending}
+                logger.error(f"Не удалось записать {len(pending)} состояний FSM, повторю позже: {e}")
+                return False
+            
+            self._flushes += 1
+            if self._flushes % self.CLEANUP_EVERY == 0:
+                await self.db.delete_expired_fsm_records(self.ttl)
+            return True
+    
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+    
+    async def wait_closed(self):
+        pass
+    
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._get_record(chat, user)
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+    
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['data'])
+    
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        record = dict(await self._get_record(chat, user))
+        record['state'] = self.resolve_state(state)
+        self._put_record(chat, user, record)
+    
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = dict(await self._get_record(chat, user))
+        record['data'] = copy.deepcopy(data or {})
+        self._put_record(chat, user, record)
+    
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        record = dict(await self._get_record(chat, user))
+        record['data'] = {**record['data'], **copy.deepcopy(data or {}), **kwargs}
+        self._put_record(chat, user, record)
+    
+    def has_bucket(self):
+        return True
+    
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['bucket'])
+    
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = dict(await self._get_record(chat, user))
+        record['bucket'] = copy.deepcopy(bucket or {})
+        self._put_record(chat, user, record)
+    
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        record = dict(await self._get_record(chat, user))
+        record['bucket'] = {**record['bucket'], **copy.deepcopy(bucket or {}), **kwargs}
+        self._put_record(chat, user, record)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from config import Config
+from utils.cache import LRUCache
+from utils.logger import setup_logger
+from utils.metrics import RATE_LIMIT_REQUESTS
+
+logger = setup_logger(__name__)
+
+# Типы действий, которые ограничиваются по частоте
+ACTION_SEARCH = "search"
+ACTION_DOWNLOAD = "download"
+ACTION_RECOGNITION = "recognition"
+
+# Какие внешние сервисы нагружает каждое действие
+ACTION_UPSTREAMS = {
+    ACTION_SEARCH: ["vk"],
+    ACTION_DOWNLOAD: ["vk"],
+    ACTION_RECOGNITION: ["shazam", "vk"],
+}
+
+# Как часто напоминать пользователю об ограничении (сек)
+NOTIFY_INTERVAL = 10
+
+def rate_limit(action: str) -> Callable:
+    """Декоратор, отмечающий обработчик типом ограничиваемого действия"""
+    def decorator(func: Callable) -> Callable:
+        setattr(func, "rate_limit_action", action)
+        return func
+    return decorator
+
+class TokenBucket:
+    """Корзина токенов с резервированием.
+    
+    Запрос может занять токен в долг: тогда он ждет, пока токен накопится.
+    Так короткие всплески растягиваются во времени, а не отклоняются сразу.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+    
+    def reserve(self, max_delay: float) -> Optional[float]:
+        """Занимает токен и возвращает время ожидания или None при отказе"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        
+        delay = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if delay > max_delay:
+            return None
+        
+        self.tokens -= 1
+        return delay
+    
+    def refund(self):
+        """Возвращает занятый токен"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class RateLimiter:
+    """Ограничение частоты по пользователям и по внешним сервисам"""
+    
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]],
+        upstream_limits: Dict[str, Tuple[float, float]],
+        max_delay: float,
+        max_users: int = 10000
+    ):
+        self.limits = limits
+        self.max_delay = max_delay
+        self.upstreams = {
+            name: TokenBucket(rate, capacity)
+            for name, (rate, capacity) in upstream_limits.items()
+        }
+        
+        # Неактивные корзины пользователей вытесняются, когда успевают наполниться
+        max_idle = max(capacity / rate for rate, capacity in limits.values())
+        self._buckets = LRUCache(max_users, max_idle + max_delay)
+        
+        self.stats: Dict[str, Dict[str, int]] = {
+            action: {'allowed': 0, 'delayed': 0, 'rejected': 0}
+            for action in limits
+        }
+    
+    def _user_bucket(self, user_id: int, action: str) -> TokenBucket:
+        key = (user_id, action)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*self.limits[action])
+        # Обновляем время жизни при каждом обращении
+        self._buckets.set(key, bucket)
+        return bucket
+    
+    def acquire(self, user_id: int, action: str) -> Optional[float]:
+        """Занимает токены пользователя и сервисов.
+        
+        Возвращает время ожидания или None, если запрос нужно отклонить.
+        """
+        reserved: List[TokenBucket] = []
+        delay = 0.0
+        
+        buckets = [self._user_bucket(user_id, action)] + [
+            self.upstreams[name]
+            for name in ACTION_UPSTREAMS.get(action, [])
+            if name in self.upstreams
+        ]
+        for bucket in buckets:
+            bucket_delay = bucket.reserve(self.max_delay)
+            if bucket_delay is None:
+                for taken in reserved:
+                    taken.refund()
+                self.stats[action]['rejected'] += 1
+                RATE_LIMIT_REQUESTS.inc(action=action, result="rejected")
+                return None
+            
+            reserved.append(bucket)
+            delay = max(delay, bucket_delay)
+        
+        result = 'delayed' if delay else 'allowed'
+        self.stats[action][result] += 1
+        RATE_LIMIT_REQUESTS.inc(action=action, result=result)
+        return delay
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Middleware, ограничивающий частоту поиска, скачивания и распознавания"""
+    
+    def __init__(self, limiter: RateLimiter):
+        super().__init__()
+        self.limiter = limiter
+        self._notified = LRUCache(10000, NOTIFY_INTERVAL)
+    
+    @classmethod
+    def from_config(cls, config: Config) -> "ThrottlingMiddleware":
+        """Создает middleware с лимитами из конфигурации"""
+        # Общий лимит сервиса делится между рабочими процессами
+        workers = max(config.WORKERS, 1)
+        upstream_limits = {
+            name: (rate / workers, max(capacity / workers, 1))
+            for name, (rate, capacity) in (
+                ("vk", config.VK_RATE_LIMIT),
+                ("shazam", config.SHAZAM_RATE_LIMIT),
+            )
+        }
+        
+        return cls(RateLimiter(
+            limits={
+                ACTION_SEARCH: config.SEARCH_RATE_LIMIT,
+                ACTION_DOWNLOAD: config.DOWNLOAD_RATE_LIMIT,
+                ACTION_RECOGNITION: config.RECOGNITION_RATE_LIMIT,
+            },
+            upstream_limits=upstream_limits,
+            max_delay=config.RATE_LIMIT_MAX_DELAY
+        ))
+    
+    async def _throttle(self, user_id: int, reject: Callable):
+        handler = current_handler.get()
+        action = getattr(handler, "rate_limit_action", None)
+        if action is None:
+            return
+        
+        delay = self.limiter.acquire(user_id, action)
+        if delay is None:
+            logger.warning(f"Пользователь {user_id} превысил лимит: {action}")
+            await reject()
+            raise CancelHandler()
+        
+        if delay:
+            await asyncio.sleep(delay)
+    
+    async def on_process_message(self, message: types.Message, data: dict):
+        async def reject():
+            # Отвечаем не на каждое отклоненное сообщение, чтобы не усиливать флуд
+            if self._notified.get(message.from_user.id) is None:
+                self._notified.set(message.from_user.id, True)
+                await message.answer("⏳ Слишком много запросов. Подождите немного.")
+        
+        await self._throttle(message.from_user.id, reject)
+    
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        async def reject():
+            await callback_query.answer("⏳ Слишком много запросов. Подождите немного.")
+        
+        await self._throttle(callback_query.from_user.id, reject)
@@ -0,0 +1,283 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from config import Config
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Имя сервиса в экспортируемых трассах
+SERVICE_NAME = "vk-music-bot"
+
+# Коды статуса span в формате OpenTelemetry
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Сколько трасс может ждать экспорта, лишние отбрасываются
+EXPORT_QUEUE_SIZE = 1000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+class Span:
+    """Один этап обработки запроса"""
+    
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id",
+        "start_ns", "end_ns", "attributes", "status", "root", "children"
+    )
+    
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status = STATUS_OK
+        # Завершенные span трассы копятся у корневого
+        self.root = parent.root if parent else self
+        self.children: List["Span"] = []
+    
+    @property
+    def duration(self) -> float:
+        """Длительность в секундах"""
+        return (self.end_ns - self.start_ns) / 1e9
+    
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+    
+    def record_exception(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.attributes['exception.type'] = type(error).__name__
+        self.attributes['exception.message'] = str(error)
+    
+    def to_otlp(self) -> Dict:
+        """Представление span в формате OTLP/JSON"""
+        data = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        return data
+
+class _NoopSpan:
+    """Заглушка, когда трассировка выключена"""
+    
+    def set_attribute(self, key: str, value: Any):
+        pass
+    
+    def record_exception(self, error: BaseException):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def _otlp_attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+class Tracer:
+    """Трассировка с выборкой по завершении трассы.
+    
+    Span одной трассы копятся у корневого span. Когда он завершается,
+    трасса сохраняется с вероятностью sample_rate, а медленные трассы
+    и трассы с ошибками сохраняются всегда. Экспорт в файл или коллектор
+    идет в отдельном потоке.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.slow_threshold = 0.0
+        self.file: Optional[Path] = None
+        self.endpoint = ""
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    def configure(self, config: Config):
+        """Включает трассировку, если задан файл или адрес коллектора"""
+        self.shutdown()
+        
+        self.file = Path(config.TRACE_FILE) if config.TRACE_FILE else None
+        self.endpoint = config.TRACE_ENDPOINT
+        self.sample_rate = config.TRACE_SAMPLE_RATE
+        self.slow_threshold = config.TRACE_SLOW_THRESHOLD
+        self.enabled = bool(self.file or self.endpoint)
+        if not self.enabled:
+            return
+        
+        if self.file:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+        
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+        self._thread.start()
+        logger.info(f"Трассировка включена: {self.file or self.endpoint}")
+    
+    def shutdown(self):
+        """Экспортирует оставшиеся трассы и останавливает поток"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+            self._queue = None
+        self.enabled = False
+    
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Any]:
+        """Создает span, вложенный в текущий.
+        
+        Вне обработки обновления (фоновые задачи, запуск) span не пишется.
+        """
+        if not self.enabled or _current_span.get() is None:
+            yield _NOOP_SPAN
+            return
+        
+        span, token = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            self.end_span(span, token)
+    
+    def start_span(self, name: str, **attributes):
+        """Начинает span и делает его текущим; завершать нужно через end_span"""
+        span = Span(name, _current_span.get(), attributes)
+        return span, _current_span.set(span)
+    
+    def end_span(self, span: Span, token):
+        """Завершает span и при завершении корня решает судьбу трассы"""
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        
+        root = span.root
+        if root is not span:
+            # Span, завершившиеся после корня, уже не попадут в трассу
+            if root.end_ns == 0:
+                root.children.append(span)
+            return
+        
+        keep = (
+            span.duration >= self.slow_threshold
+            or span.status == STATUS_ERROR
+            or any(child.status == STATUS_ERROR for child in span.children)
+            or random.random() < self.sample_rate
+        )
+        if keep and self._queue is not None:
+            try:
+                self._queue.put_nowait(span.children + [span])
+            except queue.Full:
+                logger.warning("Очередь экспорта трасс переполнена, трасса отброшена")
+    
+    def _export_loop(self):
+        """Пишет трассы в файл или отправляет их в коллектор"""
+        export_queue = self._queue
+        while True:
+            spans = export_queue.get()
+            if spans is None:
+                return
+            
+            payload = json.dumps({
+                'resourceSpans': [{
+                    'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+                    'scopeSpans': [{
+                        'scope': {'name': 'bot'},
+                        'spans': [span.to_otlp() for span in spans],
+                    }],
+                }],
+            }, ensure_ascii=False)
+            
+            try:
+                if self.file:
+                    with open(self.file, "a", encoding="utf-8") as f:
+                        f.write(payload + "\n")
+                if self.endpoint:
+                    request = urllib.request.Request(
+                        self.endpoint,
+                        data=payload.encode("utf-8"),
+                        headers={'Content-Type': 'application/json'}
+                    )
+                    urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.error(f"Ошибка экспорта трассы: {e}")
+
+tracer = Tracer()
+
+def traced(name: str) -> Callable:
+    """Декоратор, оборачивающий асинхронную функцию в span"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class TracedBot(Bot):
+    """Бот, который записывает каждый запрос к Telegram Bot API в span"""
+    
+    async def request(self, method, data=None, files=None, **kwargs):
+        with tracer.span(f"telegram.{method}"):
+            return await super().request(method, data, files, **kwargs)
+
+class TracingMiddleware(BaseMiddleware):
+    """Middleware, открывающий корневой span на каждое обновление"""
+    
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if not tracer.enabled:
+            return
+        
+        span, token = tracer.start_span("update", update_id=update.update_id)
+        data['_trace_span'] = (span, token)
+    
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._describe(data, "message", message.from_user.id)
+    
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._describe(data, "callback_query", callback_query.from_user.id)
+    
+    def _describe(self, data: dict, kind: str, user_id: int):
+        span = _current_span.get()
+        if span is None:
+            return
+        handler = current_handler.get()
+        span.set_attribute('update.kind', kind)
+        span.set_attribute('user.id', user_id)
+        span.set_attribute('handler', getattr(handler, "__name__", "unknown"))
+    
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict):
+        trace_span = data.pop('_trace_span', None)
+        if trace_span:
+            tracer.end_span(*trace_span)
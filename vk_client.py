@@ -1,134 +1,405 @@
-import asyncio
-import aiohttp
-import vk_api
-from vk_api import audio
-import io
-from typing import List, Dict, Optional
-import logging
-
-from config import Config
-from utils.logger import setup_logger
-
-logger = setup_logger(__name__)
-
-class VKClient:
-    """Клиент для работы с VK API"""
-    
-    def __init__(self):
-        self.config = Config()
-        self.session = None
-        self.vk_audio = None
-        self._http_session = None
-    
-    async def init(self):
-        """Инициализация VK клиента"""
-        try:
-            # Создаем сессию VK
-            self.session = vk_api.VkApi(
-                login=self.config.VK_LOGIN,
-                password=self.config.VK_PASSWORD
-            )
-            self.session.auth()
-            
-            # Получаем доступ к аудио
-            self.vk_audio = audio.VkAudio(self.session)
-            
-            # HTTP сессия для скачивания
-            self._http_session = aiohttp.ClientSession()
-            
-            logger.info("VK клиент успешно инициализирован")
-            
-        except Exception as e:
-            logger.error(f"Ошибка инициализации VK клиента: {e}")
-            raise
-    
-    async def search_audio(self, query: str, page: int = 0) -> List[Dict]:
-        """Поиск аудио в VK"""
-        try:
-            # VK API работает синхронно, поэтому выполняем в executor
-            loop = asyncio.get_event_loop()
-            results = await loop.run_in_executor(
-                None,
-                lambda: self.vk_audio.search(
-                    query, 
-                    count=self.config.RESULTS_PER_PAGE,
-                    offset=page * self.config.RESULTS_PER_PAGE
-                )
-            )
-            
-            processed_results = []
-            for track in results:
-                processed_track = {
-                    'id': f"{track['owner_id']}_{track['id']}",
-                    'title': track['title'],
-                    'artist': track['artist'],
-                    'duration': track.get('duration', 0),
-                    'url': track['url'],
-                    'thumb_url': track.get('album', {}).get('thumb', {}).get('photo_300')
-                }
-                processed_results.append(processed_track)
-            
-            return processed_results
-            
-        except Exception as e:
-            logger.error(f"Ошибка поиска аудио: {e}")
-            return []
-    
-    async def get_track_by_id(self, track_id: str) -> Optional[Dict]:
-        """Получение трека по ID"""
-        try:
-            owner_id, audio_id = track_id.split('_')
-            
-            loop = asyncio.get_event_loop()
-            track = await loop.run_in_executor(
-                None,
-                lambda: self.vk_audio.get_audio_by_id(int(owner_id), int(audio_id))
-            )
-            
-            if track:
-                return {
-                    'id': track_id,
-                    'title': track['title'],
-                    'artist': track['artist'],
-                    'duration': track.get('duration', 0),
-                    'url': track['url'],
-                    'thumb_url': track.get('album', {}).get('thumb', {}).get('photo_300')
-                }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения трека: {e}")
-            return None
-    
-    async def download_audio(self, url: str) -> io.BytesIO:
-        """Скачивание аудио файла"""
-        try:
-            async with self._http_session.get(url) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    return io.BytesIO(content)
-                else:
-                    raise Exception(f"HTTP {response.status}")
-                    
-        except Exception as e:
-            logger.error(f"Ошибка скачивания аудио: {e}")
-            raise
-    
-    async def download_cover(self, url: str) -> Optional[io.BytesIO]:
-        """Скачивание обложки"""
-        try:
-            async with self._http_session.get(url) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    return io.BytesIO(content)
-                return None
-                
-        except Exception as e:
-            logger.error(f"Ошибка скачивания обложки: {e}")
-            return None
-    
-    async def close(self):
-        """Закрытие соединений"""
-        if self._http_session:
-            await self._http_session.close()
+import asyncio
+import aiohttp
+import vk_api
+from vk_api import audio
+from vk_api.utils import cookies_to_list, set_cookies_from_list
+import io
+import tempfile
+import time
+from typing import Any, BinaryIO, List, Dict, Optional
+
+from config import Config
+from utils.cache import SearchCache, SearchSessions
+from utils.circuit_breaker import CircuitBreaker, ServiceUnavailableError
+from utils.executor import ExecutorBusyError, PriorityExecutor, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from utils.logger import setup_logger
+from utils.metrics import VK_REQUEST_LATENCY, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT
+from utils.tracing import tracer
+
+logger = setup_logger(__name__)
+
+# Размер блока при потоковом скачивании
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class DownloadTooLargeError(Exception):
+    """Файл превышает допустимый размер скачивания"""
+
+def login(config: Config) -> Dict[str, Any]:
+    """Входит в VK и возвращает токен и cookies сессии.
+    
+    Блокирующий вызов: при нескольких процессах супервизор входит один раз
+    и передает результат рабочим процессам в VKClient.init.
+    """
+    session = vk_api.VkApi(login=config.VK_LOGIN, password=config.VK_PASSWORD)
+    session.auth()
+    return {
+        'token': session.token,
+        'cookies': cookies_to_list(session.http.cookies)
+    }
+
+class VKClient:
+    """Клиент для работы с VK API"""
+    
+    # Кэш результатов поиска общий для всех экземпляров клиента
+    search_cache: Optional[SearchCache] = None
+    
+    # Сессии поиска для листания результатов без запросов к VK
+    search_sessions: Optional[SearchSessions] = None
+    
+    # Отдельный пул потоков для блокирующих вызовов vk_api
+    executor: Optional[PriorityExecutor] = None
+    
+    # Автомат отключения при сбоях VK
+    breaker: Optional[CircuitBreaker] = None
+    
+    def __init__(self):
+        self.config = Config()
+        self.session = None
+        self.vk_audio = None
+        self._http_session = None
+        
+        if VKClient.search_cache is None:
+            VKClient.search_cache = SearchCache(
+                ttl=self.config.SEARCH_CACHE_TTL,
+                max_size=self.config.SEARCH_CACHE_SIZE,
+                max_rows=self.config.SEARCH_CACHE_MAX_ROWS,
+                stale_ttl=self.config.SEARCH_CACHE_STALE_TTL
+            )
+        
+        if VKClient.search_sessions is None:
+            VKClient.search_sessions = SearchSessions(
+                ttl=self.config.SEARCH_SESSION_TTL,
+                max_size=self.config.SEARCH_SESSION_SIZE
+            )
+        
+        if VKClient.executor is None:
+            VKClient.executor = PriorityExecutor(
+                "vk",
+                workers=self.config.VK_WORKERS,
+                queue_size=self.config.VK_QUEUE_SIZE,
+                default_timeout=self.config.VK_CALL_TIMEOUT
+            )
+        
+        if VKClient.breaker is None:
+            VKClient.breaker = CircuitBreaker(
+                "vk",
+                window=self.config.CIRCUIT_WINDOW,
+                failure_rate=self.config.CIRCUIT_FAILURE_RATE,
+                slow_call=self.config.VK_SLOW_CALL,
+                base_backoff=self.config.CIRCUIT_BASE_BACKOFF,
+                max_backoff=self.config.CIRCUIT_MAX_BACKOFF,
+                # Переполненная очередь - наша перегрузка, а не сбой VK
+                ignore=(ExecutorBusyError,)
+            )
+    
+    async def init(self, credentials: Optional[Dict[str, Any]] = None):
+        """Инициализация VK клиента.
+        
+        credentials - результат login() из другого процесса: с ними клиент
+        использует готовую сессию и не входит в VK сам.
+        """
+        try:
+            # Создаем сессию VK
+            self.session = vk_api.VkApi(
+                login=self.config.VK_LOGIN,
+                password=self.config.VK_PASSWORD
+            )
+            if credentials:
+                self.session.token = credentials['token']
+                set_cookies_from_list(self.session.http.cookies, credentials['cookies'])
+            else:
+                # Авторизация может ждать captcha или 2FA, поэтому без таймаута
+                await self.executor.run(self.session.auth, timeout=None)
+            
+            # Получаем доступ к аудио
+            self.vk_audio = await self.executor.run(
+                lambda: audio.VkAudio(self.session)
+            )
+            
+            # HTTP сессия для скачивания
+            self._http_session = aiohttp.ClientSession()
+            
+            logger.info("VK клиент успешно инициализирован")
+        
+        except Exception as e:
+            logger.error(f"Ошибка инициализации VK клиента: {e}")
+            raise
+    
+    async def _call(self, method: str, func, priority: int):
+        """Выполняет блокирующий вызов vk_api через автомат отключения и пул"""
+        async def run():
+            with tracer.span(f"vk.{method}"), VK_REQUEST_LATENCY.time(method=method):
+                return await self.executor.run(func, priority=priority)
+        
+        return await self.breaker.call(run)
+    
+    async def search_audio(self, query: str, page: int = 0, priority: int = PRIORITY_INTERACTIVE) -> List[Dict]:
+        """Поиск аудио в VK с использованием кэша.
+        
+        Результаты запрашиваются пачками по SEARCH_BATCH_SIZE, page - номер
+        пачки. Если VK недоступен, отдает устаревшие результаты из кэша,
+        а без них вызывает ServiceUnavailableError.
+        """
+        try:
+            return await self.search_cache.get_or_fetch(
+                query,
+                page,
+                lambda: self._search_audio(query, page, priority)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка поиска аудио: {e}")
+            
+            results = await self.search_cache.get_stale(query, page)
+            if results is not None:
+                logger.info(f"VK недоступен, отдаю устаревшие результаты: {query}")
+                return results
+            
+            if isinstance(e, ServiceUnavailableError):
+                raise
+            raise ServiceUnavailableError(f"Ошибка поиска в VK: {e}") from e
+    
+    async def _search_audio(self, query: str, page: int, priority: int) -> List[Dict]:
+        """Поиск аудио напрямую в VK"""
+        # VK API работает синхронно, поэтому выполняем в отдельном пуле
+        results = await self._call(
+            "search",
+            lambda: list(self.vk_audio.search(
+                query, 
+                count=self.config.SEARCH_BATCH_SIZE,
+                offset=page * self.config.SEARCH_BATCH_SIZE
+            )),
+            priority
+        )
+        
+        processed_results = []
+        for track in results:
+            processed_track = {
+                'id': f"{track['owner_id']}_{track['id']}",
+                'title': track['title'],
+                'artist': track['artist'],
+                'duration': track.get('duration', 0),
+                'url': track['url'],
+                'thumb_url': self._cover_url(track)
+            }
+            processed_results.append(processed_track)
+        
+        return processed_results
+    
+    async def create_search_session(self, query: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
+        """Ищет треки одной пачкой и сохраняет их в сессию поиска.
+        
+        Возвращает сессию с ключами id, query и results или None,
+        если ничего не найдено.
+        """
+        results = await self.search_audio(query, page=0, priority=priority)
+        if not results:
+            return None
+        
+        session_id = await self.search_sessions.create(query, results)
+        return {'id': session_id, 'query': query, 'results': results}
+    
+    async def get_search_session(self, session_id: str) -> Optional[Dict]:
+        """Сессия поиска по ID или None, если она устарела"""
+        return await self.search_sessions.get(session_id)
+    
+    async def get_track_by_id(self, track_id: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
+        """Получение трека по ID.
+        
+        Возвращает None, только если трека нет. Если VK не ответил,
+        вызывает ServiceUnavailableError.
+        """
+        try:
+            owner_id, audio_id = map(int, track_id.split('_'))
+        except ValueError:
+            logger.warning(f"Некорректный ID трека: {track_id}")
+            return None
+        
+        try:
+            track = await self._call(
+                "get_by_id",
+                lambda: self.vk_audio.get_audio_by_id(owner_id, audio_id),
+                priority
+            )
+            
+            if track:
+                return {
+                    'id': track_id,
+                    'title': track['title'],
+                    'artist': track['artist'],
+                    'duration': track.get('duration', 0),
+                    'url': track['url'],
+                    'thumb_url': self._cover_url(track)
+                }
+            
+            return None
+        
+        except ServiceUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка получения трека: {e}")
+            raise ServiceUnavailableError(f"Ошибка получения трека из VK: {e}") from e
+    
+    async def get_tracks_by_ids(self, track_ids: List[str], priority: int = PRIORITY_BACKGROUND) -> Dict[str, Dict]:
+        """Пакетное получение треков по ID.
+        
+        Хэши треков собираются отдельными запросами, а ссылки на аудио
+        запрашиваются у VK пачками по 10 вместо запроса на каждый трек.
+        Ненайденных треков нет в результате, а если VK не ответил,
+        вызывается ServiceUnavailableError.
+        """
+        if not track_ids:
+            return {}
+        
+        try:
+            scraped = await asyncio.gather(
+                *(
+                    self._call(
+                        "scrap_ids",
+                        lambda track_id=track_id: self._scrap_track_ids(track_id),
+                        priority
+                    )
+                    for track_id in track_ids
+                ),
+                return_exceptions=True
+            )
+            
+            full_ids = []
+            for track_id, result in zip(track_ids, scraped):
+                if isinstance(result, Exception):
+                    logger.warning(f"Не удалось получить хэши трека {track_id}: {result}")
+                    continue
+                full_ids.extend(result)
+            
+            if not full_ids:
+                # Все запросы завершились ошибкой: VK недоступен, а не треки пропали
+                for result in scraped:
+                    if isinstance(result, Exception):
+                        raise result
+                return {}
+            
+            # scrap_tracks сам делит ID на пачки по 10 и соблюдает паузы VK
+            results = await self._call(
+                "scrap_tracks",
+                lambda: list(audio.scrap_tracks(
+                    full_ids,
+                    self.vk_audio.user_id,
+                    http=self.session.http,
+                    convert_m3u8_links=self.vk_audio.convert_m3u8_links
+                )),
+                priority
+            )
+            
+            tracks = {}
+            for track in results:
+                processed_track = {
+                    'id': f"{track['owner_id']}_{track['id']}",
+                    'title': track['title'],
+                    'artist': track['artist'],
+                    'duration': track.get('duration', 0),
+                    'url': track['url'],
+                    'thumb_url': self._cover_url(track)
+                }
+                tracks[processed_track['id']] = processed_track
+            
+            return tracks
+        
+        except ServiceUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка пакетного получения треков: {e}")
+            raise ServiceUnavailableError(f"Ошибка получения треков из VK: {e}") from e
+    
+    def _scrap_track_ids(self, track_id: str) -> List[tuple]:
+        """Получение полного ID трека с хэшами со страницы аудиозаписи"""
+        owner_id, audio_id = track_id.split('_')
+        response = self.session.http.get(
+            f"https://m.vk.com/audio{owner_id}_{audio_id}",
+            allow_redirects=False
+        )
+        return audio.scrap_ids_from_html(
+            response.text,
+            filter_root_el={'class': 'basisDefault'}
+        )
+    
+    async def download_audio(self, url: str, max_size: Optional[int] = None) -> BinaryIO:
+        """Потоковое скачивание аудио файла во временный файл.
+        
+        Небольшие файлы остаются в памяти, крупные переносятся на диск.
+        Скачивание прерывается, как только размер превышает max_size
+        (по умолчанию MAX_DOWNLOAD_SIZE).
+        """
+        max_size = max_size or self.config.MAX_DOWNLOAD_SIZE
+        audio_file = tempfile.SpooledTemporaryFile(
+            max_size=self.config.DOWNLOAD_SPOOL_SIZE
+        )
+        
+        started = time.monotonic()
+        try:
+            with tracer.span("vk.download_audio") as span:
+                async with self._http_session.get(url) as response:
+                    if response.status != 200:
+                        raise Exception(f"HTTP {response.status}")
+                    
+                    if response.content_length and response.content_length > max_size:
+                        raise DownloadTooLargeError(
+                            f"Размер файла {response.content_length} больше {max_size}"
+                        )
+                    
+                    downloaded = 0
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        downloaded += len(chunk)
+                        if downloaded > max_size:
+                            raise DownloadTooLargeError(
+                                f"Скачано больше {max_size} байт"
+                            )
+                        audio_file.write(chunk)
+                
+                span.set_attribute('bytes', downloaded)
+            
+            elapsed = time.monotonic() - started
+            DOWNLOAD_BYTES.inc(downloaded)
+            if elapsed > 0:
+                DOWNLOAD_THROUGHPUT.observe(downloaded / elapsed)
+            
+            audio_file.seek(0)
+            return audio_file
+        
+        except asyncio.CancelledError:
+            # Таймаут этапа или отмена: файл больше никому не понадобится
+            audio_file.close()
+            raise
+        except Exception as e:
+            audio_file.close()
+            logger.error(f"Ошибка скачивания аудио: {e}")
+            raise
+    
+    @staticmethod
+    def _cover_url(track: Dict) -> Optional[str]:
+        """Ссылка на самую крупную обложку трека.
+        
+        vk_api отдает обложки списком от меньшей к большей в track_covers.
+        """
+        covers = track.get('track_covers') or []
+        return covers[-1] if covers else None
+    
+    async def download_cover(self, url: str) -> Optional[io.BytesIO]:
+        """Скачивание обложки"""
+        try:
+            with tracer.span("vk.download_cover"):
+                async with self._http_session.get(url) as response:
+                    if response.status == 200:
+                        content = await response.read()
+                        return io.BytesIO(content)
+                    return None
+        
+        except Exception as e:
+            logger.error(f"Ошибка скачивания обложки: {e}")
+            return None
+    
+    async def close(self):
+        """Закрытие соединений"""
+        if self._http_session:
+            await self._http_session.close()
+        
+        if self.executor:
+            await self.executor.shutdown()
@@ -0,0 +1,122 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from config import Config
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Сколько ждать завершения обработки обновлений при остановке
+SHUTDOWN_TIMEOUT = 30
+
+class WebhookServer:
+    """Встроенный aiohttp сервер для приема обновлений через webhook"""
+    
+    def __init__(
+        self,
+        dp: Dispatcher,
+        config: Config,
+        on_startup: Callable[[Dispatcher], Awaitable[None]],
+        on_shutdown: Callable[[Dispatcher], Awaitable[None]],
+        forward: Optional[Callable[[Dict], Awaitable[None]]] = None
+    ):
+        """forward - передача обновлений в рабочие процессы вместо обработки на месте"""
+        self.dp = dp
+        self.config = config
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self.forward = forward
+        self._semaphore = asyncio.Semaphore(config.WEBHOOK_MAX_CONCURRENCY)
+        self._tasks = set()
+        
+        self.app = web.Application()
+        self.app.router.add_get("/", self.handle_health)
+        self.app.router.add_post(config.WEBHOOK_PATH, self.handle_update)
+        self.app.on_startup.append(self._on_startup)
+        self.app.on_shutdown.append(self._on_shutdown)
+    
+    async def _on_startup(self, app: web.Application):
+        """Запуск бота и регистрация webhook в Telegram"""
+        await self.on_startup(self.dp)
+        
+        webhook_url = self.config.WEBHOOK_URL.rstrip("/") + self.config.WEBHOOK_PATH
+        await self.dp.bot.set_webhook(
+            webhook_url,
+            max_connections=self.config.WEBHOOK_MAX_CONCURRENCY,
+            secret_token=self.config.WEBHOOK_SECRET or None
+        )
+        logger.info(f"Webhook установлен: {webhook_url}")
+    
+    async def _on_shutdown(self, app: web.Application):
+        """Дожидается обработки принятых обновлений и останавливает бота"""
+        if self._tasks:
+            logger.info(f"Ожидаю обработки {len(self._tasks)} обновлений...")
+            await asyncio.wait(self._tasks, timeout=SHUTDOWN_TIMEOUT)
+        
+        # Webhook не удаляем: Telegram накопит обновления до следующего запуска
+        await self.on_shutdown(self.dp)
+        
+        session = await self.dp.bot.get_session()
+        await session.close()
+    
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Проверка работоспособности для платформы деплоя"""
+        return web.json_response({
+            'status': 'ok',
+            'updates_in_progress': len(self._tasks)
+        })
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Прием обновления от Telegram"""
+        if self.config.WEBHOOK_SECRET:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            if token != self.config.WEBHOOK_SECRET:
+                return web.Response(status=401)
+        
+        try:
+            data = await request.json()
+            update = types.Update(**data)
+        except Exception as e:
+            logger.error(f"Некорректное обновление: {e}")
+            return web.Response(status=400)
+        
+        if self.forward:
+            await self.forward(data)
+            return web.Response(text="ok")
+        
+        # При достижении лимита Telegram ждет ответа и не шлет новые обновления
+        await self._semaphore.acquire()
+        
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        
+        task = asyncio.create_task(self._process_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        
+        return web.Response(text="ok")
+    
+    async def _process_update(self, update: types.Update):
+        """Обработка обновления в фоне"""
+        try:
+            # Через process_updates, чтобы сработали middleware уровня обновления
+            await self.dp.process_updates([update])
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self._semaphore.release()
+    
+    def run(self):
+        """Запускает сервер и блокирует поток до остановки"""
+        logger.info(
+            f"Запуск webhook сервера на {self.config.WEBAPP_HOST}:{self.config.WEBAPP_PORT}"
+        )
+        web.run_app(
+            self.app,
+            host=self.config.WEBAPP_HOST,
+            port=self.config.WEBAPP_PORT,
+            print=None
+        )
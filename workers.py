@@ -0,0 +1,259 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, types
+
+from config import Config
+from utils.logger import setup_logger, configure_logging
+from utils.storage import SQLiteStorage
+from utils.outbound import ScheduledBot
+
+logger = setup_logger(__name__)
+
+# Таймаут long polling в супервизоре
+POLLING_TIMEOUT = 20
+
+# Интервал между входами в VK, если супервизор не смог войти сам
+VK_LOGIN_STAGGER = 5  # секунд
+
+def get_update_user_id(data: Dict) -> int:
+    """Возвращает ID пользователя, от которого пришло обновление"""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if user:
+                return user['id']
+            chat = value.get('chat')
+            if chat:
+                return chat['id']
+    return data.get('update_id', 0)
+
+class Supervisor:
+    """Принимает обновления и распределяет их по рабочим процессам.
+    
+    Все обновления одного пользователя попадают в один процесс, поэтому
+    его состояние FSM и порядок сообщений остаются в одном месте.
+    Команды бота и вход в VK выполняются здесь один раз, а не в каждом
+    рабочем процессе.
+    """
+    
+    def __init__(self, config: Config, set_commands: Callable[[Bot], Awaitable[None]]):
+        self.config = config
+        self._set_commands = set_commands
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._vk_credentials: Optional[Dict[str, Any]] = None
+    
+    async def prepare(self, bot: Bot):
+        """Устанавливает команды бота и входит в VK до запуска процессов"""
+        from vk_client import login as vk_login
+        
+        try:
+            await self._set_commands(bot)
+        except Exception as e:
+            logger.error(f"Ошибка установки команд бота: {e}")
+        
+        # Авторизация может ждать captcha или 2FA, поэтому в отдельном потоке
+        try:
+            self._vk_credentials = await asyncio.get_running_loop().run_in_executor(
+                None, vk_login, self.config
+            )
+            logger.info("Вход в VK выполнен")
+        except Exception as e:
+            self._vk_credentials = None
+            logger.error(f"Ошибка входа в VK, процессы войдут сами: {e}")
+    
+    def start_workers(self):
+        """Запускает рабочие процессы"""
+        for index in range(self.config.WORKERS):
+            queue = self._context.Queue(maxsize=self.config.WORKER_QUEUE_SIZE)
+            process = self._context.Process(
+                target=worker_main,
+                args=(index, queue, self._vk_credentials),
+                name=f"bot-worker-{index}",
+                # Не демон: рабочему процессу нужен свой пул обработки аудио
+                daemon=False
+            )
+            process.start()
+            self._queues.append(queue)
+            self._processes.append(process)
+        
+        logger.info(f"Запущено рабочих процессов: {self.config.WORKERS}")
+    
+    def stop_workers(self):
+        """Останавливает рабочие процессы после обработки их очередей"""
+        for queue in self._queues:
+            queue.put(None)
+        
+        for process in self._processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не завершился, останавливаю")
+                process.terminate()
+        
+        self._queues = []
+        self._processes = []
+        logger.info("Рабочие процессы остановлены")
+    
+    async def dispatch(self, data: Dict):
+        """Передает обновление процессу, закрепленному за пользователем"""
+        index = get_update_user_id(data) % len(self._queues)
+        queue = self._queues[index]
+        
+        # Если очередь процесса заполнена, ждем в отдельном потоке
+        await asyncio.get_running_loop().run_in_executor(None, queue.put, data)
+    
+    async def _on_startup(self, dp: Dispatcher):
+        await self.prepare(dp.bot)
+        self.start_workers()
+    
+    async def _on_shutdown(self, dp: Dispatcher):
+        await asyncio.get_running_loop().run_in_executor(None, self.stop_workers)
+    
+    def run(self):
+        """Запускает прием обновлений через webhook или polling"""
+        if self.config.WEBHOOK_URL:
+            from webhook import WebhookServer
+            
+            bot = Bot(token=self.config.BOT_TOKEN)
+            dp = Dispatcher(bot)
+            WebhookServer(
+                dp,
+                self.config,
+                self._on_startup,
+                self._on_shutdown,
+                forward=self.dispatch
+            ).run()
+        else:
+            asyncio.run(self._run_polling())
+    
+    async def _run_polling(self):
+        """Получает обновления через long polling и распределяет их"""
+        bot = Bot(token=self.config.BOT_TOKEN)
+        stop_event = asyncio.Event()
+        
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        
+        # Как и в обычном режиме, пропускаем накопившиеся обновления
+        await bot.delete_webhook(drop_pending_updates=True)
+        await self.prepare(bot)
+        self.start_workers()
+        
+        offset: Optional[int] = None
+        try:
+            while not stop_event.is_set():
+                get_updates = asyncio.create_task(
+                    bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT)
+                )
+                stop_wait = asyncio.create_task(stop_event.wait())
+                await asyncio.wait({get_updates, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                stop_wait.cancel()
+                
+                if not get_updates.done():
+                    get_updates.cancel()
+                    break
+                
+                try:
+                    updates = get_updates.result()
+                except Exception as e:
+                    logger.error(f"Ошибка получения обновлений: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.dispatch(update.to_python())
+        finally:
+            await loop.run_in_executor(None, self.stop_workers)
+            session = await bot.get_session()
+            await session.close()
+
+def worker_main(index: int, queue: multiprocessing.Queue, vk_credentials: Optional[Dict[str, Any]]):
+    """Точка входа рабочего процесса"""
+    # Остановкой управляет супервизор через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    
+    # Каждый процесс отдает метрики на своем порту
+    metrics_port = int(os.getenv("METRICS_PORT", str(Config.METRICS_PORT)))
+    if metrics_port:
+        os.environ["METRICS_PORT"] = str(metrics_port + 1 + index)
+    
+    asyncio.run(_run_worker(index, queue, vk_credentials))
+
+async def _run_worker(index: int, queue: multiprocessing.Queue, vk_credentials: Optional[Dict[str, Any]]):
+    """Обрабатывает обновления из очереди процесса"""
+    import bot as bot_module
+    
+    config = Config()
+    
+    # Ротация файла из нескольких процессов небезопасна, у каждого свой файл
+    log_file = Path(config.LOG_FILE)
+    config.LOG_FILE = str(log_file.with_name(f"{log_file.stem}-worker-{index}{log_file.suffix}"))
+    configure_logging(config)
+    
+    bot = ScheduledBot(token=config.BOT_TOKEN, parse_mode=types.ParseMode.HTML)
+    # Пользователь закреплен за процессом, поэтому кэшу состояний можно доверять
+    storage = SQLiteStorage(
+        ttl=config.FSM_TTL,
+        cache_ttl=config.FSM_TTL,
+        flush_interval=config.FSM_FLUSH_INTERVAL
+    )
+    dp = Dispatcher(bot, storage=storage)
+    bot_module.register_handlers(dp)
+    
+    Dispatcher.set_current(dp)
+    Bot.set_current(bot)
+    
+    # Без сессии супервизора процессы входят в VK по очереди
+    if vk_credentials is None:
+        await asyncio.sleep(index * VK_LOGIN_STAGGER)
+    await bot_module.init_services(vk_credentials)
+    
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(config.WORKER_CONCURRENCY)
+    # Блокировка пользователя и число его обновлений в обработке
+    user_locks: Dict[int, list] = {}
+    tasks = set()
+    
+    async def process(data: Dict):
+        user_id = get_update_user_id(data)
+        entry = user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # Обновления одного пользователя обрабатываются по порядку
+            async with entry[0]:
+                await dp.process_updates([types.Update(**data)])
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления в процессе {index}: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del user_locks[user_id]
+            semaphore.release()
+    
+    logger.info(f"Рабочий процесс {index} запущен")
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            
+            await semaphore.acquire()
+            task = asyncio.create_task(process(data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.wait(tasks)
+        await bot_module.on_shutdown(dp)
+        session = await bot.get_session()
+        await session.close()
+        logger.info(f"Рабочий процесс {index} остановлен")